@@ -0,0 +1,226 @@
+"""Headless batch processing of many pulsars.
+
+This runs the same load -> fit -> summary pipeline as the plk widget, but
+without any GUI, for a list of par/tim pairs. Every pulsar is processed in
+its own worker process, and the results (post-fit parfile, timfile, fit
+summary and a residual plot) are written to an output directory.
+
+Nothing in here may import Qt: the worker processes should run on machines
+without a display.
+"""
+import concurrent.futures
+import contextlib
+import io
+import os
+
+import astropy.units as u
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import pint.logging
+from loguru import logger as log
+
+from pylk.pulsar import Pulsar
+
+
+def read_batch_file(filename):
+    """Read a list of par/tim pairs
+
+    Every line holds a parfile and a timfile name, separated by whitespace.
+    Empty lines and lines starting with # are skipped. Relative file names
+    are relative to the directory of the batch file.
+
+    :param filename:    The batch file
+    :return:            List of (parfile, timfile) tuples
+    """
+    basedir = os.path.dirname(os.path.abspath(filename))
+    pairs = []
+    with open(filename) as fp:
+        for lineno, line in enumerate(fp, start=1):
+            words = line.split()
+            if not words or words[0].startswith("#"):
+                continue
+            if len(words) != 2:
+                raise ValueError(f"{filename}:{lineno}: expected a parfile and a timfile")
+            pairs.append(tuple(os.path.join(basedir, word) for word in words))
+    return pairs
+
+
+def _basename(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def output_names(pairs):
+    """Return a unique output name for every par/tim pair
+
+    The name is that of the parfile. Pairs that share a parfile name get the
+    timfile name appended, and if that is not unique either, their position
+    in the list.
+
+    :param pairs:       List of (parfile, timfile) tuples
+    :return:            List of names, in the order of pairs
+    """
+    names = [_basename(par) for par, tim in pairs]
+    names = [
+        f"{name}_{_basename(tim)}" if names.count(name) > 1 else name
+        for name, (par, tim) in zip(names, pairs)
+    ]
+    return [
+        f"{name}_{index}" if names.count(name) > 1 else name
+        for index, name in enumerate(names)
+    ]
+
+
+def plot_residuals(psr, filename):
+    """Save a plot of the (post-fit, if available) residuals vs MJD"""
+    resids = psr.postfit_resids if psr.fitted else psr.prefit_resids
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.errorbar(
+        psr.all_toas.get_mjds().value,
+        resids.time_resids.to_value(u.us),
+        yerr=psr.all_toas.get_errors().to_value(u.us),
+        fmt=".",
+    )
+    ax.set_xlabel("MJD")
+    ax.set_ylabel(f"{'Post' if psr.fitted else 'Pre'}-fit residual (us)")
+    ax.set_title(psr.name)
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(filename)
+
+
+def process_pulsar(
+    parfile,
+    timfile,
+    outdir,
+    ephem=None,
+    fitter="auto",
+    iters=4,
+    usecache=True,
+    plot=True,
+    name=None,
+):
+    """Load, fit, and export one pulsar
+
+    The output files are <name>.fit.par, <name>.fit.tim, <name>.summary.txt
+    and <name>.png
+
+    :param parfile:     The parfile name
+    :param timfile:     The timfile name
+    :param outdir:      Directory for the output files
+    :param ephem:       Ephemeris to use (None = from the parfile)
+    :param fitter:      The fitter (as for Pulsar)
+    :param iters:       Number of fit iterations
+    :param usecache:    Use the on-disk session cache
+    :param plot:        Save a residual plot
+    :param name:        Name of the output files (None = that of the parfile)
+    :return:            Dictionary with the results. On failure, "error"
+                        holds the error message
+    """
+    name = _basename(parfile) if name is None else name
+    result = {"name": name, "parfile": parfile, "timfile": timfile, "error": None}
+    summary = io.StringIO()
+    try:
+        # Pulsar and the fitter print their summaries to stdout
+        with contextlib.redirect_stdout(summary):
+            psr = Pulsar(parfile, timfile, ephem=ephem, fitter=fitter, usecache=usecache)
+            psr.fit(np.zeros(psr.all_toas.ntoas, dtype=bool), iters=iters)
+
+        base = os.path.join(outdir, name)
+        with open(f"{base}.summary.txt", "w") as fp:
+            fp.write(summary.getvalue())
+        with open(f"{base}.fit.par", "w") as fp:
+            fp.write(psr.postfit_model.as_parfile())
+        # Don't save the model-specific jump flags
+        for flags in psr.all_toas.table["flags"]:
+            flags.pop("jump", None)
+        psr.all_toas.write_TOA_file(f"{base}.fit.tim", format="tempo2")
+        if plot:
+            plot_residuals(psr, f"{base}.png")
+
+        resids = psr.selected_postfit_resids
+        result.update(
+            psr=psr.name,
+            ntoas=psr.all_toas.ntoas,
+            chi2=float(resids.chi2),
+            reduced_chi2=float(resids.reduced_chi2),
+            wrms=float(resids.rms_weighted().to_value(u.us)),
+        )
+    except Exception as e:
+        log.error(f"Processing {parfile} / {timfile} failed: {e}")
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_batch(pairs, outdir, workers=None, loglevel=None, **kwargs):
+    """Process many pulsars in a pool of worker processes
+
+    :param pairs:       List of (parfile, timfile) tuples
+    :param outdir:      Directory for the output files
+    :param workers:     Number of worker processes (None = number of CPUs).
+                        With one worker, everything runs in this process
+    :param loglevel:    Logging level of the workers
+    :param kwargs:      Passed on to process_pulsar
+    :return:            List of result dictionaries, in the order of pairs.
+                        The output files of every pair are named after
+                        output_names, so that no pair overwrites another
+    """
+    os.makedirs(outdir, exist_ok=True)
+    names = output_names(pairs)
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(pairs)))
+    log.info(f"Processing {len(pairs)} pulsars with {workers} worker(s)")
+
+    if workers == 1:
+        return [
+            process_pulsar(par, tim, outdir, name=name, **kwargs)
+            for (par, tim), name in zip(pairs, names)
+        ]
+
+    initargs = () if loglevel is None else (loglevel,)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=pint.logging.setup, initargs=initargs
+    ) as pool:
+        futures = [
+            pool.submit(process_pulsar, par, tim, outdir, name=name, **kwargs)
+            for (par, tim), name in zip(pairs, names)
+        ]
+        results = []
+        for future, (par, tim), name in zip(futures, pairs, names):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # The worker itself died (e.g. out of memory)
+                log.error(f"Worker for {par} / {tim} failed: {e}")
+                results.append(
+                    {
+                        "name": name,
+                        "parfile": par,
+                        "timfile": tim,
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                )
+    return results
+
+
+def print_batch_summary(results):
+    """Print a table with the fit results of run_batch"""
+    print("%-24s %8s %14s %14s %12s" % ("Pulsar", "NTOA", "Chi2", "Reduced-Chi2", "WRMS (us)"))
+    print("-" * 76)
+    for result in results:
+        if result["error"] is not None:
+            print("%-24s FAILED: %s" % (result["name"], result["error"]))
+        else:
+            print(
+                "%-24s %8d %14.8g %14.8g %12.6g"
+                % (
+                    result["name"],
+                    result["ntoas"],
+                    result["chi2"],
+                    result["reduced_chi2"],
+                    result["wrms"],
+                )
+            )
@@ -29,17 +29,51 @@ named_colors = [
 
 
 class ColorMode:
-    """Base Class for color modes."""
+    """Base Class for color modes.
+
+    A color mode does not draw anything itself: it describes which TOAs get
+    which color, and the plk widget renders that.
+
+    The colors come as one index per TOA into a list of colors, which the
+    renderers turn into per-TOA colors with a single lookup. Modes whose
+    colors only depend on the TOAs themselves (and not on e.g. the jumps)
+    cache that index, and only compute it again when the TOAs change.
+    """
+
+    selected_color = "orange"
 
     def __init__(self, application):
         self.application = application  # PLKWidget for pintk
+        self._cache = None  # (TOA table, (index, colors))
 
     def displayInfo(self):
         raise NotImplementedError
 
-    def plotColorMode(self):
+    def colorIndex(self):
+        """
+        Return the colors of the TOAs
+
+        :return:    (index, colors): colors is a list of colors, and index[i]
+                    is the position in colors of the color of TOA i, or -1 if
+                    TOA i is not shown. The selected TOAs are drawn on top in
+                    `selected_color`
+        """
         raise NotImplementedError
 
+    def cachedColorIndex(self, compute):
+        """
+        Return compute(toas), for the TOAs of the pulsar
+
+        The result is cached until the TOAs change. Deleting, stashing or
+        reloading TOAs replaces the TOA table, so the table identifies them.
+
+        :param compute: Function that returns (index, colors) for TOAs
+        """
+        toas = self.application.psr.all_toas
+        if self._cache is None or self._cache[0] is not toas.table:
+            self._cache = (toas.table, compute(toas))
+        return self._cache[1]
+
 
 class DefaultMode(ColorMode):
     """
@@ -62,33 +96,14 @@ class DefaultMode(ColorMode):
             + "  Magenta = jumped TOAs\n"
         )
 
-    def plotColorMode(self):
+    selected_color = "xkcd:burnt orange"
+
+    def colorIndex(self):
         """
-        Plots application's residuals in proper color scheme.
+        Color all TOAs cyan, and the jumped TOAs magenta
         """
-        if self.application.yerrs is None:
-            self.application.plkAxes.scatter(
-                self.application.xvals[~self.application.selected],
-                self.application.yvals[~self.application.selected],
-                marker=".",
-                color="xkcd:cyan",
-            )
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.jumped],
-                self.application.yvals[self.application.jumped],
-                marker=".",
-                color="xkcd:magenta",
-            )
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.selected],
-                self.application.yvals[self.application.selected],
-                marker=".",
-                color="xkcd:burnt orange",
-            )
-        else:
-            self.application.plotErrorbar(~self.application.selected, color="xkcd:cyan")
-            self.application.plotErrorbar(self.application.jumped, color="xkcd:burnt orange")
-            self.application.plotErrorbar(self.application.selected, color="xkcd:magenta")
+        index = np.asarray(self.application.jumped, dtype=int)
+        return index, ["xkcd:cyan", "xkcd:magenta"]
 
 
 class FreqMode(ColorMode):
@@ -116,64 +131,33 @@ class FreqMode(ColorMode):
             + "  Brown is for selected TOAs\n"
         )
 
-    def plotColorMode(self):
+    selected_color = "#362511"  # brown
+
+    freq_colors = [
+        "xkcd:dark red",  # dark red
+        "xkcd:red",  # red
+        "xkcd:orange",  # orange
+        "xkcd:yellow",  # yellow
+        "xkcd:green",  # green
+        "xkcd:blue",  # blue
+        "xkcd:indigo",  # indigo
+        "xkcd:black",  # black
+        "xkcd:grey",  # grey
+    ]
+    highfreqs = [300.0, 400.0, 500.0, 700.0, 1000.0, 1800.0, 3000.0, 8000.0]
+
+    def colorIndex(self):
         """
-        Plots application's residuals in proper color scheme.
+        Color the TOAs according to their frequency band
         """
+        return self.cachedColorIndex(self._freqIndex)
 
-        colorGroups = [
-            "xkcd:dark red",  # dark red
-            "xkcd:red",  # red
-            "xkcd:orange",  # orange
-            "xkcd:yellow",  # yellow
-            "xkcd:green",  # green
-            "xkcd:blue",  # blue
-            "xkcd:indigo",  # indigo
-            "xkcd:black",  # black
-            "xkcd:grey",  # grey
-        ]
-        highfreqs = [300.0, 400.0, 500.0, 700.0, 1000.0, 1800.0, 3000.0, 8000.0]
-
-        freqGroups = []
-        for ii, highfreq in enumerate(highfreqs):
-            if ii == 0:
-                freqGroups.append(
-                    self.application.psr.all_toas.get_freqs().value < highfreq
-                )
-            else:
-                freqGroups.append(
-                    (self.application.psr.all_toas.get_freqs().value < highfreq)
-                    & (
-                        self.application.psr.all_toas.get_freqs().value
-                        >= highfreqs[ii - 1]
-                    )
-                )
-        freqGroups.append(
-            self.application.psr.all_toas.get_freqs().value >= highfreqs[-1]
-        )
-
-        for index in range(len(freqGroups)):
-            if self.application.yerrs is None:
-                self.application.plkAxes.scatter(
-                    self.application.xvals[freqGroups[index]],
-                    self.application.yvals[freqGroups[index]],
-                    marker=".",
-                    color=colorGroups[index],
-                )
-            else:
-                self.application.plotErrorbar(
-                    freqGroups[index], color=colorGroups[index]
-                )
-        # The following is for selected TOAs
-        if self.application.yerrs is None:
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.selected],
-                self.application.yvals[self.application.selected],
-                marker=".",
-                color="#362511",  # brown
-            )
-        else:
-            self.application.plotErrorbar(self.application.selected, color="#362511")
+    def _freqIndex(self, toas):
+        freqs = toas.get_freqs().value
+        # Band ii holds highfreqs[ii-1] <= freq < highfreqs[ii]
+        index = np.digitize(freqs, self.highfreqs)
+        index[np.isnan(freqs)] = -1
+        return index, self.freq_colors
 
 
 class NameMode(ColorMode):
@@ -189,51 +173,19 @@ class NameMode(ColorMode):
     def displayInfo(self):
         print('"Name" mode selected\n' + "  Orange = selected TOAs\n")
 
-    def plotColorMode(self):
+    def colorIndex(self):
         """
-        Plots application's residuals in proper color scheme.
+        Color the TOAs according to their name flag
         """
+        return self.cachedColorIndex(self._nameIndex)
 
-        all_names = np.array(
-            [f["name"] for f in self.application.psr.all_toas.get_flags()]
-        )
-        single_names = list(set(all_names))
+    def _nameIndex(self, toas):
+        all_names = np.array([f["name"] for f in toas.get_flags()])
+        single_names, index = np.unique(all_names, return_inverse=True)
         N = len(single_names)
         cmap = matplotlib.cm.get_cmap("brg")
-        colorGroups = [matplotlib.colors.rgb2hex(cmap(v)) for v in np.linspace(0, 1, N)]
-        colorGroups += ["orange"]
-
-        freqGroups = []
-        index = 0
-        for name in single_names:
-            index += 1
-            freqGroups.append(all_names == name)
-            index += 1
-
-        for index in range(N):
-            if self.application.yerrs is None:
-                self.application.plkAxes.scatter(
-                    self.application.xvals[freqGroups[index]],
-                    self.application.yvals[freqGroups[index]],
-                    marker=".",
-                    color=colorGroups[index],
-                )
-            else:
-                self.application.plotErrorbar(
-                    freqGroups[index], color=colorGroups[index]
-                )
-
-        if self.application.yerrs is None:
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.selected],
-                self.application.yvals[self.application.selected],
-                marker=".",
-                color=colorGroups[N],
-            )
-        else:
-            self.application.plotErrorbar(
-                self.application.selected, color=colorGroups[N]
-            )
+        colors = [matplotlib.colors.rgb2hex(cmap(v)) for v in np.linspace(0, 1, N)]
+        return index, colors
 
 
 class ObsMode(ColorMode):
@@ -311,37 +263,17 @@ class ObsMode(ColorMode):
         outstr += f"  {self.selected_color.capitalize()} = selected\n"
         print(outstr)
 
-    def plotColorMode(self):
+    def colorIndex(self):
         """
-        Plots application's residuals in proper color scheme.
+        Color the TOAs according to their observatory
         """
+        return self.cachedColorIndex(self._obsIndex)
+
+    def _obsIndex(self, toas):
         obsmap = self.get_obs_mapping()
-        alltoas = self.application.psr.all_toas
-        for obs, ourobs in obsmap.items():
-            # group toa indices by observatory
-            toas = alltoas.get_obss() == obs
-            color = self.obs_colors[ourobs]
-            if self.application.yerrs is None:
-                self.application.plkAxes.scatter(
-                    self.application.xvals[toas],
-                    self.application.yvals[toas],
-                    marker=".",
-                    color=color,
-                )
-            else:
-                self.application.plotErrorbar(toas, color=color)
-        # Now handle the selected TOAs
-        if self.application.yerrs is None:
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.selected],
-                self.application.yvals[self.application.selected],
-                marker=".",
-                color=self.selected_color,
-            )
-        else:
-            self.application.plotErrorbar(
-                self.application.selected, color=self.selected_color
-            )
+        single_obss, index = np.unique(toas.get_obss(), return_inverse=True)
+        colors = [self.obs_colors[obsmap.get(obs, "other")] for obs in single_obss]
+        return index, colors
 
 
 class JumpMode(ColorMode):
@@ -388,32 +320,16 @@ class JumpMode(ColorMode):
         )
         print(outstr)
 
-    def plotColorMode(self):
-        """Plot the points with the desired coloring"""
+    def colorIndex(self):
+        """Color the TOAs according to their jump (unjumped TOAs are not shown)
+
+        Not cached: the jumps change without the TOAs changing. A TOA with more
+        than one jump gets the color of the last one.
+        """
         alltoas = self.application.psr.all_toas
+        index = np.full(alltoas.ntoas, -1)
+        # only use the number of colors - 1 to preserve orange for selected
+        ncolors = len(self.jump_colors) - 1
         for jumpnum, jump in enumerate(self.get_jumps()):
-            color_number = jumpnum % (len(self.jump_colors) - 1)
-            color_name = self.jump_colors[color_number]
-            toas = jump.select_toa_mask(alltoas)
-            # group toa indices by jump
-            if self.application.yerrs is None:
-                self.application.plkAxes.scatter(
-                    self.application.xvals[toas],
-                    self.application.yvals[toas],
-                    marker=".",
-                    color=color_name,
-                )
-            else:
-                self.application.plotErrorbar(toas, color=color_name)
-        # Now handle the selected TOAs
-        if self.application.yerrs is None:
-            self.application.plkAxes.scatter(
-                self.application.xvals[self.application.selected],
-                self.application.yvals[self.application.selected],
-                marker=".",
-                color=self.selected_color,
-            )
-        else:
-            self.application.plotErrorbar(
-                self.application.selected, color=self.selected_color
-            )
+            index[jump.select_toa_mask(alltoas)] = jumpnum % ncolors
+        return index, self.jump_colors[:ncolors]
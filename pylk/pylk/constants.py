@@ -31,6 +31,8 @@ plk_figure_dpi = 100
 plk_figsize_inch = (5.0, 4.0)
 plk_figure_frame_lw = 2
 plk_figure_frame_mlw = 3
+plk_hud_interval_ms = 250  # Refresh interval of the redraw timing overlay
+plk_export_dpi = 300  # Resolution of exported figures
 
 mpl_console_style = 'dark_background'
 mpl_canvas_style = 'dark_background'
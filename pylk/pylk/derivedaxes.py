@@ -0,0 +1,64 @@
+"""Cache of derived per-TOA plot axes.
+
+Some of the plot axes in the plk widget are not simply columns of the TOA
+table: the decimal year and day of year need astropy Time conversions, and
+the orbital phase needs the binary model. Those used to be recomputed on
+every redraw, even for a selection click that changed no data at all.
+
+A DerivedAxes object keeps the computed values per axis, keyed by the TOA
+`index` column, so that deleting or stashing TOAs only needs a lookup. Every
+axis also has a key (e.g. a fingerprint of the model parameters it depends
+on), and the values are recomputed only when the key changes, or when TOAs
+are requested that have not been seen before.
+"""
+import numpy as np
+
+
+class _Column:
+    """Values of one derived axis, for a set of TOAs identified by their index"""
+
+    def __init__(self, key, indices, values):
+        self.key = key
+        self.values = values
+        self.position = np.full(indices.max(initial=-1) + 1, -1, dtype=int)
+        self.position[indices] = np.arange(len(indices))
+
+    def lookup(self, indices):
+        """Return the positions of indices in values (-1 for missing ones)"""
+        pos = np.full(len(indices), -1, dtype=int)
+        known = indices < len(self.position)
+        pos[known] = self.position[indices[known]]
+        return pos
+
+
+class DerivedAxes:
+    """Per-TOA values of derived plot axes, computed once"""
+
+    def __init__(self):
+        self._columns = {}
+
+    def invalidate(self, name=None):
+        """Forget the values of axis name, or of all axes if None"""
+        if name is None:
+            self._columns.clear()
+        else:
+            self._columns.pop(name, None)
+
+    def get(self, name, toas, compute, key=None):
+        """Return the values of axis name for toas
+
+        :param name:    Name of the axis
+        :param toas:    The TOAs for which we need the values
+        :param compute: Function that computes the values for all of toas
+        :param key:     Anything else (hashable) that the values depend on
+        :return:        The values (usually a Quantity), one per TOA
+        """
+        indices = np.asarray(toas.table["index"], dtype=int)
+        column = self._columns.get(name, None)
+        if column is not None and column.key == key:
+            pos = column.lookup(indices)
+            if np.all(pos >= 0):
+                return column.values[pos]
+        values = compute(toas)
+        self._columns[name] = _Column(key, indices, values)
+        return values
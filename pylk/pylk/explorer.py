@@ -0,0 +1,232 @@
+"""Which parameter to fit next: F-tests of candidate parameters.
+
+The F-test of `Pulsar.fit` only compares a fit with the one before it, so
+finding out which parameter to add takes a fit per candidate, by hand. This
+module fits the model once with its current free parameters, and once more
+for every candidate parameter that is free in addition, in a pool of worker
+processes. The fits are done on copies of the model: the model of the
+pulsar is not changed.
+
+The candidates are the frozen parameters that are worth a try: the next
+spin, orbital frequency, and DM derivatives (which `Pulsar.add_model_params`
+adds), the jumps, and the parameters of the binary model.
+
+Nothing in here may import Qt, like in batch.
+"""
+import concurrent.futures
+import copy
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+import pint.fitter
+import pint.logging
+from pint.utils import FTest
+from loguru import logger as log
+
+
+# Kinds of candidate parameters
+kind_derivative = "derivative"
+kind_jump = "jump"
+kind_binary = "binary"
+kind_other = "other"
+
+_derivative = re.compile(r"^(F|FB|DM)\d+$")
+
+# What the worker processes fit, set by _init_worker
+_worker = {}
+
+
+def candidate_params(model, exclude=()):
+    """
+    Return the frozen parameters of model that are candidates to fit
+
+    :param model:   The timing model
+    :param exclude: Names of parameters that are never candidates
+    :return:        List of (name, kind) tuples
+    """
+    binary = set()
+    for component in model.components.values():
+        if component.category == "pulsar_system":
+            binary.update(component.params)
+    candidates = []
+    for name in model.fittable_params:
+        par = getattr(model, name)
+        if not par.frozen or par.quantity is None or name in exclude:
+            continue
+        if name.startswith("JUMP"):
+            candidates.append((name, kind_jump))
+        elif _derivative.match(name) and name not in ("F0", "DM"):
+            candidates.append((name, kind_derivative))
+        elif name in binary:
+            candidates.append((name, kind_binary))
+    return candidates
+
+
+def fit_candidate(toas, model, fit_method, param=None, iters=4):
+    """
+    Fit a copy of model, with param free in addition to its free parameters
+
+    :param toas:        The TOAs to fit
+    :param model:       The timing model. It is not changed
+    :param fit_method:  Name of the pint fitter class
+    :param param:       The extra parameter to fit (None = just the model)
+    :param iters:       Number of fit iterations
+    :return:            Dictionary with the results. On failure, "error"
+                        holds the error message
+    """
+    result = {"param": param, "error": None}
+    try:
+        model = copy.deepcopy(model)
+        if param is not None:
+            getattr(model, param).frozen = False
+            # DM derivatives need an epoch, like the spin derivatives have
+            if (
+                param.startswith("DM")
+                and "DMEPOCH" in model.params
+                and model.DMEPOCH.value is None
+            ):
+                model.DMEPOCH.value = model.PEPOCH.value
+        fitter = getattr(pint.fitter, fit_method)(toas, model)
+        fitter.fit_toas(maxiter=iters)
+        result.update(chi2=float(fitter.resids.chi2), dof=int(fitter.resids.dof))
+        if param is not None:
+            par = getattr(fitter.model, param)
+            result.update(
+                value=float(par.value),
+                uncertainty=float(par.uncertainty_value),
+                units=str(par.units),
+            )
+    except Exception as e:
+        log.error(f"Fitting {param or 'the model'} failed: {e}")
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _init_worker(toas, model, fit_method, iters, loglevel=None):
+    """Keep what all fits need in the worker process, so it is sent once"""
+    if loglevel is None:
+        pint.logging.setup()
+    else:
+        pint.logging.setup(loglevel)
+    _worker.update(toas=toas, model=model, fit_method=fit_method, iters=iters)
+
+
+def _fit_in_worker(param):
+    return fit_candidate(
+        _worker["toas"],
+        _worker["model"],
+        _worker["fit_method"],
+        param=param,
+        iters=_worker["iters"],
+    )
+
+
+def explore_params(
+    toas,
+    model,
+    fit_method,
+    candidates=None,
+    iters=4,
+    workers=None,
+    loglevel=None,
+):
+    """
+    Fit every candidate parameter, and rank them by their F-test
+
+    :param toas:        The TOAs to fit
+    :param model:       The timing model. It is not changed
+    :param fit_method:  Name of the pint fitter class
+    :param candidates:  List of (name, kind) tuples (None = candidate_params)
+    :param iters:       Number of fit iterations
+    :param workers:     Number of worker processes (None = number of CPUs).
+                        With one worker, everything runs in this process
+    :param loglevel:    Logging level of the workers
+    :return:            List of result dictionaries, one per candidate, with
+                        the most significant first. "dchi2" is the decrease
+                        of chi2, and "probability" the F-test probability
+                        that the decrease is due to noise
+    """
+    candidates = candidate_params(model) if candidates is None else candidates
+    params = [None] + [name for name, kind in candidates]
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(params)))
+    log.info(f"Fitting {len(candidates)} candidate parameters with {workers} worker(s)")
+
+    if workers == 1:
+        results = [
+            fit_candidate(toas, model, fit_method, param=param, iters=iters)
+            for param in params
+        ]
+    else:
+        # This can run on a thread of the GUI, and forking a process with
+        # threads can deadlock the children. The initializer sends all they need
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(toas, model, fit_method, iters, loglevel),
+        ) as pool:
+            futures = [pool.submit(_fit_in_worker, param) for param in params]
+            results = []
+            for future, param in zip(futures, params):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # The worker itself died (e.g. out of memory)
+                    log.error(f"Worker for {param or 'the model'} failed: {e}")
+                    results.append({"param": param, "error": f"{type(e).__name__}: {e}"})
+
+    base, results = results[0], results[1:]
+    for result, (name, kind) in zip(results, candidates):
+        result["kind"] = kind
+        result["dchi2"] = result["probability"] = np.nan
+        if result["error"] is None and base["error"] is None:
+            result["dchi2"] = base["chi2"] - result["chi2"]
+            result["probability"] = (
+                FTest(base["chi2"], base["dof"], result["chi2"], result["dof"])
+                if result["dchi2"] > 0
+                else 1.0
+            )
+    if base["error"] is not None:
+        log.error(f"Cannot compare the candidates: {base['error']}")
+
+    # Most significant first, then the largest decrease of chi2. Failures last
+    def rank(result):
+        probability, dchi2 = result["probability"], result["dchi2"]
+        return (
+            np.isnan(probability),
+            0.0 if np.isnan(probability) else probability,
+            0.0 if np.isnan(dchi2) else -dchi2,
+        )
+
+    return sorted(results, key=rank)
+
+
+def print_explore_table(results):
+    """Print a table with the results of explore_params"""
+    print(
+        "%-12s %-10s %14s %12s %16s %12s  %s"
+        % ("Param", "Kind", "Delta-Chi2", "F-test P", "Value", "Uncertainty", "Unit")
+    )
+    print("-" * 90)
+    for result in results:
+        if result["error"] is not None:
+            print("%-12s %-10s FAILED: %s" % (result["param"], result["kind"], result["error"]))
+        elif np.isnan(result["dchi2"]):
+            print("%-12s %-10s %14s" % (result["param"], result["kind"], "-"))
+        else:
+            print(
+                "%-12s %-10s %14.6g %12.3g %16.8g %12.3g  %s"
+                % (
+                    result["param"],
+                    result["kind"],
+                    result["dchi2"],
+                    result["probability"],
+                    result["value"],
+                    result["uncertainty"],
+                    result["units"],
+                )
+            )
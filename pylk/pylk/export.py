@@ -0,0 +1,166 @@
+"""Export of the plk plot to image files.
+
+Saving the figure used to render the live canvas, on the GUI thread. With
+many TOAs at publication resolution, that freezes the GUI for as long as
+the rendering takes.
+
+An export has two steps. On the GUI thread, the plk widget takes a
+PlotSnapshot: copies of everything the plot shows (the values, colors,
+selection, limits, labels and lines), for the current axes or for other
+axis choices. Rendering a snapshot only needs matplotlib, not the pulsar or
+the widget, so that can run on a worker thread, on its own Agg figure.
+"""
+import os
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from pylk import constants
+from pylk.plotview import MplPlot
+
+
+# File formats that can be exported
+export_formats = ["png", "pdf", "svg"]
+
+
+def _copy(values):
+    """Return a plain copy of values (dropping any unit), or None"""
+    return None if values is None else np.array(getattr(values, "value", values))
+
+
+class PlotSnapshot:
+    """Everything the plk plot shows, copied so that it does not change"""
+
+    def __init__(
+        self,
+        xid,
+        yid,
+        x,
+        y,
+        yerr,
+        index,
+        colors,
+        selected,
+        selected_color,
+        limits,
+        xlabel,
+        ylabel,
+        title,
+        x2=None,
+        y2=None,
+        lines=(),
+        curves=None,
+    ):
+        """
+        :param xid:             The x-axis choice
+        :param yid:             The y-axis choice
+        :param x:               x-values of all TOAs
+        :param y:               y-values of all TOAs
+        :param yerr:            y-errors of all TOAs (None = no error bars)
+        :param index:           Per-TOA color index, from the color mode
+        :param colors:          List of colors, from the color mode
+        :param selected:        Boolean array, True = selected TOA
+        :param selected_color:  Color of the selected TOAs
+        :param limits:          (xmin, xmax, ymin, ymax)
+        :param xlabel:          Label of the x-axis
+        :param ylabel:          Label of the y-axis
+        :param title:           Title of the plot
+        :param x2:              (label, scale) of a secondary x-axis, or None
+        :param y2:              (label, scale) of a secondary y-axis, or None
+        :param lines:           List of (x, y, color, alpha) tuples
+        :param curves:          (x, ys, color, alpha) of the random models, or
+                                None
+        """
+        self.xid, self.yid = xid, yid
+        self.x, self.y, self.yerr = _copy(x), _copy(y), _copy(yerr)
+        self.index = np.array(index)
+        self.colors = list(colors)
+        self.selected = np.array(selected, dtype=bool)
+        self.selected_color = selected_color
+        self.limits = tuple(float(limit) for limit in limits)
+        self.xlabel, self.ylabel, self.title = xlabel, ylabel, title
+        self.x2, self.y2 = x2, y2
+        self.lines = list(lines)
+        # The random model curves are cached arrays that are never changed
+        self.curves = curves
+
+    def render(self, filename, dpi=None, figsize=None):
+        """
+        Render the plot to a file, on a new Agg figure
+
+        :param filename:    The file to write. The extension sets the format
+        :param dpi:         Resolution (default: constants.plk_export_dpi)
+        :param figsize:     Size in inches (default: the size of the canvas)
+        """
+        dpi = constants.plk_export_dpi if dpi is None else dpi
+        figsize = constants.plk_figsize_inch if figsize is None else figsize
+        figure = Figure(figsize, dpi=dpi)
+        FigureCanvasAgg(figure)
+        plot = MplPlot(figure)
+        plot.clear(self.xlabel, self.ylabel)
+        plot.setResiduals(
+            self.x,
+            self.y,
+            self.yerr,
+            self.index,
+            self.colors,
+            self.selected,
+            self.selected_color,
+        )
+        plot.setAxes(
+            self.limits, self.xlabel, self.ylabel, self.title, x2=self.x2, y2=self.y2
+        )
+        plot.setLines(self.lines)
+        if self.curves is not None:
+            plot.setCurves(*self.curves)
+        figure.tight_layout()
+        figure.savefig(filename, dpi=dpi)
+
+
+def export_filename(basename, snapshot, fmt):
+    """
+    Return the file name of a snapshot in a batch export
+
+    :param basename:    File name without extension, e.g. 'plots/J1744'
+    :param snapshot:    The PlotSnapshot
+    :param fmt:         The file format (one of export_formats)
+    :return:            e.g. 'plots/J1744_mjd_post-fit.png'
+    """
+    axes = f"{snapshot.xid}_{snapshot.yid}".replace(" ", "-")
+    return f"{basename}_{axes}.{fmt}"
+
+
+def export_snapshots(jobs, dpi=None, progress=None, cancelled=None, failed=None):
+    """
+    Render snapshots to files
+
+    A file that cannot be written does not stop the export: the error is
+    passed to failed, and the next file is rendered.
+
+    :param jobs:        List of (snapshot, filename) pairs
+    :param dpi:         Resolution (default: constants.plk_export_dpi)
+    :param progress:    Function called with (done, total) after every file
+    :param cancelled:   Function that returns True to stop before the next file
+    :param failed:      Function called with (filename, message) for every
+                        file that could not be written
+    :return:            List of the files that were written
+    """
+    written = []
+    for job, (snapshot, filename) in enumerate(jobs):
+        if cancelled is not None and cancelled():
+            break
+        try:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            snapshot.render(filename, dpi=dpi)
+        except Exception as e:
+            if failed is None:
+                raise
+            failed(filename, str(e))
+        else:
+            written.append(filename)
+        if progress is not None:
+            progress(job + 1, len(jobs))
+    return written
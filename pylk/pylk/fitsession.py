@@ -0,0 +1,534 @@
+"""Persistent fit session of a pulsar.
+
+Every fit used to build a new pint fitter from scratch, which evaluates the
+timing model for the pre-fit residuals (although the residual engine has them
+already), and then ran all iterations, although a re-fit of a model that was
+fitted before usually converges in one. Every iteration evaluates the design
+matrix and the timing model twice, so that adds up.
+
+A FitSession is kept by the Pulsar, and keeps track of what changed since the
+last fit: the fitter, the TOAs, the free parameters, and the model values.
+It
+- re-uses the fitter of the last fit, if the fit method did not change
+- gives the fitter the cached pre-fit residuals, and has it compute its
+  residuals with the residual engine. The model is then not evaluated again
+  for the pre-fit model in the first iteration, or for the post-fit model
+  after the fit.
+- keeps the design matrix of the last iteration, and re-uses it when it is
+  asked for the same TOAs, free parameters and model values
+- stops iterating when chi2 no longer changes. The pre-fit model is the
+  solution of the last fit, so a re-fit is warm-started from there.
+- with correlated noise, has the fitter take the noise basis, weights, and
+  scaled uncertainties from the noise cache of the engine (see noisecache)
+- in incremental mode, keeps the normal equations of the last fit. When the
+  only change since then is that TOAs were removed, a re-fit downdates and
+  re-solves those, instead of running the fitter (see normaleqs).
+- previews a fit with other free parameters, linearized around the current
+  model, from the design matrix columns of the last fit. Only the columns of
+  newly freed parameters are computed, once.
+
+The fitters themselves still compute the design matrix and residuals of
+every iteration, so this only re-uses what the pint fitter API allows.
+"""
+import contextlib
+import copy
+
+import astropy.units as u
+import numpy as np
+
+import pint.fitter
+from pint.pint_matrix import CorrelationMatrix, CovarianceMatrix
+
+from loguru import logger as log
+
+from pylk.normaleqs import NormalEquations
+from pylk.residengine import model_fingerprint
+
+
+# Relative change of chi2 below which a fit is converged
+CHI2_TOLERANCE = 1e-6
+
+# Largest fraction of the TOAs that an incremental re-fit can remove
+MAX_REMOVED_FRACTION = 0.5
+
+# Fitters of which the last fit can be updated in incremental mode. The
+# downhill fitters keep their solution in a state object instead
+INCREMENTAL_FITTERS = ("WLSFitter", "GLSFitter")
+
+
+class FitPreview:
+    """Linearized prediction of a fit, with the free parameters of a model"""
+
+    def __init__(self, free_params, selected, resids, chi2, dof, params, dpars, errors):
+        """
+        :param free_params: The free parameters of the model
+        :param selected:    The TOA selection the fit is for (all False = all)
+        :param resids:      Predicted post-fit time residuals of all TOAs
+        :param chi2:        Predicted post-fit chi2 of the fitted TOAs
+        :param dof:         Degrees of freedom of the fit
+        :param params:      Names of the fitted columns (may include 'Offset')
+        :param dpars:       Predicted parameter steps, as Quantities
+        :param errors:      Predicted parameter uncertainties, as Quantities
+        """
+        self.free_params = tuple(free_params)
+        self.selected = np.array(selected, dtype=bool)
+        self.resids = resids
+        self.chi2 = chi2
+        self.dof = dof
+        self.params = list(params)
+        self.dpars = list(dpars)
+        self.errors = list(errors)
+
+    @property
+    def reduced_chi2(self):
+        return self.chi2 / self.dof if self.dof > 0 else np.inf
+
+
+class FitSession:
+    """The fitter of a pulsar, kept from one fit to the next"""
+
+    def __init__(self, engine, tolerance=CHI2_TOLERANCE):
+        """
+        :param engine:      The ResidualEngine of the pulsar
+        :param tolerance:   Relative change of chi2 below which a fit is
+                            converged
+        """
+        self.engine = engine
+        self.tolerance = tolerance
+        self.incremental = False  # Update the last fit when TOAs are removed
+        self.reset()
+
+    def reset(self):
+        """Forget the fitter, the design matrix, and the last fit"""
+        self.fitter = None
+        self.fit_method = None
+        self.designmatrix = None  # (key, (M, params, units)) of the last one
+        self.last = None  # Key of the last fit, see _key
+        self.normal = None  # NormalEquations of the last fit (incremental)
+        self.iterations = 0  # Iterations done by the last fit
+        self.converged = False
+        self.columns = None  # (key, columns, units) for fit previews
+
+    def _key(self, fit_method, toas, model):
+        """What the result of a fit depends on"""
+        columns = ["delta_pulse_number", "pulse_number"]
+        return {
+            "fitter": (fit_method, self.engine.generation),
+            "TOAs": np.array(toas.table["index"], dtype=int),
+            "pulse numbers": [
+                np.array(toas.table[column])
+                for column in columns
+                if column in toas.table.colnames
+            ],
+            "free parameters": tuple(model.free_params),
+            "model": model_fingerprint(model),
+        }
+
+    @staticmethod
+    def _same(value, other):
+        if isinstance(value, list):
+            return len(value) == len(other) and all(
+                np.array_equal(a, b) for a, b in zip(value, other)
+            )
+        if isinstance(value, np.ndarray):
+            return np.array_equal(value, other)
+        return value == other
+
+    @classmethod
+    def _differences(cls, key, other):
+        """Return the names of the parts of two keys that differ"""
+        return [name for name, value in key.items() if not cls._same(value, other[name])]
+
+    def changes(self, fit_method, toas, model):
+        """
+        Return what changed since the last fit
+
+        :param fit_method:  Name of the pint fitter class
+        :param toas:        The TOAs to fit
+        :param model:       The model to start from
+        :return:            List of the things that changed
+        """
+        if self.last is None:
+            return ["everything"]
+        return self._differences(self._key(fit_method, toas, model), self.last)
+
+    def start(self, fit_method, toas, model, residuals=None):
+        """
+        Prepare the fitter for a fit of toas, starting from model
+
+        :param fit_method:  Name of the pint fitter class
+        :param toas:        The TOAs to fit
+        :param model:       The model to start from. It is not changed
+        :param residuals:   The residuals of model for toas, if known
+        :return:            The fitter
+        """
+        changes = self.changes(fit_method, toas, model)
+        log.info(
+            f"Changed since the last fit: {', '.join(changes)}"
+            if changes
+            else "Nothing changed since the last fit"
+        )
+        fitter_class = getattr(pint.fitter, fit_method)
+        # Residuals of a narrowband model can not stand in for wideband ones
+        wideband = fitter_class.make_resids is not pint.fitter.Fitter.make_resids
+        if wideband:
+            residuals = None
+
+        if type(self.fitter) is fitter_class and not wideband:
+            # Only the starting point of the fitter changes
+            fitter = self.fitter
+            fitter.toas = toas
+            fitter.model_init = model
+            fitter.model = copy.deepcopy(model)
+            fitter.resids_init = (
+                residuals if residuals is not None else fitter.make_resids(model)
+            )
+            fitter.resids = fitter.resids_init
+            fitter.fitresult = []
+            fitter.converged = False
+        else:
+            fitter = fitter_class(toas, model, residuals=residuals)
+            if not wideband:
+                fitter.make_resids = self._resids_maker(fitter)
+            if fitter_class.get_designmatrix is pint.fitter.Fitter.get_designmatrix:
+                fitter.get_designmatrix = self._designmatrix_maker(fitter)
+        self.engine.share(fitter.model, model)
+
+        self.fitter = fitter
+        self.fit_method = fit_method
+        self.normal = None
+        self.iterations = 0
+        self.converged = False
+        self._start_chi2 = None if residuals is None else residuals.chi2
+        return fitter
+
+    def _resids_maker(self, fitter):
+        """Return a make_resids for fitter that uses the residual engine"""
+
+        def make_resids(model):
+            return self.engine.residuals(
+                fitter.toas, model, track_mode=fitter.track_mode
+            )
+
+        return make_resids
+
+    def _designmatrix_maker(self, fitter):
+        """Return a get_designmatrix for fitter that re-uses the last one"""
+
+        def get_designmatrix():
+            key = self._key(self.fit_method, fitter.toas, fitter.model)
+            if self.designmatrix is not None:
+                last_key, designmatrix = self.designmatrix
+                if not self._differences(key, last_key):
+                    log.debug("Re-using the design matrix of the last iteration")
+                    return designmatrix
+            designmatrix = fitter.model.designmatrix(
+                toas=fitter.toas, incfrozen=False, incoffset=True
+            )
+            self.designmatrix = (key, designmatrix)
+            return designmatrix
+
+        return get_designmatrix
+
+    def run(self, iters, progress=None, cancelled=None):
+        """
+        Run the fitter, one iteration at a time if the fitter allows it
+
+        Iterations of the linear fitters can be run one by one, until chi2
+        does not change anymore. Downhill and other non-linear fitters have
+        their own convergence criteria, so they are run as a single step.
+
+        :param iters:       Maximum number of fit iterations
+        :param progress:    Called as progress(step, steps) after each step
+        :param cancelled:   Called before each step, stop if it returns True
+        :return:            True if the fit finished, False if cancelled
+        """
+        fitter = self.fitter
+        stepwise = isinstance(
+            fitter,
+            (pint.fitter.WLSFitter, pint.fitter.GLSFitter, pint.fitter.WidebandTOAFitter),
+        )
+        steps = iters if stepwise else 1
+        chi2 = self._start_chi2
+        for step in range(steps):
+            if cancelled is not None and cancelled():
+                return False
+            last_chi2 = chi2
+            with self._noise_installed(fitter):
+                chi2 = fitter.fit_toas(maxiter=1 if stepwise else iters)
+            self.iterations += 1 if stepwise else iters
+            if (
+                stepwise
+                and last_chi2 is not None
+                and abs(chi2 - last_chi2) <= self.tolerance * max(abs(last_chi2), 1.0)
+            ):
+                log.info(f"Fit converged after {step + 1} iteration(s)")
+                self.converged = True
+            if progress is not None:
+                progress(steps if self.converged else step + 1, steps)
+            if self.converged:
+                break
+        return True
+
+    def _noise_installed(self, fitter):
+        """Let fitter use the noise cache of the engine, if there is one"""
+        if self.engine.noise_cache is None or fitter.is_wideband:
+            return contextlib.nullcontext()
+        return self.engine.noise_cache.installed(fitter)
+
+    def _noise(self, toas, model):
+        """
+        Return the scaled TOA uncertainties, and the noise basis and weights
+
+        :return:    (sigma, noise_basis, noise_weights), the uncertainties in
+                    seconds. The basis and weights are None without
+                    correlated noise
+        """
+        cache = self.engine.noise_cache
+        if not model.has_correlated_errors:
+            return model.scaled_toa_uncertainty(toas).to_value(u.s), None, None
+        if cache is None:
+            return (
+                model.scaled_toa_uncertainty(toas).to_value(u.s),
+                model.noise_model_designmatrix(toas),
+                model.noise_model_basis_weight(toas),
+            )
+        entry = cache.entry(toas, model)
+        return entry.sigma.to_value(u.s), entry.basis, entry.weights
+
+    def can_update(self, fit_method, toas, model):
+        """
+        Return True if a fit can be done by updating the last one
+
+        That is the case in incremental mode, for the fitters in
+        INCREMENTAL_FITTERS, when the only change since the last fit is that
+        some of its TOAs were removed.
+
+        :param fit_method:  Name of the pint fitter class
+        :param toas:        The TOAs to fit
+        :param model:       The model to start from
+        """
+        if not self.incremental or self.normal is None or self.last is None:
+            return False
+        if fit_method not in INCREMENTAL_FITTERS:
+            return False
+        key = self._key(fit_method, toas, model)
+        changes = self._differences(key, self.last)
+        if set(changes) - {"TOAs", "pulse numbers"}:
+            return False
+        keep = np.isin(self.normal.indices, key["TOAs"])
+        if not np.array_equal(self.normal.indices[keep], key["TOAs"]):
+            return False
+        # The pulse numbers of the remaining TOAs must be the same
+        if not self._same(
+            key["pulse numbers"], [column[keep] for column in self.last["pulse numbers"]]
+        ):
+            return False
+        return (
+            (~keep).sum() <= MAX_REMOVED_FRACTION * len(keep)
+            and keep.sum() > len(self.normal.params)
+        )
+
+    def update(self, toas, model):
+        """
+        Update the last fit for the TOAs that were removed since
+
+        The normal equations of the last fit are downdated and solved once,
+        without evaluating the design matrix. Only the post-fit residuals
+        are computed, to keep the normal equations up to date.
+
+        :param toas:    The remaining TOAs
+        :param model:   The model to start from: the solution of the last fit
+        :return:        The fitter, with the updated model
+        """
+        fitter, normal = self.fitter, self.normal
+        normal.remove(np.isin(normal.indices, toas.table["index"]))
+        dpars, cov = normal.solve()
+        errors = np.sqrt(np.diag(cov))
+
+        fitter.toas = toas
+        fitter.model_init = model
+        fitter.model = copy.deepcopy(model)
+        fitp = fitter.model.get_params_dict("free", "quantity")
+        fitpv = fitter.model.get_params_dict("free", "num")
+        fitperrs = {}
+        for name in fitp:
+            index = normal.params.index(name)
+            step = dpars[index] * u.s / normal.units[index]
+            fitpv[name] = np.longdouble(
+                (fitpv[name] * fitp[name].units + step) / fitp[name].units
+            )
+            fitperrs[name] = errors[index]
+        fitter.set_params(fitpv)
+        fitter.set_param_uncertainties(fitperrs)
+
+        # The same covariance matrices that the pint fitters provide
+        labels = {
+            name: (index, index + 1, unit)
+            for index, (name, unit) in enumerate(zip(normal.params, normal.units))
+        }
+        fitter.parameter_covariance_matrix = CovarianceMatrix(cov, [labels, labels])
+        fitter.parameter_correlation_matrix = CorrelationMatrix(
+            (cov / errors).T / errors, [labels, labels]
+        )
+        fitter.fac = normal.norm[: len(normal.params)]
+        fitter.errors = errors
+
+        fitter.resids = fitter.make_resids(fitter.model)
+        normal.set_residuals(
+            fitter.resids.time_resids.to_value(u.s),
+            self._noise(toas, fitter.model)[0],
+        )
+        self._update_model(fitter)
+        log.info(f"Updated the last fit for {toas.ntoas} TOAs")
+        self.iterations = 0
+        self.converged = True
+        return fitter
+
+    @staticmethod
+    def _update_model(fitter):
+        """
+        Update what changes in the model when TOAs are removed
+
+        This is what `fitter.update_model` does, except that it finds the
+        first and last TOA from the float MJDs. pint compares all the TOA
+        times as Time objects for that, which takes longer than the update.
+        """
+        model, toas, resids = fitter.model, fitter.toas, fitter.resids
+        mjds = np.asarray(toas.table["mjd_float"])
+        model.START.value = toas.table["mjd"][np.argmin(mjds)]
+        model.FINISH.value = toas.table["mjd"][np.argmax(mjds)]
+        model.NTOA.value = toas.ntoas
+        model.CHI2.value = resids.chi2
+        model.CHI2R.value = resids.chi2 / resids.dof
+        model.TRES.quantity = resids.rms_weighted()
+
+    def _normal_equations(self):
+        """Return the NormalEquations at the solution of the fit, or None"""
+        fitter = self.fitter
+        if fitter.is_wideband:
+            return None
+        toas, model = fitter.toas, fitter.model
+        key = self._key(self.fit_method, toas, model)
+        if self.designmatrix is not None and set(
+            self._differences(key, self.designmatrix[0])
+        ) <= {"model", "pulse numbers"}:
+            # The design matrix of the last iteration, one (small) step away
+            M, params, units = self.designmatrix[1]
+        else:
+            M, params, units = model.designmatrix(
+                toas=toas, incfrozen=False, incoffset=True
+            )
+        sigma, noise_basis, noise_weights = self._noise(toas, model)
+        return NormalEquations(
+            key["TOAs"],
+            M,
+            params,
+            units,
+            fitter.resids.time_resids.to_value(u.s),
+            sigma,
+            noise_basis=noise_basis,
+            noise_weights=noise_weights,
+        )
+
+    def finish(self):
+        """Remember the solution of the fit, to see what changes next time"""
+        fitter = self.fitter
+        self.last = self._key(self.fit_method, fitter.toas, fitter.model)
+        if self.incremental and self.normal is None:
+            self.normal = self._normal_equations()
+
+    def _preview_columns(self, toas, model):
+        """
+        Return the design matrix columns of the free parameters, for toas
+
+        The columns are kept for the TOAs and model values, so that toggling
+        parameters back and forth does not compute anything. The design
+        matrix of the last fit is used when it is for the same TOAs.
+
+        :return:    (names, M, units): the column names, the design matrix,
+                    and the column units
+        """
+        key = self._key(self.fit_method, toas, model)
+        # The columns do not depend on the pulse numbers or the free parameters
+        if self.columns is None or set(
+            self._differences(key, self.columns[0])
+        ) - {"free parameters", "pulse numbers"}:
+            self.columns = (key, {}, {})
+            if self.designmatrix is not None and set(
+                self._differences(key, self.designmatrix[0])
+            ) <= {"model", "pulse numbers", "free parameters"}:
+                # The design matrix of the last iteration, one (small) step away
+                M, params, units = self.designmatrix[1]
+                for column, name, unit in zip(M.T, params, units):
+                    self.columns[1][name] = column
+                    self.columns[2][name] = unit
+        _, columns, column_units = self.columns
+
+        missing = [name for name in model.free_params if name not in columns]
+        if missing or not columns:
+            log.debug(f"Computing design matrix columns: {', '.join(missing)}")
+            frozen = {name: getattr(model, name).frozen for name in model.params}
+            try:
+                for name in model.params:
+                    getattr(model, name).frozen = name not in missing
+                M, params, units = model.designmatrix(
+                    toas=toas, incfrozen=False, incoffset=True
+                )
+            finally:
+                for name, value in frozen.items():
+                    getattr(model, name).frozen = value
+            for column, name, unit in zip(M.T, params, units):
+                columns[name] = column
+                column_units[name] = unit
+
+        names = [name for name in ["Offset"] if name in columns]
+        names += list(model.free_params)
+        M = np.column_stack([columns[name] for name in names])
+        return names, M, [column_units[name] for name in names]
+
+    def preview(self, toas, model, residuals, selected):
+        """
+        Predict the fit of the selected TOAs, with the free parameters of model
+
+        This is a single linearized step from model, like one iteration of a
+        WLS or GLS fit, so it predicts the result of a converged fit for
+        parameters that enter the phase (nearly) linearly.
+
+        :param toas:        All TOAs
+        :param model:       The model to start from. It is not changed
+        :param residuals:   The residuals of model for toas
+        :param selected:    Boolean array over toas, True = fit this TOA (all
+                            False = fit all TOAs)
+        :return:            A FitPreview
+        """
+        fittable = set(model.fittable_params)
+        unfittable = [name for name in model.free_params if name not in fittable]
+        if unfittable:
+            raise ValueError(f"No derivative for {', '.join(unfittable)}")
+        selected = np.array(selected, dtype=bool)
+        rows = selected if np.any(selected) else np.ones(toas.ntoas, dtype=bool)
+        names, M, units = self._preview_columns(toas, model)
+        sigma, noise_basis, noise_weights = self._noise(toas, model)
+        r = residuals.time_resids.to_value(u.s)
+        normal = NormalEquations(
+            np.asarray(toas.table["index"], dtype=int)[rows],
+            M[rows],
+            names,
+            units,
+            r[rows],
+            sigma[rows],
+            noise_basis=None if noise_basis is None else noise_basis[rows],
+            noise_weights=noise_weights,
+        )
+        dpars, cov = normal.solve()
+        return FitPreview(
+            model.free_params,
+            selected,
+            (r - M @ dpars) * u.s,
+            normal.chi2(),
+            rows.sum() - len(names),
+            names,
+            [dpar * u.s / unit for dpar, unit in zip(dpars, units)],
+            [error * u.s / unit for error, unit in zip(np.sqrt(np.diag(cov)), units)],
+        )
@@ -0,0 +1,82 @@
+"""Timing of the plk plot redraws.
+
+A slow interaction can be spent getting the plot data, updating the
+artists, laying out the figure, or rasterizing it. A FrameTimer measures the
+stages of the last redraw. It also counts the frames that the plot view
+shows, including the ones during a drag that do not redraw the plot, for a
+rolling frame rate.
+
+Timing is cheap (a few perf_counter calls per redraw), so it is always on:
+the plk widget only decides whether to show it.
+"""
+import collections
+import contextlib
+import time
+
+
+# Time window of the rolling frame rate, in seconds
+FPS_WINDOW = 1.0
+
+
+class FrameTimer:
+    """Stage timings of the last redraw, and a rolling frame rate"""
+
+    def __init__(self, window=FPS_WINDOW):
+        """
+        :param window:  Time window of the frame rate, in seconds
+        """
+        self.window = window
+        self.stages = {}  # Stage name -> seconds, for the last redraw
+        self.total = 0.0  # Seconds of the last redraw
+        self.redraws = 0
+        self._current = None
+        self._start = None
+        self._frames = collections.deque()
+
+    def begin(self):
+        """Start timing a redraw"""
+        self._current = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the redraw (outside a redraw, this does nothing)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._current is not None:
+                elapsed = time.perf_counter() - start
+                self._current[name] = self._current.get(name, 0.0) + elapsed
+
+    def end(self):
+        """Finish timing a redraw"""
+        if self._current is None:
+            return
+        self.total = time.perf_counter() - self._start
+        self.stages = self._current
+        self.redraws += 1
+        self._current = None
+
+    def frame(self):
+        """Count a frame shown by the plot view"""
+        now = time.perf_counter()
+        self._frames.append(now)
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._frames and now - self._frames[0] > self.window:
+            self._frames.popleft()
+
+    def fps(self):
+        """Return the number of frames per second, over the last window"""
+        self._trim(time.perf_counter())
+        return len(self._frames) / self.window
+
+    def summary(self):
+        """Return the timings as lines of text"""
+        lines = [f"redraw  {1e3 * self.total:7.1f} ms  (#{self.redraws})"]
+        for name, seconds in self.stages.items():
+            lines.append(f"  {name:<9}{1e3 * seconds:6.1f} ms")
+        lines.append(f"fps     {self.fps():7.1f}")
+        return lines
@@ -0,0 +1,219 @@
+"""Compact undo/redo journal for the plk widget.
+
+Rather than keeping deep copies of the whole Pulsar (all TOAs, both models,
+the residuals and the fitter) for every step, the journal keeps one full
+snapshot of the current state, and the differences between consecutive
+states. A snapshot is a dictionary with plain values, as produced by
+`Pulsar.get_state`:
+
+- lists of strings (the parfile lines of the models) are stored as line diffs
+- frozensets (deleted/stashed/selected TOA indices) as added/removed elements
+- dicts (per-TOA jump flags and delta pulse numbers) as changed items
+- anything else (e.g. booleans) as old/new values
+
+All deltas can be applied in both directions, so undo and redo walk from the
+current state. When the deltas take more memory than the budget, the oldest
+steps are forgotten.
+"""
+import difflib
+import sys
+
+from loguru import logger as log
+
+
+# Default memory budget for the journal deltas, in bytes
+DEFAULT_BUDGET = 32 * 1024**2
+
+_MISSING = object()
+
+
+def _sizeof(obj):
+    """Rough estimate of the memory used by obj and its contents"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(v) for v in obj)
+    return size
+
+
+def _diff_lines(old, new):
+    """Return the non-equal opcodes that turn the lines old into new"""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    return tuple(
+        (i1, i2, j1, j2, tuple(old[i1:i2]), tuple(new[j1:j2]))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    )
+
+
+def _patch_lines(lines, opcodes, reverse=False):
+    """Apply the opcodes of _diff_lines to lines (or undo them)"""
+    patched, pos = [], 0
+    for i1, i2, j1, j2, old, new in opcodes:
+        if reverse:
+            i1, i2, old, new = j1, j2, new, old
+        patched.extend(lines[pos:i1])
+        patched.extend(new)
+        pos = i2
+    patched.extend(lines[pos:])
+    return patched
+
+
+def diff_states(old, new):
+    """Return the delta that turns state old into state new
+
+    :param old:     The old state dictionary
+    :param new:     The new state dictionary
+    :return:        Dictionary with a change for every key that differs
+    """
+    delta = {}
+    for key in set(old) | set(new):
+        a, b = old.get(key, None), new.get(key, None)
+        if isinstance(a, list) and isinstance(b, list):
+            if a != b:
+                delta[key] = ("lines", _diff_lines(a, b))
+        elif isinstance(a, frozenset) and isinstance(b, frozenset):
+            if a != b:
+                delta[key] = ("set", b - a, a - b)
+        elif isinstance(a, dict) and isinstance(b, dict):
+            changed = {
+                k: (a.get(k, _MISSING), b.get(k, _MISSING))
+                for k in set(a) | set(b)
+                if a.get(k, _MISSING) != b.get(k, _MISSING)
+            }
+            if changed:
+                delta[key] = ("dict", changed)
+        elif a != b:
+            delta[key] = ("value", a, b)
+    return delta
+
+
+def apply_delta(state, delta, reverse=False):
+    """Apply the delta of diff_states to state (or undo it)
+
+    :param state:   The state dictionary. It is not modified
+    :param delta:   The delta from diff_states
+    :param reverse: Undo the delta, rather than apply it
+    :return:        The new state dictionary
+    """
+    state = dict(state)
+    for key, change in delta.items():
+        kind = change[0]
+        if kind == "lines":
+            state[key] = _patch_lines(state[key], change[1], reverse=reverse)
+        elif kind == "set":
+            added, removed = change[1], change[2]
+            if reverse:
+                added, removed = removed, added
+            state[key] = (state[key] - removed) | added
+        elif kind == "dict":
+            items = dict(state[key])
+            for k, (a, b) in change[1].items():
+                value = a if reverse else b
+                if value is _MISSING:
+                    items.pop(k, None)
+                else:
+                    items[k] = value
+            state[key] = items
+        else:
+            state[key] = change[1] if reverse else change[2]
+    return state
+
+
+class Journal:
+    """Undo/redo history of Pulsar states, stored as deltas
+
+    Every recorded step has a label (e.g. "fit" or "delete"), so that we can
+    find the state right before the last fit for the revert action.
+    """
+
+    def __init__(self, state, label="load", budget=DEFAULT_BUDGET):
+        """Start a new journal
+
+        :param state:   The initial state
+        :param label:   Label of the initial state
+        :param budget:  Memory budget for the deltas, in bytes
+        """
+        self.initial = state
+        self.budget = budget
+        self._current = state
+        self._deltas = []  # (delta, nbytes) from state i to state i+1
+        self._labels = [label]
+        self._pos = 0
+
+    @property
+    def current(self):
+        return self._current
+
+    @property
+    def nbytes(self):
+        """Estimated memory used by the deltas"""
+        return sum(nbytes for _, nbytes in self._deltas)
+
+    def can_undo(self):
+        return self._pos > 0
+
+    def can_redo(self):
+        return self._pos < len(self._deltas)
+
+    def record(self, state, label):
+        """Record a new state, dropping everything that could be redone
+
+        :param state:   The new state
+        :param label:   Label that describes the step to this state
+        :return:        True if the state differs from the current one
+        """
+        delta = diff_states(self._current, state)
+        if not delta:
+            return False
+        del self._deltas[self._pos :]
+        del self._labels[self._pos + 1 :]
+        self._deltas.append((delta, _sizeof(delta)))
+        self._labels.append(label)
+        self._pos += 1
+        self._current = state
+        self._trim()
+        return True
+
+    def _trim(self):
+        """Forget the oldest steps until the deltas fit within the budget"""
+        nbytes = self.nbytes
+        while nbytes > self.budget and self._pos > 0:
+            nbytes -= self._deltas.pop(0)[1]
+            self._labels.pop(0)
+            self._pos -= 1
+            log.debug("Undo journal over budget, forgot the oldest step")
+
+    def undo(self):
+        """Step back, and return the state (None if there is no history)"""
+        if not self.can_undo():
+            return None
+        self._pos -= 1
+        self._current = apply_delta(
+            self._current, self._deltas[self._pos][0], reverse=True
+        )
+        return self._current
+
+    def redo(self):
+        """Step forward, and return the state (None if there is nothing to redo)"""
+        if not self.can_redo():
+            return None
+        self._current = apply_delta(self._current, self._deltas[self._pos][0])
+        self._pos += 1
+        return self._current
+
+    def revert_position(self, label="fit"):
+        """Return the position of the state right before the last label step"""
+        for pos in range(self._pos, 0, -1):
+            if self._labels[pos] == label:
+                return pos - 1
+        return None
+
+    def goto(self, pos):
+        """Undo or redo until we are at pos, and return that state"""
+        while self._pos > pos and self.can_undo():
+            self.undo()
+        while self._pos < pos and self.can_redo():
+            self.redo()
+        return self._current
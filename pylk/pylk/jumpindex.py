@@ -0,0 +1,89 @@
+"""Index of which TOAs are in which JUMP.
+
+The jump membership of a TOA is stored in its flags dictionary, as a comma
+separated list of jump numbers in the "jump" flag. Finding the TOAs of a
+jump used to mean a scan over all flag dictionaries, which the plk widget
+did once per jump (and once per cluster when jumping clusters). The
+JumpIndex keeps the same information as two integer arrays of (TOA index,
+jump number) pairs, so that the TOAs of one or more jumps, and the overlap
+of jumps with a selection, are found with vectorized set operations.
+
+The TOAs are identified by their `index` column, so the index stays valid
+when TOAs are deleted or stashed. It is built once from the flags, and then
+kept up to date by the code that changes the jump flags.
+"""
+import numpy as np
+
+
+class JumpIndex:
+    """Membership of TOAs in JUMPs, as (TOA index, jump number) pairs"""
+
+    def __init__(self, toas=None):
+        """Create the index
+
+        :param toas:    The TOAs to build the index from (None = empty index)
+        """
+        self.toa = np.zeros(0, dtype=int)
+        self.jump = np.zeros(0, dtype=int)
+        if toas is not None:
+            self.rebuild(toas)
+
+    def rebuild(self, toas):
+        """Build the index from the "jump" flags of toas"""
+        toa, jump = [], []
+        for idx, flags in zip(toas.table["index"], toas.table["flags"]):
+            value = flags.get("jump", None)
+            if value:
+                for num in value.split(","):
+                    toa.append(idx)
+                    jump.append(int(num))
+        self.toa = np.array(toa, dtype=int)
+        self.jump = np.array(jump, dtype=int)
+
+    @property
+    def numbers(self):
+        """The jump numbers that have at least one TOA"""
+        return np.unique(self.jump)
+
+    def add(self, num, indices):
+        """Add the TOAs with (TOA) indices to jump num"""
+        indices = np.asarray(indices, dtype=int)
+        new = ~np.isin(indices, self.toa[self.jump == num])
+        self.toa = np.concatenate([self.toa, indices[new]])
+        self.jump = np.concatenate([self.jump, np.full(new.sum(), num, dtype=int)])
+
+    def remove(self, num, indices=None):
+        """Remove the TOAs with (TOA) indices from jump num (None = all TOAs)"""
+        drop = self.jump == num
+        if indices is not None:
+            drop &= np.isin(self.toa, np.asarray(indices, dtype=int))
+        self.toa = self.toa[~drop]
+        self.jump = self.jump[~drop]
+
+    def mask(self, toas, numbers):
+        """Return a boolean array over toas, True = in any of the jumps
+
+        :param toas:    The TOAs (or a table with an index column)
+        :param numbers: A jump number, or a sequence of jump numbers
+        """
+        table = getattr(toas, "table", toas)
+        members = self.toa[np.isin(self.jump, np.atleast_1d(numbers))]
+        return np.isin(np.asarray(table["index"], dtype=int), members)
+
+    def overlap(self, toas, selected, maxnum):
+        """Count the TOAs of every jump, in toas and in the selection
+
+        :param toas:        The TOAs
+        :param selected:    Boolean array over toas, True = selected toa
+        :param maxnum:      The highest jump number to count
+        :return:            Tuple (nvisible, nselected) of arrays of length
+                            maxnum+1: the number of TOAs of every jump in toas,
+                            and in the selected toas
+        """
+        table = getattr(toas, "table", toas)
+        indices = np.asarray(table["index"], dtype=int)
+        visible = np.isin(self.toa, indices) & (self.jump <= maxnum)
+        chosen = visible & np.isin(self.toa, indices[np.asarray(selected, dtype=bool)])
+        nvisible = np.bincount(self.jump[visible], minlength=maxnum + 1)
+        nselected = np.bincount(self.jump[chosen], minlength=maxnum + 1)
+        return nvisible, nselected
@@ -0,0 +1,197 @@
+"""Cache of the correlated noise model of GLS fits.
+
+With red noise or ECORR in the model, every GLS fit iteration builds the
+noise basis (the Fourier design matrix, the ECORR quantization matrix) and
+their weights, scales the TOA uncertainties with EFAC/EQUAD, and every GLS
+chi2 factorizes
+
+    Sigma = Phi^-1 + U^T N^-1 U
+
+for the Woodbury identity. None of that depends on the timing model
+parameters, only on the noise parameters and the TOAs, and the noise
+parameters are usually frozen during interactive timing.
+
+A NoiseCache keeps all of it, keyed by the values of the noise parameters
+and the TOA index column, so that it is only computed again when the noise
+model or the TOAs change. The pint fitters call the noise functions of the
+model directly, so while a fit runs, the fitter model gets instance overrides
+of those functions that look things up in the cache (see `installed`).
+"""
+import contextlib
+import copy
+from collections import OrderedDict
+
+import astropy.units as u
+import numpy as np
+import scipy.linalg
+
+from loguru import logger as log
+
+from pylk.residengine import model_fingerprint
+
+
+# The model functions that a fit can take from the cache
+_cached_functions = [
+    "noise_model_designmatrix",
+    "noise_model_basis_weight",
+    "noise_model_dimensions",
+    "scaled_toa_uncertainty",
+]
+
+
+def noise_params(model):
+    """Return the names of the parameters of the noise components of model"""
+    return [param for component in model.NoiseComponent_list for param in component.params]
+
+
+class _NoiseEntry:
+    """The noise model of one set of noise parameter values and TOAs"""
+
+    def __init__(self, toas, model):
+        self.sigma = model.scaled_toa_uncertainty(toas)
+        parts, self.dimensions, ntot = [], {}, 0
+        # The same order as model.basis_funcs
+        for component in model.NoiseComponent_list:
+            if len(component.basis_funcs) == 0:
+                continue
+            pairs = [basis_func(toas) for basis_func in component.basis_funcs]
+            nbf = sum(len(weights) for _, weights in pairs)
+            self.dimensions[component.category] = (ntot, nbf)
+            ntot += nbf
+            parts += pairs
+        self.basis = np.hstack([basis for basis, _ in parts]) if parts else None
+        self.weights = np.hstack([weights for _, weights in parts]) if parts else None
+        self._factors = {}
+
+    def factor(self, offset):
+        """
+        Return the Woodbury factorization of the noise covariance
+
+        :param offset:  Include an overall offset in the basis, with a very
+                        large weight (like pint does if PHOFF is not fitted)
+        :return:        (U, Ndiag, Sigma factor, log det C)
+        """
+        if offset not in self._factors:
+            U, Phidiag = self.basis, self.weights
+            if offset:
+                U = np.append(U, np.ones((len(U), 1)), axis=1)
+                Phidiag = np.append(Phidiag, [1e40])
+            Ndiag = self.sigma.to_value(u.s) ** 2
+            Sigma = np.diag(1 / Phidiag) + (U.T / Ndiag) @ U
+            cf = scipy.linalg.cho_factor(Sigma)
+            logdet_C = (
+                np.sum(np.log(Ndiag))
+                + np.sum(np.log(Phidiag))
+                + 2 * np.sum(np.log(np.diag(cf[0])))
+            )
+            self._factors[offset] = (U, Ndiag, cf, logdet_C)
+        return self._factors[offset]
+
+
+class NoiseCache:
+    """Noise basis, weights, scaled uncertainties and factorizations
+
+    Only the `maxentries` most recently used noise models and TOA sets are
+    kept (e.g. for all TOAs and for a selection).
+    """
+
+    def __init__(self, maxentries=4):
+        self.maxentries = maxentries
+        self._entries = OrderedDict()
+        self.nbuilt = 0  # Number of times the noise model was computed
+        self.nreused = 0  # Number of times it was taken from the cache
+
+    def clear(self):
+        """Forget all cached noise models"""
+        self._entries.clear()
+
+    def entry(self, toas, model):
+        """Return the cached noise model for toas, computing it if needed"""
+        # Only the noise components count (pint can add AbsPhase at any time)
+        key = (
+            tuple(type(component).__name__ for component in model.NoiseComponent_list),
+            model_fingerprint(model, noise_params(model))[1:],
+            np.asarray(toas.table["index"], dtype=int).tobytes(),
+        )
+        entry = self._entries.get(key, None)
+        if entry is None:
+            log.debug(f"Computing the noise model for {toas.ntoas} TOAs")
+            entry = _NoiseEntry(toas, model)
+            self._entries[key] = entry
+            self.nbuilt += 1
+        else:
+            self.nreused += 1
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxentries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def basis(self, toas, model):
+        """Return the noise basis and weights, like the model functions"""
+        entry = self.entry(toas, model)
+        return entry.basis, entry.weights
+
+    def gls_chi2(self, toas, model, residuals, lognorm=False):
+        """
+        Return the GLS chi2 of residuals, like `Residuals._calc_gls_chi2`
+
+        :param toas:        The TOAs
+        :param model:       The timing model, with correlated noise
+        :param residuals:   The time residuals, in seconds
+        :param lognorm:     Also return the log-normalization of the
+                            likelihood
+        """
+        offset = "PHOFF" not in model.free_params
+        U, Ndiag, cf, logdet_C = self.entry(toas, model).factor(offset)
+        s = np.asarray(residuals, dtype=float)
+        s_Ninv_U = (s / Ndiag) @ U
+        chi2 = np.sum(s * s / Ndiag) - s_Ninv_U @ scipy.linalg.cho_solve(cf, s_Ninv_U)
+        return (chi2, logdet_C / 2) if lognorm else chi2
+
+    @contextlib.contextmanager
+    def installed(self, fitter):
+        """
+        Let the model of fitter take its noise model from the cache
+
+        The overrides are removed from the model of the fitter at the end,
+        also when the fitter replaced its model by a copy (the downhill
+        fitters do that for every step).
+        """
+        model = fitter.model
+        if not model.has_correlated_errors:
+            yield
+            return
+        for name in _cached_functions:
+            setattr(model, name, _CachedFunction(self, name, model))
+        try:
+            yield
+        finally:
+            for fitted in {id(model): model, id(fitter.model): fitter.model}.values():
+                for name in _cached_functions:
+                    fitted.__dict__.pop(name, None)
+
+
+class _CachedFunction:
+    """A noise function of a model, taken from a NoiseCache
+
+    A copy of the model gets a function for the copy, so that the noise
+    parameters of the right model are used.
+    """
+
+    def __init__(self, cache, name, model):
+        self.cache = cache
+        self.name = name
+        self.model = model
+
+    def __deepcopy__(self, memo):
+        return _CachedFunction(self.cache, self.name, copy.deepcopy(self.model, memo))
+
+    def __call__(self, toas):
+        entry = self.cache.entry(toas, self.model)
+        if self.name == "noise_model_designmatrix":
+            return entry.basis
+        elif self.name == "noise_model_basis_weight":
+            return entry.weights
+        elif self.name == "noise_model_dimensions":
+            return dict(entry.dimensions)
+        return entry.sigma.copy()
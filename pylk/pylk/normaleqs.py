@@ -0,0 +1,124 @@
+"""Normal equations of a least-squares fit, kept row by row.
+
+A WLS or GLS fit with uncorrelated white noise, and correlated noise that is
+described by a basis (red noise, ECORR), solves the normal equations
+
+    (M^T N^-1 M + Phi^-1) x = M^T N^-1 r
+
+where every TOA adds one row to M and r. Removing k TOAs from a fit only
+subtracts their rows: a rank-k downdate of the normal matrix. Building the
+design matrix is the expensive part of a fit, so NormalEquations keeps the
+whitened rows of the last fit, and re-solves the system after a downdate
+without evaluating the design matrix again.
+
+The design matrix is linearized around the solution of the last fit. That is
+exact for the parameters that enter the phase linearly (spin frequency and
+derivatives, DM, jumps), and a very good approximation for the others after
+removing a few TOAs. A full fit re-linearizes.
+"""
+import numpy as np
+import scipy.linalg
+
+
+class NormalEquations:
+    """Whitened least-squares system of a fit, with one row per TOA"""
+
+    def __init__(
+        self,
+        indices,
+        designmatrix,
+        params,
+        units,
+        residuals,
+        sigma,
+        noise_basis=None,
+        noise_weights=None,
+    ):
+        """
+        :param indices:         TOA index of every row
+        :param designmatrix:    Design matrix (in seconds per parameter unit),
+                                including the Offset column
+        :param params:          Names of the design matrix columns
+        :param units:           Units of the design matrix columns
+        :param residuals:       Time residuals of the TOAs, in seconds
+        :param sigma:           Scaled TOA uncertainties, in seconds
+        :param noise_basis:     Basis of the correlated noise (or None)
+        :param noise_weights:   Prior variances of the noise basis (or None)
+        """
+        self.indices = np.asarray(indices, dtype=int)
+        self.params = list(params)
+        self.units = list(units)
+        M = np.asarray(designmatrix, dtype=float)
+        prior = np.zeros(M.shape[1])
+        if noise_basis is not None and noise_weights is not None:
+            M = np.hstack([M, noise_basis])
+            prior = np.concatenate([prior, 1.0 / np.asarray(noise_weights)])
+        sigma = np.asarray(sigma, dtype=float)
+        M = M / sigma[:, None]
+        # Normalize the columns, like pint does, for a better conditioned system
+        self.norm = np.sqrt(np.sum(M**2, axis=0))
+        self.norm[self.norm == 0] = 1.0
+        self.M = M / self.norm
+        self.r = np.asarray(residuals, dtype=float) / sigma
+        self.prior = prior / self.norm**2
+        self.A = self.M.T @ self.M + np.diag(self.prior)
+        self.b = self.M.T @ self.r
+        self.x = None  # Solution of the last solve, normalized
+
+    @property
+    def nrows(self):
+        return len(self.indices)
+
+    @property
+    def ncols(self):
+        return self.M.shape[1]
+
+    def remove(self, keep):
+        """
+        Remove rows (TOAs) from the system, with a rank-k downdate
+
+        :param keep:    Boolean array over the rows, False = remove
+        """
+        drop = ~np.asarray(keep, dtype=bool)
+        if np.any(drop):
+            Md, rd = self.M[drop], self.r[drop]
+            self.A -= Md.T @ Md
+            self.b -= Md.T @ rd
+            self.M, self.r = self.M[~drop], self.r[~drop]
+            self.indices = self.indices[~drop]
+
+    def solve(self):
+        """
+        Solve the normal equations
+
+        :return:    (dpars, cov): the parameter steps, and their covariance
+                    matrix, for the design matrix columns (not the noise
+                    basis), in the units of the design matrix
+        """
+        factor = scipy.linalg.cho_factor(self.A)
+        self.x = x = scipy.linalg.cho_solve(factor, self.b)
+        cov = scipy.linalg.cho_solve(factor, np.eye(self.ncols))
+        ntm = len(self.params)
+        norm = self.norm[:ntm]
+        dpars = x[:ntm] / norm
+        cov = (cov[:ntm, :ntm] / norm).T / norm
+        return dpars, cov
+
+    def chi2(self):
+        """
+        Return the chi2 at the solution, after solve
+
+        With a noise basis, that includes the prior of the noise, like the
+        chi2 of a GLS fit.
+        """
+        return float(self.r @ self.r - self.b @ self.x)
+
+    def set_residuals(self, residuals, sigma):
+        """
+        Replace the residuals, after the model changed
+
+        :param residuals:   Time residuals of the TOAs, in seconds
+        :param sigma:       Scaled TOA uncertainties, in seconds
+        """
+        self.r = np.asarray(residuals, dtype=float) / np.asarray(sigma, dtype=float)
+        self.b = self.M.T @ self.r
@@ -0,0 +1,364 @@
+"""pyqtgraph plot view of the plk widget.
+
+Matplotlib renders the plot with Agg, in Python, into an image. Every pan
+or zoom step renders the whole plot again. pyqtgraph keeps the plot in a Qt
+scene graph instead, which Qt paints (with QPainter, so no GPU is needed),
+and panning and zooming only changes the view transform.
+
+This view uses one scatter item and one error bar item per color, and one
+for the selected TOAs on top, all updated in place. The random models are
+one curve item.
+
+Mouse interaction, in select mode:
+
+- left click:       select a TOA
+- right click:      delete a TOA
+- left drag:        select the TOAs in a box
+- right drag:       scale the axes
+- middle drag:      pan
+- mouse wheel:      zoom
+
+In zoom mode, a left drag zooms into a box instead. pyqtgraph is optional:
+import this module only through pylk.plotview.make_plot_view.
+"""
+import numpy as np
+import pyqtgraph as pg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QCursor
+from PyQt5.QtWidgets import QAction, QFileDialog, QGraphicsRectItem, QToolBar
+
+from pylk import constants
+from pylk.plotview import MplPlot, PlotView
+
+from loguru import logger as log
+
+
+def _plain(values):
+    """Return values as a plain float array (dropping any unit)"""
+    return np.asarray(getattr(values, "value", values), dtype=float)
+
+
+def _text(label):
+    """Convert a matplotlib label to pyqtgraph (html) text"""
+    return label.replace(r"$\mu$", "&mu;").replace("$", "")
+
+
+def _qcolor(rgba):
+    return pg.mkColor(*[int(round(255 * c)) for c in rgba])
+
+
+class _PlkViewBox(pg.ViewBox):
+    """ViewBox that selects TOAs with the left mouse button"""
+
+    def __init__(self, view):
+        super(_PlkViewBox, self).__init__()
+        self.view = view
+        self.setMenuEnabled(False)  # The right button deletes TOAs
+        self.selectRect = QGraphicsRectItem()
+        self.selectRect.setPen(pg.mkPen("gray", cosmetic=True))
+        self.selectRect.hide()
+        self.addItem(self.selectRect, ignoreBounds=True)
+
+    def mouseClickEvent(self, ev):
+        if ev.button() in (Qt.LeftButton, Qt.RightButton):
+            ev.accept()
+            pos = self.mapSceneToView(ev.scenePos())
+            button = 1 if ev.button() == Qt.LeftButton else 3
+            log.debug(f"You stationary clicked (button = {button})")
+            self.view.clicked.emit(pos.x(), pos.y(), button)
+        else:
+            super(_PlkViewBox, self).mouseClickEvent(ev)
+
+    def mouseDragEvent(self, ev, axis=None):
+        if ev.button() != Qt.LeftButton or axis is not None or "zoom" in self.view.mode:
+            super(_PlkViewBox, self).mouseDragEvent(ev, axis=axis)
+            return
+        ev.accept()
+        rect = QRectF(
+            self.mapSceneToView(ev.buttonDownScenePos()),
+            self.mapSceneToView(ev.scenePos()),
+        ).normalized()
+        if ev.isFinish():
+            self.selectRect.hide()
+            log.debug(f"You clicked and dragged in mode '{self.view.mode}'")
+            self.view.boxSelected.emit(
+                rect.left(), rect.right(), rect.top(), rect.bottom()
+            )
+        else:
+            self.selectRect.setRect(rect)
+            self.selectRect.show()
+
+    def keyPressEvent(self, ev):
+        # All keys are shortcuts of the plk widget
+        ev.ignore()
+
+
+class _PlkPlotWidget(pg.PlotWidget):
+    """PlotWidget that reports key presses with the mouse position"""
+
+    def __init__(self, view, **kwargs):
+        super(_PlkPlotWidget, self).__init__(**kwargs)
+        self.view = view
+        self.setFocusPolicy(Qt.StrongFocus)
+
+    def mousePressEvent(self, ev):
+        self.setFocus()
+        super(_PlkPlotWidget, self).mousePressEvent(ev)
+
+    def paintEvent(self, ev):
+        super(_PlkPlotWidget, self).paintEvent(ev)
+        self.view.timer.frame()
+
+    def keyPressEvent(self, ev):
+        scenePos = self.mapToScene(self.mapFromGlobal(QCursor.pos()))
+        viewBox = self.getPlotItem().getViewBox()
+        x, y = None, None
+        if viewBox.sceneBoundingRect().contains(scenePos):
+            pos = viewBox.mapSceneToView(scenePos)
+            x, y = pos.x(), pos.y()
+        modifiers = int(ev.modifiers())
+        if ev.text() and ev.text().isprintable():
+            # Like matplotlib: shift is part of the character, not a modifier
+            modifiers &= ~int(Qt.ShiftModifier | Qt.KeypadModifier)
+        self.view.keyPressed.emit(ev.key(), modifiers, x, y)
+        ev.accept()
+
+
+class _Layer:
+    """The points and error bars of one color"""
+
+    def __init__(self, plotItem, z):
+        self.errors = pg.ErrorBarItem(beam=0)
+        self.points = pg.ScatterPlotItem(pxMode=True, size=4, pen=None)
+        self.errors.setZValue(z)
+        self.points.setZValue(z + 0.1)
+        plotItem.addItem(self.errors)
+        plotItem.addItem(self.points)
+        self.rgba = None
+        self.npoints = 0
+
+    def remove(self, plotItem):
+        plotItem.removeItem(self.errors)
+        plotItem.removeItem(self.points)
+
+    def update(self, x, y, yerr, rgba):
+        if rgba != self.rgba:
+            color = _qcolor(rgba)
+            self.points.setBrush(pg.mkBrush(color))
+            self.errors.setData(pen=pg.mkPen(color, cosmetic=True))
+            self.rgba = rgba
+        self.points.setData(x=x, y=y)
+        self.npoints = len(x)
+        if yerr is None:
+            self.errors.setData(x=np.zeros(0), y=np.zeros(0), height=np.zeros(0))
+        else:
+            self.errors.setData(x=x, y=y, height=2 * yerr)
+
+
+class PgPlotView(PlotView):
+    """Plot view on a pyqtgraph canvas"""
+
+    name = "pyqtgraph"
+
+    def __init__(self, parent=None):
+        super(PgPlotView, self).__init__(parent)
+
+        self.zoom = False
+        self.viewBox = _PlkViewBox(self)
+        self.widget = _PlkPlotWidget(self, parent=parent, viewBox=self.viewBox)
+        self.plotItem = self.widget.getPlotItem()
+        self.plotItem.hideButtons()
+        self.plotItem.showGrid(x=True, y=True, alpha=0.3)
+        for side in ("bottom", "top"):
+            self.plotItem.getAxis(side).enableAutoSIPrefix(False)
+
+        self.toolbar = QToolBar(parent)
+        self.toolbar.addAction("Home", self.home.emit)
+        self.zoomAction = QAction("Zoom", self.toolbar)
+        self.zoomAction.setCheckable(True)
+        self.zoomAction.toggled.connect(self.setZoom)
+        self.toolbar.addAction(self.zoomAction)
+        self.toolbar.addAction("Save", self.saveFigDialog)
+
+        self.layers = {}  # Key (RGBA color, or "selected") -> _Layer
+        self.lines = []
+        self.curves = pg.PlotDataItem()
+        self.curves.setZValue(20)
+        self.plotItem.addItem(self.curves, ignoreBounds=True)
+        self.ghost = pg.ScatterPlotItem(size=4, pen=None)
+        self.ghost.setZValue(-10)
+        self.plotItem.addItem(self.ghost, ignoreBounds=True)
+
+        # What is shown, to draw it again with matplotlib for export
+        self.shown = {
+            "residuals": None,
+            "axes": None,
+            "lines": [],
+            "curves": None,
+            "ghost": None,
+        }
+
+    @property
+    def mode(self):
+        return "zoom" if self.zoom else ""
+
+    def setZoom(self, zoom):
+        self.zoom = zoom
+        self.viewBox.setMouseMode(pg.ViewBox.RectMode if zoom else pg.ViewBox.PanMode)
+
+    def toggleZoom(self):
+        self.zoomAction.setChecked(not self.zoom)
+
+    def clear(self, xlabel, ylabel):
+        for layer in self.layers.values():
+            layer.remove(self.plotItem)
+        self.layers = {}
+        self.setLines([])
+        self.setCurves(None, None, None, None)
+        self.setGhost(None, None, None, None)
+        self.plotItem.setLabel("bottom", _text(xlabel))
+        self.plotItem.setLabel("left", _text(ylabel))
+        self.shown = {
+            "residuals": None,
+            "axes": None,
+            "lines": [],
+            "curves": None,
+            "ghost": None,
+        }
+
+    def limits(self):
+        (xmin, xmax), (ymin, ymax) = self.viewBox.viewRange()
+        return xmin, xmax, ymin, ymax
+
+    def setResiduals(self, x, y, yerr, index, colors, selected, selected_color):
+        x, y = _plain(x), _plain(y)
+        yerr = None if yerr is None else _plain(yerr)
+        index = np.asarray(index, dtype=int)
+        selected = np.asarray(selected, dtype=bool)
+        self.shown["residuals"] = (x, y, yerr, index, colors, selected, selected_color)
+
+        # One layer per distinct color: group the TOAs by color with one sort
+        # (the extra -1 at the end is where the TOAs with index -1 end up)
+        rgbas = {}
+        layer = np.array(
+            [rgbas.setdefault(to_rgba(color), len(rgbas)) for color in colors] + [-1]
+        )[index]
+        order = np.argsort(layer, kind="stable")
+        starts = np.searchsorted(layer[order], np.arange(len(rgbas) + 1))
+        members = {rgba: order[starts[k] : starts[k + 1]] for rgba, k in rgbas.items()}
+        members["selected"] = np.flatnonzero(selected)
+
+        for key in list(self.layers):
+            if key not in members or len(members[key]) == 0:
+                self.layers.pop(key).remove(self.plotItem)
+        for key, mask in members.items():
+            if len(mask) == 0:
+                continue
+            if key not in self.layers:
+                self.layers[key] = _Layer(self.plotItem, 10 if key == "selected" else 0)
+            rgba = to_rgba(selected_color) if key == "selected" else key
+            self.layers[key].update(
+                x[mask], y[mask], None if yerr is None else yerr[mask], rgba
+            )
+
+    def setAxes(self, limits, xlabel, ylabel, title, x2=None, y2=None):
+        self.shown["axes"] = (limits, xlabel, ylabel, title, x2, y2)
+        xmin, xmax, ymin, ymax = limits
+        self.viewBox.setRange(xRange=(xmin, xmax), yRange=(ymin, ymax), padding=0)
+        self.plotItem.setLabel("bottom", _text(xlabel))
+        self.plotItem.setLabel("left", _text(ylabel))
+        self.plotItem.setTitle(title)
+        for side, secondary in (("top", x2), ("right", y2)):
+            if secondary is None:
+                self.plotItem.hideAxis(side)
+            else:
+                label, scale = secondary
+                self.plotItem.showAxis(side)
+                axis = self.plotItem.getAxis(side)
+                axis.setLabel(_text(label))
+                axis.setScale(scale)
+
+    def setLines(self, lines):
+        self.shown["lines"] = lines
+        for item in self.lines:
+            self.plotItem.removeItem(item)
+        self.lines = []
+        for x, y, color, alpha in lines:
+            item = pg.PlotDataItem(
+                _plain(x), _plain(y), pen=pg.mkPen(_qcolor(to_rgba(color, alpha)))
+            )
+            item.setZValue(20)
+            self.plotItem.addItem(item, ignoreBounds=True)
+            self.lines.append(item)
+
+    def setCurves(self, x, ys, color, alpha):
+        shown = self.shown["curves"]
+        if x is None:
+            self.shown["curves"] = None
+            self.curves.setData([], [])
+            return
+        self.shown["curves"] = (x, ys, color, alpha)
+        self.curves.setPen(pg.mkPen(_qcolor(to_rgba(color, alpha))))
+        if shown is not None and shown[0] is x and shown[1] is ys:
+            return
+        # One item for all curves, not connected from the end of one curve to
+        # the start of the next
+        ncurves, n = ys.shape
+        connect = np.ones(ncurves * n, dtype=bool)
+        connect[n - 1 :: n] = False
+        self.curves.setData(np.tile(x, ncurves), ys.ravel(), connect=connect)
+
+    def setGhost(self, x, y, color, alpha):
+        if x is None:
+            self.shown["ghost"] = None
+            self.ghost.setData(x=np.zeros(0), y=np.zeros(0))
+            return
+        x, y = _plain(x), _plain(y)
+        self.shown["ghost"] = (x, y, color, alpha)
+        self.ghost.setData(x=x, y=y, brush=pg.mkBrush(_qcolor(to_rgba(color, alpha))))
+
+    def draw(self):
+        # The scene graph repaints itself (in the next frame, not timed here)
+        pass
+
+    def stats(self):
+        points = sum(layer.npoints for layer in self.layers.values())
+        if self.shown["curves"] is not None:
+            points += self.shown["curves"][1].size
+        if self.shown["ghost"] is not None:
+            points += len(self.shown["ghost"][0])
+        return len(self.plotItem.items), points
+
+    def resetHistory(self):
+        pass
+
+    def savefig(self, filename):
+        """Save the plot to a file, drawn with matplotlib"""
+        figure = Figure(constants.plk_figsize_inch, dpi=constants.plk_figure_dpi)
+        FigureCanvasAgg(figure)
+        plot = MplPlot(figure)
+        if self.shown["residuals"] is not None:
+            plot.setResiduals(*self.shown["residuals"])
+        if self.shown["axes"] is not None:
+            limits, xlabel, ylabel, title, x2, y2 = self.shown["axes"]
+            # Export what is in view now
+            plot.setAxes(self.limits(), xlabel, ylabel, title, x2=x2, y2=y2)
+        plot.setLines(self.shown["lines"])
+        if self.shown["curves"] is not None:
+            plot.setCurves(*self.shown["curves"])
+        if self.shown["ghost"] is not None:
+            plot.setGhost(*self.shown["ghost"])
+        figure.tight_layout()
+        figure.savefig(filename)
+
+    def saveFigDialog(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self.widget, "Save the figure", "", "Images (*.png *.pdf *.svg);;All files (*)"
+        )
+        if filename:
+            log.info(f"Saving the figure to {filename}")
+            self.savefig(filename)
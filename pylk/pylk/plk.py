@@ -26,12 +26,16 @@ Right click     Delete a TOA (if close enough)
   c             Print the postfit model parameter correlation matrix
   s             Print summary / derived parameters about the pulsar
   m             Print the range of MJDs with the highest density of TOAs
+  e             Print which frozen parameter to fit next (an F-test for each)
 space           Print info about highlighted points (or all, if none are selected)
   x             Print chi^2 and rms info about highlighted points (or all, if none are selected)
   + (or =)      Increase pulse number for selected TOAs
   - (or _)      Decrease pulse number for selected TOAs
   > (or .)      Increase pulse number for TOAs to the right (i.e. later) of selection
   < (or ,)      Decrease pulse number for TOAs to the right (i.e. later) of selection
+  ctrl+z        Undo the last change (fit, delete, jump, stash, phase wrap)
+  ctrl+y        Redo the last undone change
+  ctrl+t        Show or hide the redraw timing overlay
   q             Quit
   h             Print help
 
@@ -58,17 +62,18 @@ from PyQt5.QtWidgets import (
     QLabel,
     QRadioButton,
     QComboBox,
+    QSpinBox,
+    QFileDialog,
 )
 
 # All the Qt keys we want to bind
 from PyQt5.QtCore import Qt
 
+# For running fits on a worker thread
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+
 # Importing all the stuff for the matplotlib widget
 import matplotlib as mpl
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
-from matplotlib.figure import Figure
-from matplotlib.patches import Rectangle
 import matplotlib.pyplot as plt
 from cycler import cycler
 
@@ -81,49 +86,17 @@ from pylk import colormodes as cm
 #import pint.pintk.colormodes as cm
 #from pylk import pulsar   # Not used anymore
 from pylk import constants
+from pylk.explorer import explore_params, print_explore_table
+from pylk.export import PlotSnapshot, export_filename, export_formats, export_snapshots
+from pylk.fitsession import INCREMENTAL_FITTERS
+from pylk.journal import Journal, DEFAULT_BUDGET
+from pylk.plotview import make_plot_view
+from pylk.pointindex import PointIndex
 
 import pint.logging
 from loguru import logger as log
 
 
-# Mapping from Matplotlib key strings to Qt key constants
-key_map = {
-    "control": Qt.ControlModifier,
-    "ctrl": Qt.ControlModifier,
-    "alt": Qt.AltModifier,
-    "shift": Qt.ShiftModifier,
-    "super": Qt.MetaModifier,
-    "cmd": Qt.MetaModifier,
-    "up": Qt.Key_Up,
-    "down": Qt.Key_Down,
-    "left": Qt.Key_Left,
-    "right": Qt.Key_Right,
-    "enter": Qt.Key_Return,
-    "return": Qt.Key_Return,
-    "backspace": Qt.Key_Backspace,
-    "escape": Qt.Key_Escape,
-    "f1": Qt.Key_F1,
-    "f2": Qt.Key_F2,
-    "f3": Qt.Key_F3,
-    "f4": Qt.Key_F4,
-    "f5": Qt.Key_F5,
-    "f6": Qt.Key_F6,
-    "f7": Qt.Key_F7,
-    "f8": Qt.Key_F8,
-    "f9": Qt.Key_F9,
-    "f10": Qt.Key_F10,
-    "f11": Qt.Key_F11,
-    "f12": Qt.Key_F12,
-    "underscore": Qt.Key_Underscore,
-    "minus": Qt.Key_Minus,
-    "plus": Qt.Key_Plus,
-    "equal": Qt.Key_Equal,
-    "less": Qt.Key_Less,
-    "greater": Qt.Key_Greater,
-    "comma": Qt.Key_Comma,
-    "period": Qt.Key_Period,
-    "space": Qt.Key_Space,
-}
 
 plotlabels = {
     "pre-fit": [
@@ -188,12 +161,16 @@ Right click     Delete a TOA (if close enough)
   c             Print the postfit model parameter correlation matrix
   s             Print summary / derived parameters about the pulsar
   m             Print the range of MJDs with the highest density of TOAs
+  e             Print which frozen parameter to fit next (an F-test for each)
 space           Print info about highlighted points (or all, if none are selected)
   x             Print chi^2 and rms info about highlighted points (or all, if none are selected)
   + (or =)      Increase pulse number for selected TOAs
   - (or _)      Decrease pulse number for selected TOAs
   > (or .)      Increase pulse number for TOAs to the right (i.e. later) of selection
   < (or ,)      Decrease pulse number for TOAs to the right (i.e. later) of selection
+  ctrl+z        Undo the last change (fit, delete, jump, stash, phase wrap)
+  ctrl+y        Redo the last undone change
+  ctrl+t        Show or hide the redraw timing overlay
   q             Quit
   h             Print help
 """
@@ -222,11 +199,6 @@ foreground = "black"
 background = "#E9E9E9"
 
 
-class State:
-    """class used by revert to save the state of the system before each fit"""
-
-    pass
-
 # This is the old design philosopy. Take with a grain of salt
 #
 # Design philosophy:
@@ -244,25 +216,6 @@ class State:
 # any further data.
 # TODO: remove dependence on psr object in child widgets
 
-def mpl_key_to_qt_key(mpl_key):
-    """Convert a Matplotlib key string to a Qt key constant"""
-    qt_key = 0
-    qt_mod = Qt.NoModifier
-
-    keys = mpl_key.split("+")
-
-    for key in keys:
-        if key in key_map:
-            if key in ["control", "ctrl", "alt", "shift", "super", "cmd"]:
-                qt_mod |= key_map[key]
-            else:
-                qt_key = key_map[key]
-        elif len(key) == 1:
-            qt_key = ord(key.upper())
-
-    return qt_key, qt_mod
-
-
 class PlkFitboxesWidget(QWidget):
     """A widget that allows one to select which parameters to fit for"""
 
@@ -436,21 +389,33 @@ class PlkRandomModelSelect(QFrame):
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.checkbox = None
+        self.nmodelsBox = None
         self.modeLabel = None
 
     def addRandomCheckbox(self, parent):
+        # Keep the settings when the widgets are re-created
+        checked = self.checkbox is not None and self.checkbox.isChecked()
+        nmodels = 15 if self.nmodelsBox is None else self.nmodelsBox.value()
         self.clear_layout()
         self.checkbox = QCheckBox(
             "Random Models",
             self
         )
+        self.checkbox.setChecked(checked)
         self.checkbox.stateChanged.connect(self.changedRMCheckBox)
         self.layout.addWidget(self.checkbox)
 
+        self.nmodelsBox = QSpinBox(self)
+        self.nmodelsBox.setRange(1, 1000)
+        self.nmodelsBox.setValue(nmodels)
+        self.nmodelsBox.setPrefix("N = ")
+        self.nmodelsBox.setToolTip("Number of random models to compute")
+        self.layout.addWidget(self.nmodelsBox)
+
         # You need to create a custom class or function for tooltip
         # checkbox_ttp = CreateToolTip(checkbox, "Display random timing models consistent with selected TOAs.")
 
-        if "zoom" in parent.plkToolbar.mode:
+        if "zoom" in parent.plotView.mode:
             self.modeLabel = QLabel("Mode: Zoom", self)
         else:
             self.modeLabel = QLabel("Mode: Select", self)
@@ -477,6 +442,9 @@ class PlkRandomModelSelect(QFrame):
     def getRandomModel(self):
         return self.checkbox.isChecked()
 
+    def getNumberOfModels(self):
+        return self.nmodelsBox.value()
+
     def changeMode(self, mode):
         if "zoom" in mode:
             self.modeLabel.setText("Mode: Zoom")
@@ -534,6 +502,14 @@ class PlkFitterSelect(QWidget):
         self.layout.addWidget(self.fitterSelect)
         self.fitterSelect.addItems([])  # initially empty
         self.fitterSelect.currentIndexChanged.connect(self.changeFitter)
+
+        self.incremental = False
+        self.incrementalCheck = QCheckBox("Incremental", self)
+        self.incrementalCheck.setToolTip(
+            "After removing TOAs, update the last fit instead of re-fitting"
+        )
+        self.layout.addWidget(self.incrementalCheck)
+        self.incrementalCheck.stateChanged.connect(self.changeIncremental)
     
     def updateFitterChoices(self, wideband):
         self.fitterSelect.clear()
@@ -541,8 +517,13 @@ class PlkFitterSelect(QWidget):
 
     def changeFitter(self):
         self.fitter = self.fitterSelect.currentText()
+        self.incrementalCheck.setEnabled(self.fitter in INCREMENTAL_FITTERS)
         log.info(f"Selected {self.fitter}")
 
+    def changeIncremental(self, state):
+        self.incremental = state == Qt.Checked
+        log.info(f"Incremental re-fits {'on' if self.incremental else 'off'}")
+
 
 class PlkColorModeBoxes(QWidget):
     """
@@ -719,33 +700,239 @@ class PlkXYChoiceWidget(QWidget):
         if self.updatePlot is not None:
             self.updatePlot()
 
-class PlkToolbar(NavigationToolbar2QT):
+class PlkFitWorker(QObject):
     """
-    A modification of the stock Matplotlib toolbar to perform the
-    necessary selections/un-selections on points
+    Runs a fit of the pulsar on a worker thread, so the GUI stays responsive
     """
 
-    toolitems = [t for t in NavigationToolbar2QT.toolitems if t[0] in ("Home", "Back", "Forward", "Pan", "Zoom", "Save")]
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(bool)
+    failed = pyqtSignal(str)
 
-    def __init__(self, *args, **kwargs):
-        super(PlkToolbar, self).__init__(*args, **kwargs)
+    def __init__(self, psr, selected, compute_random=False, parent=None):
+        super(PlkFitWorker, self).__init__(parent)
 
-        self.setIconSize(QtCore.QSize(16, 16))
-        self.set_actions()
+        self.psr = psr
+        self.selected = selected
+        self.compute_random = compute_random
+        self.cancel_requested = False
 
-    def set_actions(self):
-        for action in self.actions():
-            if action.text() == 'Home':
-                action.triggered.connect(self.updatePlot)
-        
-        self.homeCallback = None
+    def run(self):
+        """Run the fit, and emit finished(True) unless cancelled or failed"""
+        try:
+            done = self.psr.fit(
+                self.selected,
+                compute_random=self.compute_random,
+                progress=self.progress.emit,
+                cancelled=lambda: self.cancel_requested,
+            )
+        except Exception as e:
+            log.exception("Fit failed")
+            self.failed.emit(str(e))
+            done = False
+        self.finished.emit(done)
 
-    def setHomeCallback(self, homeCallback):
-        self.homeCallback = homeCallback
+    def cancel(self):
+        """Cancel the fit after the current iteration"""
+        self.cancel_requested = True
+
+
+class PlkExploreWorker(QObject):
+    """
+    Fits candidate parameters on a worker thread, so the GUI stays responsive
+
+    The worker only gets copies of the TOAs and the model (see
+    `Pulsar.explore_snapshot`), never the pulsar itself.
+    """
+
+    finished = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, toas, model, fit_method, candidates, parent=None):
+        super(PlkExploreWorker, self).__init__(parent)
+
+        self.toas = toas
+        self.model = model
+        self.fit_method = fit_method
+        self.candidates = candidates
+
+    def run(self):
+        """Fit the candidates, and emit finished with the results"""
+        results = []
+        try:
+            results = explore_params(
+                self.toas, self.model, self.fit_method, candidates=self.candidates
+            )
+            print_explore_table(results)
+        except Exception as e:
+            log.exception("Exploring the parameters failed")
+            self.failed.emit(str(e))
+        self.finished.emit(results)
+
+
+class PlkExportWorker(QObject):
+    """
+    Renders plot snapshots to files on a worker thread, so the GUI stays
+    responsive
+    """
+
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(list)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, jobs, dpi=None, parent=None):
+        """
+        :param jobs:    List of (PlotSnapshot, filename) pairs
+        :param dpi:     Resolution (default: constants.plk_export_dpi)
+        """
+        super(PlkExportWorker, self).__init__(parent)
+
+        self.jobs = jobs
+        self.dpi = dpi
+        self.cancel_requested = False
+
+    def run(self):
+        """
+        Render all snapshots, and emit finished with the files written. Files
+        that cannot be written are reported with failed, and skipped
+        """
+        written = export_snapshots(
+            self.jobs,
+            dpi=self.dpi,
+            progress=self.progress.emit,
+            cancelled=lambda: self.cancel_requested,
+            failed=self.failed.emit,
+        )
+        self.finished.emit(written)
+
+    def cancel(self):
+        """Cancel the export after the current file"""
+        self.cancel_requested = True
+
+
+class PlkRedrawScheduler(QObject):
+    """
+    Merges all redraw requests from one event loop turn into a single redraw
+
+    A single user action often asks for several redraws (e.g. setting the
+    x/y choice redraws, and so does the action itself). Requests only mark
+    the plot dirty, and the redraw happens once control returns to the
+    event loop.
+    """
+
+    def __init__(self, redraw, parent=None):
+        """
+        :param redraw:  Function that redraws the plot, given keepAxes
+        :param parent:  Parent QObject
+        """
+        super(PlkRedrawScheduler, self).__init__(parent)
+
+        self.redraw = redraw
+        self.dirty = False
+        self.held = False   # No redraws while held (see hold)
+        self.keepAxes = True
+        self.requested = 0  # Number of redraw requests
+        self.drawn = 0      # Number of actual redraws
+        self.pending = 0    # Number of requests since the last redraw
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+    @property
+    def saved(self):
+        """Number of redraws saved by merging requests"""
+        return self.requested - self.drawn
+
+    def request(self, keepAxes=False):
+        """
+        Mark the plot dirty. The axes are only kept if all merged requests
+        want to keep them
+        """
+        self.requested += 1
+        self.pending += 1
+        self.keepAxes = keepAxes if not self.dirty else self.keepAxes and keepAxes
+        if not self.dirty:
+            self.dirty = True
+            self.timer.start()
+
+    def hold(self, held):
+        """
+        Hold back all redraws (e.g. while a fit changes the pulsar on another
+        thread), or release them. Requests made while held are merged into
+        one redraw after the release
+        """
+        self.held = held
+        if not held and self.dirty:
+            self.timer.start()
+
+    def flush(self):
+        """Redraw now, if the plot is dirty and not held"""
+        self.timer.stop()
+        if not self.dirty or self.held:
+            return
+        self.drawn += 1
+        if self.pending > 1:
+            log.debug(
+                f"Merged {self.pending} redraw requests "
+                f"({self.saved} of {self.requested} redraws saved)"
+            )
+        self.dirty = False
+        self.pending = 0
+        self.redraw(self.keepAxes)
+
+
+class PlkTimingHud(QLabel):
+    """
+    Overlay on the plot with the timing of the last redraw
+
+    Shows how long every stage of the last redraw took, the rolling frame
+    rate (which includes the frames during drags), and the number of artists
+    and points in the plot. While shown, it is refreshed a few times per
+    second rather than on every frame, so that it does not slow down what it
+    measures.
+    """
+
+    def __init__(self, plotView, parent=None):
+        """
+        :param plotView:    The plot view, with the frame timer
+        :param parent:      Parent widget (the plot canvas)
+        """
+        super(PlkTimingHud, self).__init__(parent)
+        self.plotView = plotView
+        # Opaque, so that refreshing it does not repaint the plot below
+        self.setAutoFillBackground(True)
+        self.setStyleSheet(
+            "background-color: black; color: lime; font-family: monospace; "
+            "font-size: 9pt; padding: 4px"
+        )
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.timer = QTimer(self)
+        self.timer.setInterval(constants.plk_hud_interval_ms)
+        self.timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def toggle(self):
+        """Show or hide the overlay"""
+        if self.isVisible():
+            self.timer.stop()
+            self.hide()
+        else:
+            self.refresh()
+            self.show()
+            self.raise_()
+            self.timer.start()
+
+    def refresh(self):
+        """Show the current timings"""
+        artists, points = self.plotView.stats()
+        lines = self.plotView.timer.summary()
+        lines.append(f"artists {artists:7d}")
+        lines.append(f"points  {points:7d}")
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(8, 8)
 
-    def updatePlot(self):
-        if self.homeCallback:
-            self.homeCallback()
 
 class PlkActionsWidget(QWidget):
     """
@@ -784,32 +971,39 @@ class PlkActionsWidget(QWidget):
         button.clicked.connect(self.revert)
         button.setToolTip('Undo the last model fit.')
         self.hbox.addWidget(button)
+        self.editbuttons = [button]
 
         button = QPushButton('Write par')
         button.clicked.connect(self.writePar)
         button.setToolTip('Write the post-fit parfile to a file of your choice.')
         self.hbox.addWidget(button)
+        self.editbuttons.append(button)
 
         button = QPushButton('Write tim')
         button.clicked.connect(self.writeTim)
         button.setToolTip('Write the current TOAs table to a .tim file of your choice.')
         self.hbox.addWidget(button)
+        self.editbuttons.append(button)
 
         button = QPushButton('Reset')
         button.clicked.connect(self.reset)
         button.setToolTip('Reset everything to the beginning of the session.  Be Careful!')
         self.hbox.addWidget(button)
+        self.editbuttons.append(button)
 
-        #button = QPushButton('Save fig')
-        #button.clicked.connect(self.saveFig)
-        #button.setToolTip('Save the current figure to file')
-        #self.hbox.addWidget(button)
+        self.savebutton = QPushButton('Save fig')
+        self.savebutton.clicked.connect(self.saveFig)
+        self.savebutton.setToolTip('Save the current figure to file (PNG, PDF or SVG)')
+        self.hbox.addWidget(self.savebutton)
+        self.editbuttons.append(self.savebutton)
 
         self.hbox.addStretch(1)
 
         self.setLayout(self.hbox)
 
-    def setCallbacks(self, updatePlot, fit, reset, writePar, writeTim, revert):
+    def setCallbacks(
+        self, updatePlot, fit, reset, writePar, writeTim, revert, saveFig=None
+    ):
         """Callback functions"""
 
         self.updatePlot = updatePlot
@@ -819,10 +1013,30 @@ class PlkActionsWidget(QWidget):
         self.writePar_callback = writePar
         self.writeTim_callback = writeTim
         self.reset_callback = reset
+        self.saveFig_callback = saveFig
 
     def setFitButtonText(self, text):
         self.fitbutton.setText(text)
 
+    def setFitRunning(self, running):
+        """While a fit runs, the fit button cancels it, and other actions wait"""
+        for button in self.editbuttons:
+            button.setEnabled(not running)
+        if running:
+            self.fitbutton.setText("Cancel")
+            self.fitbutton.setToolTip("Cancel the running fit.")
+        else:
+            self.fitbutton.setToolTip("Fit the selected TOAs to the current model.")
+
+    def setExportRunning(self, running):
+        """While an export runs, the save button cancels it"""
+        if running:
+            self.savebutton.setText("Cancel export")
+            self.savebutton.setToolTip("Cancel the running export.")
+        else:
+            self.savebutton.setText("Save fig")
+            self.savebutton.setToolTip("Save the current figure to file (PNG, PDF or SVG)")
+
     def fit(self):
         if self.fit_callback is not None:
             self.fit_callback()
@@ -849,6 +1063,8 @@ class PlkActionsWidget(QWidget):
         log.info("Reset clicked")
 
     def saveFig(self):
+        if self.saveFig_callback is not None:
+            self.saveFig_callback()
         log.info("saveFig clicked")
 
 
@@ -856,10 +1072,11 @@ class PlkActionsWidget(QWidget):
 
 class PlkWidget(QWidget):
 
-    def __init__(self, parent=None, **kwargs):
+    def __init__(self, parent=None, plot_backend="matplotlib", **kwargs):
         super(PlkWidget, self).__init__(parent, **kwargs)
 
         self.parent = parent
+        self.plot_backend = plot_backend  # See pylk.plotview.plot_backends
 
         self.init_loglevel = kwargs.get("loglevel", None)
         self.initSettings()
@@ -878,13 +1095,20 @@ class PlkWidget(QWidget):
         self.saveFig_callback = None
 
         self.psr = None
-        self.current_state = State()
-        self.state_stack = []
+        self.fitRunning = False
+        self.fitThread = None
+        self.fitWorker = None
+        self.exportThread = None
+        self.exportWorker = None
+        self.exploreThread = None
+        self.exploreWorker = None
+        self.journal = None
+        self.undo_budget = DEFAULT_BUDGET  # Memory budget of the undo journal
         self.update_callbacks = None
 
-        self.rect = Rectangle((0, 0), 0, 0, fill=False)
-        self.press = False
-        self.move = False
+        self.redrawScheduler = PlkRedrawScheduler(self.redrawPlot, parent=self)
+        self.pointIndex = None  # Spatial index of the plotted points
+        self.fitPreview = None  # Predicted fit for the current fit checkboxes
 
         self.color_modes = [
             cm.DefaultMode(self),
@@ -913,43 +1137,22 @@ class PlkWidget(QWidget):
         self.fitterWidget = PlkFitterSelect(parent=self)
         self.colorModeWidget = PlkColorModeBoxes(parent=self)
 
-        # Create the mpl Figure and FigCanvas objects. 
-        # To start: 5x4 inches, 100 dots-per-inch
+        # The plot is shown by a plot view (matplotlib, or pyqtgraph)
         # We also 'frame' the Canvas, just for looks
-        self.plkFig = Figure(constants.plk_figsize_inch,
-                             dpi=constants.plk_figure_dpi)
         self.canvasbox = QVBoxLayout()
         self.canvasbox_inside = QVBoxLayout()
         self.plkCanvasFrame = QFrame(self)
         self.plkCanvasFrame.setFrameStyle(QFrame.Panel | QFrame.Sunken)
         self.plkCanvasFrame.setLineWidth(constants.plk_figure_frame_lw)
         self.plkCanvasFrame.setMidLineWidth(constants.plk_figure_frame_mlw)
-        self.plkCanvas = FigureCanvas(self.plkFig)
-        self.plkCanvas.setParent(self.plkCanvasFrame)
-        self.plkToolbar = PlkToolbar(self.plkCanvas, self)
-        
-        # Call-back functions for clicking and key-press.
-        # This is a GUI-independent way of dealing with events. Matplotlib
-        # provides that for portability. However, in Qt, we would have more
-        # flexibility if we subclass 'FigureCanvas' instead. Then we can just
-        # overload 'mousePressEvent', 'mouseMoveEvent' etc. However, we stay
-        # close to the pintk way of doing things for now
-        self.plkCanvas.mpl_connect('button_press_event', self.canvasClickEvent)
-        self.plkCanvas.mpl_connect("button_release_event", self.canvasReleaseEvent)
-        self.plkCanvas.mpl_connect("motion_notify_event", self.canvasMotionEvent)
-        self.plkCanvas.mpl_connect("key_press_event", self.canvasKeyEvent)
-
-        # Since we have only one plot, we could use add_axes 
-        # instead of add_subplot, but then the subplot
-        # configuration tool in the navigation toolbar wouldn't
-        # work.
-        self.plkAxes = self.plkFig.add_subplot(111)
-        self.plkAx2x = self.plkAxes.twinx()
-        self.plkAx2y = self.plkAxes.twiny()
-        self.plkAxes.set_zorder(0.1)
+
         # We are creating the Figure here, so set the color scheme appropriately
         self.setColorScheme(True)
-
+        self.plotView = make_plot_view(self.plot_backend, parent=self)
+        self.plotView.clicked.connect(self.stationaryClick)
+        self.plotView.boxSelected.connect(self.clickAndDrag)
+        self.plotView.keyPressed.connect(self.canvasKeyEvent)
+        self.timingHud = PlkTimingHud(self.plotView, parent=self.plotView.widget)
 
         # Done creating the Figure. Restore color scheme to defaults
         self.setColorScheme(False)
@@ -969,8 +1172,7 @@ class PlkWidget(QWidget):
         self.layoutMode = 1    # (0 = none, 1 = all, 2 = only xy select, 3 = only fit, 4 = xy select & fit)
 
         # This makes the "Home" button reset the plot just like the 'k' key
-        #self.plkToolbar.children["!button"].config(command=self.updatePlot)
-        self.plkToolbar.setHomeCallback(self.handleKeyK)
+        self.plotView.home.connect(self.handleKeyK)
 
     def drawSomething(self):
         """
@@ -978,13 +1180,7 @@ class PlkWidget(QWidget):
         an empty figure
         """
         self.setColorScheme(True)
-        self.plkAxes.clear()
-        self.plkAxes.grid(True)
-        self.plkAxes.set_xlabel('MJD')
-        self.plkAxes.set_ylabel('Residual ($\mu$s)')
-        self.plkFig.tight_layout()
-        self.plkToolbar.push_current()
-        self.plkCanvas.draw()
+        self.plotView.clear('MJD', 'Residual ($\mu$s)')
         self.setColorScheme(False)
 
     def initPlkLayout(self):
@@ -1000,11 +1196,11 @@ class PlkWidget(QWidget):
         # Initialize the canvasbox inside the frame
         # Use a margin of 10 pixels to not overlap with the frame
         self.canvasbox_inside.setContentsMargins(3,3,3,3)
-        self.canvasbox_inside.addWidget(self.plkCanvas)
+        self.canvasbox_inside.addWidget(self.plotView.widget)
         self.plkCanvasFrame.setLayout(self.canvasbox_inside)
 
         # Initialize the Figure/Canvas box
-        self.canvasbox.addWidget(self.plkToolbar)
+        self.canvasbox.addWidget(self.plotView.toolbar)
         self.canvasbox.addWidget(self.plkCanvasFrame)
 
         self.xychoicebox.addWidget(self.xyChoiceWidget)
@@ -1064,8 +1260,25 @@ class PlkWidget(QWidget):
             (Qt.Key_M, Qt.MetaModifier): self.handleCtrlM,
             (Qt.Key_J, Qt.ControlModifier): self.handleCtrlJ,
             (Qt.Key_J, Qt.MetaModifier): self.handleCtrlJ,
+            (Qt.Key_Z, Qt.ControlModifier): self.handleCtrlZ,
+            (Qt.Key_Z, Qt.MetaModifier): self.handleCtrlZ,
+            (Qt.Key_Y, Qt.ControlModifier): self.handleCtrlY,
+            (Qt.Key_Y, Qt.MetaModifier): self.handleCtrlY,
+            (Qt.Key_T, Qt.ControlModifier): self.handleCtrlT,
+            (Qt.Key_T, Qt.MetaModifier): self.handleCtrlT,
         }
 
+        # Key handlers that do not use the pulsar, so they work during a fit
+        self.fit_safe_handlers = [
+            self.handleKeyH,
+            self.handleKeyQ,
+            self.handleKeyZ,
+            self.handleEscape,
+            self.handleCtrlM,
+            self.handleCtrlJ,
+            self.handleCtrlT,
+        ]
+
     def showVisibleWidgets(self):
         """
         Show the correct widgets in the plk Window
@@ -1153,9 +1366,9 @@ class PlkWidget(QWidget):
                 text.set_color(rc['text.color'])
 
         if start:
-            apply_style(self.plkFig, self.plkAxes, constants.mpl_canvas_style)
+            apply_style(self.plotView.figure, self.plotView.axes, constants.mpl_canvas_style)
         else:
-            apply_style(self.plkFig, self.plkAxes, constants.mpl_console_style)
+            apply_style(self.plotView.figure, self.plotView.axes, constants.mpl_console_style)
 
     def update(self):
         if self.psr is not None:
@@ -1169,10 +1382,11 @@ class PlkWidget(QWidget):
             self.fitterWidget.updateFitterChoices(self.psr.all_toas.wideband)
             self.xyChoiceWidget.setChoice()
             self.updatePlot(keepAxes=True)
-            self.plkToolbar.update()
-            # reset state stack
-            self.state_stack = [self.base_state]
-            self.current_state = State()
+            self.plotView.resetHistory()
+            # reset the undo journal
+            self.journal = Journal(
+                self.psr.get_state(self.selected), budget=self.undo_budget
+            )
 
     def setPulsar(self, psr, updates):
         self.psr = psr
@@ -1185,17 +1399,16 @@ class PlkWidget(QWidget):
         self.updateAllJumped()
         self.update_callbacks = updates
 
-        if not hasattr(self, "base_state"):
-            self.base_state = State()
-            self.base_state.psr = copy.deepcopy(self.psr)
-            self.base_state.selected = copy.deepcopy(self.selected)
-            self.state_stack.append(self.base_state)
+        self.journal = Journal(
+            self.psr.get_state(self.selected), budget=self.undo_budget
+        )
 
         self.fitboxesWidget.setCallbacks(self.fitboxChecked)
         self.colorModeWidget.setCallbacks(self.updateGraphColors)
         self.xyChoiceWidget.setCallbacks(self.updatePlot)
         self.actionsWidget.setCallbacks(self.updatePlot,
-            self.fit, self.reset, self.writePar, self.writeTim, self.revert
+            self.fit, self.reset, self.writePar, self.writeTim, self.revert,
+            saveFig=self.saveFig,
         )
 
         # TODO: set the layout
@@ -1215,7 +1428,7 @@ class PlkWidget(QWidget):
         #)
         self.fitterWidget.fitter = self.psr.fit_method
         self.updatePlot(keepAxes=False)
-        self.plkToolbar.update()
+        self.plotView.resetHistory()
 
         # Draw the residuals
         self.xyChoiceWidget.updateChoice()
@@ -1247,14 +1460,51 @@ class PlkWidget(QWidget):
             getattr(self.psr.postfit_model, parchanged).frozen = not newstate
         if parchanged.startswith("JUMP"):
             self.updateJumped(parchanged)
+        self.recordState("fitbox")
+        self.previewFit()
         self.call_updates()
         self.updatePlot(keepAxes=True)
 
+    def previewFit(self):
+        """
+        Predict the fit with the current fit checkboxes, without running it
+
+        The predicted residuals are shown as ghost points, until the next
+        fit or other change of the pulsar.
+        """
+        self.fitPreview = None
+        if self.psr is None:
+            return
+        try:
+            self.fitPreview = self.psr.preview_fit(self.selected)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            log.warning(f"Cannot preview the fit: {e}")
+
+    def previewGhost(self):
+        """
+        Return the (x, y) of the fit preview to plot, or None if not shown
+
+        The preview is only shown on the residual axes, for the TOAs and
+        free parameters it was computed for.
+        """
+        preview = self.fitPreview
+        if (
+            preview is None
+            or self.yid not in ("pre-fit", "post-fit")
+            or len(preview.resids) != len(self.xvals)
+            or not np.array_equal(preview.selected, self.selected)
+        ):
+            return None
+        model = self.psr.postfit_model if self.psr.fitted else self.psr.prefit_model
+        if preview.free_params != tuple(model.free_params):
+            return None
+        return self.xvals, preview.resids.to(self.y_unit)
+
     def unselect(self):
         """
         Undo a selection (but not deletes)
         """
-        self.psr.selected_toas = copy.deepcopy(self.psr.all_toas)
+        self.psr.select_TOAs()
         self.selected = np.zeros(self.psr.selected_toas.ntoas, dtype=bool)
         self.updatePlot(keepAxes=True)
         self.call_updates()
@@ -1262,21 +1512,99 @@ class PlkWidget(QWidget):
     def fit(self):
         """
         fit the selected points using the current pre-fit model
+
+        The fit runs on a worker thread. While it runs, the fit button
+        cancels the fit, and edits of the pulsar are blocked.
         """
+        if self.fitRunning:
+            self.cancelFit()
+            return None
         if self.psr is not None:
             # check jumps wont cancel fit, if so, exit here
             if self.check_jump_invalid():
                 return None
-            if self.psr.fitted:
-                # append the current state to the state stack
-                self.current_state.psr = copy.deepcopy(self.psr)
-                self.current_state.selected = self.selected
-                self.state_stack.append(copy.deepcopy(self.current_state))
+            self.fitPreview = None
             self.psr.fit_method = self.fitterWidget.fitter
-            self.psr.fit(self.selected)
-            if self.randomboxWidget.getRandomModel():
-                self.psr.random_models(self.selected)
-            self.current_state.selected = copy.deepcopy(self.selected)
+            self.psr.fit_session.incremental = self.fitterWidget.incremental
+            self.psr.random_nmodels = self.randomboxWidget.getNumberOfModels()
+            self.fitThread = QThread()
+            self.fitWorker = PlkFitWorker(
+                self.psr,
+                self.selected,
+                compute_random=bool(self.randomboxWidget.getRandomModel()),
+            )
+            self.fitWorker.moveToThread(self.fitThread)
+            self.fitThread.started.connect(self.fitWorker.run)
+            self.fitWorker.progress.connect(self.fitProgress)
+            self.fitWorker.failed.connect(self.fitFailed)
+            self.fitWorker.finished.connect(self.fitFinished)
+            self.setFitRunning(True)
+            self.fitThread.start()
+        else:
+            self.call_updates()
+
+    def cancelFit(self):
+        """
+        Cancel the running fit (after the current iteration)
+        """
+        if self.fitWorker is not None:
+            log.info("Cancelling the fit after the current iteration")
+            self.fitWorker.cancel()
+            self.actionsWidget.setFitButtonText("Cancelling...")
+
+    def setFitRunning(self, running):
+        """
+        Block or unblock the widgets that would edit the pulsar during a fit
+
+        The plot is not redrawn during a fit either, because the fit changes
+        the residuals, the pulse numbers and the caches that it is drawn from.
+        """
+        self.fitRunning = running
+        self.actionsWidget.setFitRunning(running)
+        self.fitboxesWidget.setEnabled(not running)
+        self.randomboxWidget.setEnabled(not running)
+        self.fitterWidget.setEnabled(not running)
+        self.xyChoiceWidget.setEnabled(not running)
+        self.colorModeWidget.setEnabled(not running)
+        self.redrawScheduler.hold(running)
+
+    def fitBlocksEdit(self):
+        """
+        Return True (and warn) if a running fit does not allow edits
+        """
+        if self.fitRunning:
+            log.warning("A fit is running. Wait for it to finish, or cancel it first")
+        return self.fitRunning
+
+    def fitProgress(self, iteration, iterations):
+        """
+        Report the progress of the running fit
+        """
+        log.info(f"Fit iteration {iteration}/{iterations} done")
+        if not self.fitWorker.cancel_requested:
+            self.actionsWidget.setFitButtonText(f"Cancel ({iteration}/{iterations})")
+
+    def fitFailed(self, message):
+        """
+        The fit on the worker thread raised an exception
+        """
+        log.error(f"Fit failed: {message}")
+
+    def fitFinished(self, done):
+        """
+        The fit on the worker thread is done, cancelled, or failed
+        """
+        self.fitThread.quit()
+        self.fitThread.wait()
+        self.fitThread = None
+        self.fitWorker = None
+        self.setFitRunning(False)
+        if not done:
+            # Go back to the state from before the fit
+            self.restoreState(self.journal.current)
+            return
+        if self.psr is not None:
+            self.recordState("fit")
             self.actionsWidget.setFitButtonText("Re-fit")
             self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
             self.randomboxWidget.addRandomCheckbox(self)
@@ -1290,26 +1618,72 @@ class PlkWidget(QWidget):
 
     def reset(self):
         """
-        Reset all plot changes for this pulsar
+        Reset all plot changes for this pulsar (this can be undone)
         """
-        self.psr.use_pulse_numbers = False
-        self.psr.reset_TOAs()
-        self.psr.fitted = False
-        self.psr = copy.deepcopy(self.base_state.psr)
+        self.psr.set_state(self.journal.initial)
         self.selected = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
         self.jumped = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
         self.updateAllJumped()
         self.actionsWidget.setFitButtonText("Fit")
-        self.fitboxesWidget.addFitCheckBoxes(self.base_state.psr.prefit_model)
+        self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
         self.randomboxWidget.addRandomCheckbox(self)
         self.colorModeWidget.addColorModeCheckbox(self.color_modes)
         self.xyChoiceWidget.setChoice()
         self.updatePlot(keepAxes=False)
-        self.plkToolbar.update()
-        self.current_state = State()
-        self.state_stack = [self.base_state]
+        self.plotView.resetHistory()
+        self.recordState("reset")
         self.call_updates(psr_update=True)
 
+    def recordState(self, label):
+        """
+        Record the current state of the pulsar in the undo journal
+
+        :param label:   Description of the change, e.g. "fit" or "delete"
+        """
+        if label != "fitbox":
+            self.fitPreview = None
+        if self.journal is not None:
+            self.journal.record(self.psr.get_state(self.selected), label)
+
+    def restoreState(self, state):
+        """
+        Restore a state from the undo journal, and update all widgets
+
+        :param state:   State dictionary from the journal
+        """
+        self.selected = self.psr.set_state(state)
+        self.fitPreview = None
+        self.jumped = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
+        self.updateAllJumped()
+        self.actionsWidget.setFitButtonText("Re-fit" if self.psr.fitted else "Fit")
+        self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
+        self.randomboxWidget.addRandomCheckbox(self)
+        self.colorModeWidget.addColorModeCheckbox(self.color_modes)
+        xid, yid = self.xyChoiceWidget.plotIDs()
+        if yid == "post-fit" and not self.psr.fitted:
+            yid = "pre-fit"
+        self.xyChoiceWidget.setChoice(xid=xid, yid=yid)
+        self.updatePlot(keepAxes=False)
+        self.call_updates()
+
+    def undo(self):
+        """
+        Undo the last change
+        """
+        if self.journal is None or not self.journal.can_undo():
+            log.warning("Nothing to undo")
+            return
+        self.restoreState(self.journal.undo())
+
+    def redo(self):
+        """
+        Redo the last undone change
+        """
+        if self.journal is None or not self.journal.can_redo():
+            log.warning("Nothing to redo")
+            return
+        self.restoreState(self.journal.redo())
+
     def writePar(self, format="pint"):
         """
         Write the fit parfile to ea file
@@ -1359,29 +1733,40 @@ class PlkWidget(QWidget):
         """
         revert to the state of the model and toas right before the last fit
         """
-        if len(self.state_stack) > 0 and self.psr.fitted and self.psr is not None:
-            c_state = self.state_stack.pop()
-            self.psr = c_state.psr
-            self.selected = c_state.selected
-            self.selected = self.psr.delete_TOAs(self.psr.deleted, self.selected)
-            self.updateAllJumped()
-            self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
-            self.randomboxWidget.addRandomCheckbox(self)
-            self.colorModeWidget.addColorModeCheckbox(self.color_modes)
-            if len(self.state_stack) == 0:
-                self.state_stack.append(self.base_state)
-                self.actionsWidget.setFitButtonText("Fit")
-            self.psr.update_resids()
-            self.updatePlot(keepAxes=False)
+        pos = None
+        if self.psr is not None and self.journal is not None:
+            pos = self.journal.revert_position("fit")
+        if pos is not None:
+            self.restoreState(self.journal.goto(pos))
         else:
             log.warning("No model to revert to")
 
     def updatePlot(self, keepAxes=False):
         """
-        Update the plot/figure
+        Update the plot/figure, once control returns to the event loop
+
+        All updates requested before then are merged into one redraw
 
         @param keepAxes: Set to True whenever we want to preserve zoom
         """
+        self.redrawScheduler.request(keepAxes=keepAxes)
+
+    def flushPlot(self):
+        """
+        Do a pending plot update now (e.g. before handling user input that
+        depends on the plotted values)
+        """
+        self.redrawScheduler.flush()
+
+    def redrawPlot(self, keepAxes=False):
+        """
+        Redraw the plot/figure now
+
+        @param keepAxes: Set to True whenever we want to preserve zoom
+        """
+
+        timer = self.plotView.timer
+        timer.begin()
 
         # These three calls are not in pintk
         self.setColorScheme(True)
@@ -1396,119 +1781,99 @@ class PlkWidget(QWidget):
             self.xid, self.yid = self.xyChoiceWidget.plotIDs()
 
             # Retrieve the data
-            x, self.xerrs = self.psr_data_from_label(self.xid)
-            y, self.yerrs = self.psr_data_from_label(self.yid)
-            if x is not None and y is not None:
-                self.xvals = x
-                self.yvals = y
-                if "fit" in self.yid and not hasattr(self, "y_unit"):
-                    ymin, ymax = self.determine_yaxis_units(miny=y.min(), maxy=y.max())
-                    self.y_unit = ymin.unit
-                    self.yvals = self.yvals.to(self.y_unit)
-                    self.yerrs = self.yerrs.to(self.y_unit)
-                self.plotResiduals(keepAxes=keepAxes)
-            else:
+            with timer.stage("data"):
+                values = self.plotValues(self.xid, self.yid)
+            if values is None:
                 raise ValueError("Nothing to plot!")
+            self.xvals, self.xerrs, self.yvals, self.yerrs = values
+            self.plotResiduals(keepAxes=keepAxes)
 
-        self.plkFig.tight_layout()
-        self.plkCanvas.draw()
+        self.plotView.draw()
         self.setColorScheme(False)
 
-    def plotErrorbar(self, selected, color):
-        """
-        For some reason, xvals will not plot unless unitless.
-        Tried using quantity_support and time_support, which plots x & yvals,
-        but then yerrs fails - cannot find work-around in this case.
-        """
-
-        self.plkAxes.errorbar(
-            self.xvals[selected].value,
-            self.yvals[selected],
-            yerr=self.yerrs[selected],
-            fmt=".",
-            color=color,
-        )
+        timer.end()
+        if self.timingHud.isVisible():
+            self.timingHud.refresh()
 
-    def plotResiduals(self, keepAxes=False):
+    def plotValues(self, xid, yid):
         """
-        Update the plot, given all the plotting info
+        Get the values to plot for a choice of x and y axis
+
+        :param xid:     The x-axis choice (one of the plot labels)
+        :param yid:     The y-axis choice
+        :return:        (xvals, xerrs, yvals, yerrs), or None if there is
+                        nothing to plot
         """
-        if keepAxes:
-            xmin, xmax = self.plkAxes.get_xlim()
-            ymin, ymax = self.plkAxes.get_ylim()
-            log.debug(f"plotResiduals(True): ({xmin, xmax}), ({ymin, ymax})")
+        x, xerrs = self.psr_data_from_label(xid)
+        y, yerrs = self.psr_data_from_label(yid)
+        if x is None or y is None:
+            return None
+        if "fit" in yid:
+            # The unit of the residuals is chosen once, for the first plot
+            if not hasattr(self, "y_unit"):
+                ymin, ymax = self.determine_yaxis_units(miny=y.min(), maxy=y.max())
+                self.y_unit = ymin.unit
+            y = y.to(self.y_unit)
+            yerrs = yerrs.to(self.y_unit)
+        return x, xerrs, y, yerrs
+
+    def autoLimits(self, xvals, yvals, yerrs):
+        """
+        Return the (xmin, xmax, ymin, ymax) that show all the points, with a
+        margin of 10% on every side
+        """
+        xave = 0.5 * (np.max(xvals) + np.min(xvals))
+        xmin = xave - 1.10 * (xave - np.min(xvals))
+        xmax = xave + 1.10 * (np.max(xvals) - xave)
+        if yerrs is None:
+            yave = 0.5 * (np.max(yvals) + np.min(yvals))
+            ymin = yave - 1.10 * (yave - np.min(yvals))
+            ymax = yave + 1.10 * (np.max(yvals) - yave)
         else:
-            xave = 0.5 * (np.max(self.xvals) + np.min(self.xvals))
-            xmin = xave - 1.10 * (xave - np.min(self.xvals))
-            xmax = xave + 1.10 * (np.max(self.xvals) - xave)
-            if self.yerrs is None:
-                yave = 0.5 * (np.max(self.yvals) + np.min(self.yvals))
-                ymin = yave - 1.10 * (yave - np.min(self.yvals))
-                ymax = yave + 1.10 * (np.max(self.yvals) - yave)
-            else:
-                yave = 0.5 * (
-                    np.max(self.yvals + self.yerrs) + np.min(self.yvals - self.yerrs)
-                )
-                ymin = yave - 1.10 * (yave - np.min(self.yvals - self.yerrs))
-                ymax = yave + 1.10 * (np.max(self.yvals + self.yerrs) - yave)
-            xmin, xmax = xmin.value, xmax.value
-            log.debug(f"plotResiduals(False): ({xmin, xmax}), ({ymin, ymax})")
+            yave = 0.5 * (np.max(yvals + yerrs) + np.min(yvals - yerrs))
+            ymin = yave - 1.10 * (yave - np.min(yvals - yerrs))
+            ymax = yave + 1.10 * (np.max(yvals + yerrs) - yave)
+        # yvals are already in the residual unit, so the limits are too
+        return (
+            getattr(xmin, "value", xmin),
+            getattr(xmax, "value", xmax),
+            getattr(ymin, "value", ymin),
+            getattr(ymax, "value", ymax),
+        )
 
-        # determine if y-axis units need scaling and scale accordingly
-        if "fit" in self.yid:
-            # ymin, ymax = self.determine_yaxis_units(miny=ymin, maxy=ymax)
-            # self.y_unit = ymin.unit
-            if type(self.yvals) == u.quantity.Quantity:
-                self.yvals = self.yvals.to(self.y_unit)
-            if type(ymin) == u.quantity.Quantity:
-                ymin, ymax = ymin.to(self.y_unit).value, ymax.to(self.y_unit).value
-        else:
-            if type(ymin) == u.quantity.Quantity:
-                ymin, ymax = ymin.value, ymax.value
+    def plotDecorations(self, xid, yid, ymin, ymax):
+        """
+        Get the labels, secondary axes and lines of a plot
 
-        self.plkAxes.clear()
-        self.plkAx2x.clear()
-        self.plkAx2y.clear()
-        self.plkAxes.grid(True)
-        # plot residuals in appropriate color scheme
-        for mode in self.color_modes:
-            if self.current_mode == mode.mode_name:
-                mode.plotColorMode()
-        self.plkAxes.axis([xmin, xmax, ymin, ymax])
-        self.plkAxes.get_xaxis().get_major_formatter().set_useOffset(False)
-        self.plkAx2y.set_visible(False)
-        self.plkAx2x.set_visible(False)
-        # clears the views stack and puts the scaled view on top, fixes toolbar problems
-        # It seems that _views is not exposed
-        #self.plkToolbar._views.clear()
-        self.plkToolbar.push_current()
-
-        if self.xid in ["pre-fit", "post-fit"]:
-            self.plkAxes.set_xlabel(plotlabels[self.xid][0])
+        :param xid:     The x-axis choice
+        :param yid:     The y-axis choice
+        :param ymin:    Lower limit of the y-axis (for vertical lines)
+        :param ymax:    Upper limit of the y-axis
+        :return:        (xlabel, ylabel, x2, y2, lines), with x2 and y2 the
+                        (label, scale) of the secondary axes (None = not
+                        shown), and lines a list of (x, y, color, alpha)
+        """
+        # Secondary axes (None = not shown), and lines on top of the residuals
+        x2, y2 = None, None
+        lines = []
+        if xid in ["pre-fit", "post-fit"]:
+            xlabel = plotlabels[xid][0]
             m = (
                 self.psr.prefit_model
-                if self.xid == "pre-fit" or not self.psr.fitted
+                if xid == "pre-fit" or not self.psr.fitted
                 else self.psr.postfit_model
             )
             if hasattr(m, "F0"):
-                self.plkAx2y.set_visible(True)
-                self.plkAx2y.set_xlabel(plotlabels[self.xid][1])
-                f0 = m.F0.quantity.to(u.MHz).value
-                self.plkAx2y.set_xlim(xmin * f0, xmax * f0)
-                self.plkAx2y.xaxis.set_major_locator(
-                    mpl.ticker.FixedLocator(self.plkAxes.get_xticks() * f0)
-                )
+                x2 = (plotlabels[xid][1], m.F0.quantity.to(u.MHz).value)
         else:
-            self.plkAxes.set_xlabel(plotlabels[self.xid])
+            xlabel = plotlabels[xid]
 
-        if self.yid in ["pre-fit", "post-fit"]:
-            self.plkAxes.set_ylabel(
-                plotlabels[self.yid][0] + " (" + str(self.y_unit) + ")"
-            )
+        if yid in ["pre-fit", "post-fit"]:
+            ylabel = plotlabels[yid][0] + " (" + str(self.y_unit) + ")"
             try:
                 r = (
                     self.psr.prefit_resids
-                    if self.yid == "pre-fit" or not self.psr.fitted
+                    if yid == "pre-fit" or not self.psr.fitted
                     else self.psr.postfit_resids
                 )
                 if self.y_unit == u.us:
@@ -1517,19 +1882,14 @@ class PlkWidget(QWidget):
                     f0 = r.get_PSR_freq().to(u.kHz).value
                 else:
                     f0 = r.get_PSR_freq().to(u.Hz).value
-                self.plkAx2x.set_visible(True)
-                self.plkAx2x.set_ylabel(plotlabels[self.yid][1])
-                self.plkAx2x.set_ylim(ymin * f0, ymax * f0)
-                self.plkAx2x.yaxis.set_major_locator(
-                    mpl.ticker.FixedLocator(self.plkAxes.get_yticks() * f0)
-                )
+                y2 = (plotlabels[yid][1], f0)
             except:
                 pass
             # If fitting orbital phase, plot the conjunction
-            if self.xid == "orbital phase":
+            if xid == "orbital phase":
                 m = (
                     self.psr.prefit_model
-                    if self.xid == "pre-fit" or not self.psr.fitted
+                    if xid == "pre-fit" or not self.psr.fitted
                     else self.psr.postfit_model
                 )
                 if m.is_binary:
@@ -1542,38 +1902,291 @@ class PlkWidget(QWidget):
                     pb = m.pb()[0].to_value("day")
                     phs = (mjd - tt) / pb
                     # TODO: Color
-                    self.plkAxes.plot([phs, phs], [ymin, ymax], "w-")
+                    lines.append(([phs, phs], [ymin, ymax], "w", 1.0))
         else:
-            self.plkAxes.set_ylabel(plotlabels[self.yid])
-
-        self.plkAxes.set_title(self.psr.name, y=1.1)
+            ylabel = plotlabels[yid]
+        return xlabel, ylabel, x2, y2, lines
 
-        # plot random models
-        if self.psr.fitted == True and self.randomboxWidget.getRandomModel() == 1:
-            log.info("Plotting random models")
-            f_toas = self.psr.faketoas
-            rs = self.psr.random_resids
+    def randomCurves(self, xid, yvals):
+        """
+        Return the random models to plot, as (x, ys), or None if not shown
+        """
+        if (
+            self.psr.fitted == True
+            and self.psr.randoms is not None
+            and self.randomboxWidget.getRandomModel() == 1
+        ):
             # look at axes, allow random models to plot on x-axes other than MJD
-            xid, yid = self.xyChoiceWidget.plotIDs()
-            if xid == "year":
-                t = Time(f_toas.get_mjds(), format="mjd")
-                f_toas_plot = np.asarray(t.decimalyear) << u.year
-            else:
-                f_toas_plot = f_toas.get_mjds()
-            scale = 1
-            if self.yvals.unit == u.us:
-                scale = 10**6
-            elif self.yvals.unit == u.ms:
-                scale = 10**3
-            # Want to plot things in sorted order so that lines are smooth
-            sort_inds = np.argsort(f_toas_plot)
-            f_toas_plot = f_toas_plot[sort_inds]
-            for i in range(len(rs)):
-                # TODO: Color
-                self.plkAxes.plot(
-                    f_toas_plot, rs[i][sort_inds] * scale, "-w", alpha=0.3
+            unit = yvals.unit if yvals.unit in (u.us, u.ms) else u.s
+            return self.psr.random_model_curves(year=(xid == "year"), unit=unit)
+        return None
+
+    def currentColorMode(self):
+        """Return the color mode that is selected"""
+        for mode in self.color_modes:
+            if self.current_mode == mode.mode_name:
+                return mode
+        return None
+
+    def plotSnapshot(self, xid=None, yid=None):
+        """
+        Take a snapshot of the plot, to export it
+
+        For the current axis choice, the snapshot is what is shown, zoom
+        included. Other axis choices are shown in full.
+
+        :param xid: The x-axis choice (default: the current one)
+        :param yid: The y-axis choice (default: the current one)
+        :return:    PlotSnapshot, or None if there is nothing to plot
+        """
+        if self.psr is None:
+            return None
+        self.flushPlot()
+        xid = self.xid if xid is None else xid
+        yid = self.yid if yid is None else yid
+        if (xid, yid) == (self.xid, self.yid):
+            values = self.xvals, self.xerrs, self.yvals, self.yerrs
+            limits = self.plotView.limits()
+        else:
+            values = self.plotValues(xid, yid)
+            if values is None:
+                return None
+            limits = self.autoLimits(values[0], values[2], values[3])
+        x, xerrs, y, yerrs = values
+
+        mode = self.currentColorMode()
+        index, colors = mode.colorIndex()
+        xlabel, ylabel, x2, y2, lines = self.plotDecorations(
+            xid, yid, limits[2], limits[3]
+        )
+        curves = self.randomCurves(xid, y)
+        return PlotSnapshot(
+            xid,
+            yid,
+            x,
+            y,
+            yerrs,
+            index,
+            colors,
+            self.selected,
+            mode.selected_color,
+            limits,
+            xlabel,
+            ylabel,
+            self.psr.name,
+            x2=x2,
+            y2=y2,
+            lines=lines,
+            curves=None if curves is None else curves + ("w", 0.3),
+        )
+
+    def exportFigures(self, jobs, dpi=None):
+        """
+        Render plot snapshots to files on a worker thread
+
+        :param jobs:    List of (PlotSnapshot, filename) pairs
+        :param dpi:     Resolution (default: constants.plk_export_dpi)
+        :return:        True if the export started
+        """
+        if self.exportThread is not None:
+            log.warning("An export is running. Wait for it to finish first")
+            return False
+        if not jobs:
+            return False
+        self.exportThread = QThread()
+        self.exportWorker = PlkExportWorker(jobs, dpi=dpi)
+        self.exportWorker.moveToThread(self.exportThread)
+        self.exportThread.started.connect(self.exportWorker.run)
+        self.exportWorker.progress.connect(self.exportProgress)
+        self.exportWorker.failed.connect(self.exportFailed)
+        self.exportWorker.finished.connect(self.exportFinished)
+        log.info(f"Exporting {len(jobs)} figure(s)")
+        self.actionsWidget.setExportRunning(True)
+        self.exportThread.start()
+        return True
+
+    def cancelExport(self):
+        """
+        Cancel the running export (after the current file)
+        """
+        if self.exportWorker is not None:
+            log.info("Cancelling the export after the current file")
+            self.exportWorker.cancel()
+            self.actionsWidget.savebutton.setText("Cancelling...")
+
+    def exportAxes(self, basename, axes, formats=("png",), dpi=None):
+        """
+        Export the plot for several axis choices, on a worker thread
+
+        The snapshots are taken now, so the plot can be changed while the
+        files are written.
+
+        :param basename:    File name without extension, e.g. 'plots/J1744'.
+                            The axis choices and format are appended
+        :param axes:        List of (xid, yid), e.g. [("mjd", "post-fit")]
+        :param formats:     File formats (of export_formats)
+        :param dpi:         Resolution (default: constants.plk_export_dpi)
+        :return:            True if the export started
+        """
+        if self.fitBlocksEdit():
+            return False
+        jobs = []
+        for xid, yid in axes:
+            snapshot = self.plotSnapshot(xid, yid)
+            if snapshot is None:
+                log.warning(f"Nothing to plot for {xid} vs {yid}: not exported")
+                continue
+            for fmt in formats:
+                if fmt not in export_formats:
+                    raise ValueError(f"Cannot export to '{fmt}' (not in {export_formats})")
+                jobs.append((snapshot, export_filename(basename, snapshot, fmt)))
+        return self.exportFigures(jobs, dpi=dpi)
+
+    def saveFig(self):
+        """
+        Save the plot as it is shown to a file of your choice. While an
+        export runs, this cancels it instead
+        """
+        if self.exportThread is not None:
+            self.cancelExport()
+            return
+        if self.fitBlocksEdit():
+            return
+        snapshot = self.plotSnapshot()
+        if snapshot is None:
+            log.warning("Nothing to save")
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Save the figure", "", "Images (*.png *.pdf *.svg);;All files (*)"
+        )
+        if not filename:
+            return
+        ext = os.path.splitext(filename)[1].lstrip(".").lower()
+        if not ext:
+            filename += ".png"
+        elif ext not in export_formats:
+            log.error(f"Cannot save the figure as '{ext}': use one of {export_formats}")
+            return
+        self.exportFigures([(snapshot, filename)])
+
+    def exportProgress(self, done, total):
+        log.info(f"Exported figure {done}/{total}")
+
+    def exportFailed(self, filename, message):
+        log.error(f"Could not save the figure to {filename}: {message}")
+
+    def exportFinished(self, written):
+        """
+        The export on the worker thread is done
+        """
+        self.exportThread.quit()
+        self.exportThread.wait()
+        self.exportThread = None
+        self.exportWorker = None
+        self.actionsWidget.setExportRunning(False)
+        for filename in written:
+            log.info(f"Saved the figure to {filename}")
+
+    def exploreParams(self):
+        """
+        Fit every frozen candidate parameter on a worker thread, and print
+        which one to fit next
+
+        The copies of the model and the TOAs that are fitted are taken here,
+        on the GUI thread, so the pulsar can be edited (and fitted) while the
+        worker runs. Not while a fit runs, because that changes the TOAs.
+
+        :return:    True if the exploration started
+        """
+        if self.psr is None:
+            return False
+        if self.exploreThread is not None:
+            log.warning("The parameters are being explored already. Wait for it to finish")
+            return False
+        if self.fitBlocksEdit():
+            return False
+        toas, model, candidates = self.psr.explore_snapshot()
+        self.exploreThread = QThread()
+        self.exploreWorker = PlkExploreWorker(
+            toas, model, self.fitterWidget.fitter, candidates
+        )
+        self.exploreWorker.moveToThread(self.exploreThread)
+        self.exploreThread.started.connect(self.exploreWorker.run)
+        self.exploreWorker.failed.connect(self.exploreFailed)
+        self.exploreWorker.finished.connect(self.exploreFinished)
+        log.info("Exploring which parameter to fit next")
+        self.exploreThread.start()
+        return True
+
+    def exploreFailed(self, message):
+        """
+        The exploration on the worker thread raised an exception
+        """
+        log.error(f"Exploring the parameters failed: {message}")
+
+    def exploreFinished(self, results):
+        """
+        The exploration on the worker thread is done
+        """
+        self.exploreThread.quit()
+        self.exploreThread.wait()
+        self.exploreThread = None
+        self.exploreWorker = None
+        log.info(f"Explored {len(results)} candidate parameters")
+
+    def plotResiduals(self, keepAxes=False):
+        """
+        Update the plot, given all the plotting info
+        """
+        if keepAxes:
+            xmin, xmax, ymin, ymax = self.plotView.limits()
+            log.debug(f"plotResiduals(True): ({xmin, xmax}), ({ymin, ymax})")
+        else:
+            xmin, xmax, ymin, ymax = self.autoLimits(self.xvals, self.yvals, self.yerrs)
+            log.debug(f"plotResiduals(False): ({xmin, xmax}), ({ymin, ymax})")
+
+        if self.pointIndex is None or not self.pointIndex.matches(self.xvals, self.yvals):
+            self.pointIndex = PointIndex(self.xvals, self.yvals)
+
+        # plot residuals in appropriate color scheme
+        timer = self.plotView.timer
+        mode = self.currentColorMode()
+        if mode is not None:
+            with timer.stage("colors"):
+                index, colors = mode.colorIndex()
+            with timer.stage("artists"):
+                self.plotView.setResiduals(
+                    self.xvals,
+                    self.yvals,
+                    self.yerrs,
+                    index,
+                    colors,
+                    self.selected,
+                    mode.selected_color,
                 )
 
+        xlabel, ylabel, x2, y2, lines = self.plotDecorations(
+            self.xid, self.yid, ymin, ymax
+        )
+        title = self.psr.name
+        ghost = self.previewGhost()
+        if ghost is not None:
+            title += f" (preview: reduced chi2 = {self.fitPreview.reduced_chi2:.4g})"
+        with timer.stage("axes"):
+            self.plotView.setAxes(
+                (xmin, xmax, ymin, ymax), xlabel, ylabel, title, x2=x2, y2=y2
+            )
+
+        # plot random models
+        curves = self.randomCurves(self.xid, self.yvals)
+        x, ys = (None, None) if curves is None else curves
+        with timer.stage("lines"):
+            # TODO: Color
+            self.plotView.setCurves(x, ys, "w", 0.3)
+            self.plotView.setLines(lines)
+            x, y = (None, None) if ghost is None else ghost
+            self.plotView.setGhost(x, y, "w", 0.35)
+
     def determine_yaxis_units(self, miny, maxy):
         """Checks range of residuals and converts units if range sufficiently large/small."""
         diff = maxy - miny
@@ -1686,24 +2299,19 @@ class PlkWidget(QWidget):
 
         :return:    Index of observation
         """
-        ax, ay = 1, 1
-        if which=='x': ay = 0
-        if which=='y': ax = 0
-
         ind = None
-        if self.psr is not None and cx is not None and cy is not None:
-            x = self.xvals.value
-            y = self.yvals.value
-            xmin, xmax, ymin, ymax = self.plkAxes.axis()
-            dist = ax*((x - cx) / (xmax - xmin)) ** 2.0 + ay*((y - cy) / (ymax - ymin)) ** 2.0
-            ind = np.argmin(dist)
-            log.debug(
-                f"Closest: TOA index {self.psr.all_toas.table['index'][ind]} (plot index {ind}): "
-                f"({self.xvals[ind]:.4f}, {self.yvals[ind]:.3g}) at d={dist[ind]:.3g}"
+        if self.psr is not None and self.pointIndex is not None and cx is not None and cy is not None:
+            xmin, xmax, ymin, ymax = self.plotView.limits()
+            ind, dist = self.pointIndex.nearest(
+                cx, cy, xmax - xmin, ymax - ymin, clickDist, which=which
             )
-            if dist[ind] > clickDist:
+            if ind is None:
                 log.warning("Not close enough to a point")
-                ind = None
+            else:
+                log.debug(
+                    f"Closest: TOA index {self.psr.all_toas.table['index'][ind]} (plot index {ind}): "
+                    f"({self.xvals[ind]:.4f}, {self.yvals[ind]:.3g}) at d={dist:.3g}"
+                )
 
         return ind
 
@@ -1741,86 +2349,40 @@ class PlkWidget(QWidget):
                 "Return value for the jump name is not a string, jumps not updated",
             )
             return None
-        num = jump_name[4:]  # string value
-        jump_select = [
-            ("jump" in dict and dict["jump"] == num)
-            for dict in self.psr.all_toas.table["flags"]
-        ]
-        log.info(f"JUMP{num} contains {sum(jump_select)} TOAs for fit.")
+        num = int(jump_name[4:])
+        jump_select = self.psr.jump_index.mask(self.psr.all_toas, num)
+        log.info(f"JUMP{num} contains {jump_select.sum()} TOAs for fit.")
         self.jumped[jump_select] = ~self.jumped[jump_select]
 
     def updateAllJumped(self):
         """Update self.jumped for all active JUMPs"""
-        self.jumped = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
-        for param in self.psr.prefit_model.params:
-            if (
-                param.startswith("JUMP")
-                and getattr(self.psr.prefit_model, param).frozen == False
-            ):
-                self.updateJumped(param)
+        active = [
+            int(param[4:])
+            for param in self.psr.prefit_model.params
+            if param.startswith("JUMP")
+            and getattr(self.psr.prefit_model, param).frozen == False
+        ]
+        self.jumped = self.psr.jump_index.mask(self.psr.all_toas, active)
 
     def setFocusToCanvas(self):
         """
         Set the focus to the plk Canvas
         """
-        self.plkCanvas.setFocus()
+        self.plotView.widget.setFocus()
 
-    def canvasClickEvent(self, event):
+    def stationaryClick(self, x, y, button):
         """
-        Call this function when the figure/canvas is clicked
-        """
-        log.debug(f"You clicked in the canvas (button = {event.button})")
-        self.setFocusToCanvas()
-        if event.inaxes == self.plkAxes:
-            self.press = True
-            self.pressEvent = event
-
-            # Unlike in Tk, in PyQt we don't directly draw on the canvas
-            # So, we need to create a rectangle artist using Matplotlib and add
-            # it to the axes
-            self.rect = Rectangle((0, 0), 0, 0, fill=False, edgecolor='gray')  # create an invisible rectangle
-            self.plkAxes.add_patch(self.rect)  # add rectangle to the axes
-
-    def canvasMotionEvent(self, event):
-        """
-        Call this function when mouse is moved in the figure/canvas
-        """
-        log.trace(f"Canvas motion event triggered (coords = {event.xdata, event.ydata})")
-        if event.inaxes == self.plkAxes and self.press:
-            self.move = True
-            # Draw bounding box
-            x0, x1 = self.pressEvent.xdata, event.xdata
-            y0, y1 = self.pressEvent.ydata, event.ydata
-            self.rect.set_xy((min([x0, x1]), min([y0, y1])))  # set bottom left corner
-            self.rect.set_width(abs(x1 - x0))  # set width
-            self.rect.set_height(abs(y1 - y0))  # set height
-            self.rect.set_visible(True)  # make rectangle visible
-            self.plkCanvas.draw()        # Don't need to update the whole plot
-
-    def canvasReleaseEvent(self, event):
-        """
-        Call this function when the figure/canvas is released
-        """
-        log.debug(f"canvasReleaseEvent triggered (coords = {event.x, event.y})")
-        self.rect.set_visible(False)  # hide the rectangle
-        self.plkCanvas.draw()
-
-        if self.press and not self.move:
-            self.stationaryClick(event)
-        elif self.press and self.move:
-            self.clickAndDrag(event)
-        self.press = False
-        self.move = False
+        Call this function when the plot is clicked at (x, y) but not moved
 
-    def stationaryClick(self, event):
+        :param x:       x-value of the click
+        :param y:       y-value of the click
+        :param button:  The mouse button (1 = left, 3 = right)
         """
-        Call this function when the mouse is clicked but not moved
-        """
-        log.debug(f"You stationary clicked (button = {event.button})")
-        if event.inaxes == self.plkAxes:
-            ind = self.coordToPoint(event.xdata, event.ydata)
+        self.flushPlot()
+        if not self.fitBlocksEdit():
+            ind = self.coordToPoint(x, y)
             if ind is not None:
-                if event.button == 3:
+                if button == 3:
                     # Right click deletes closest TOA
                     # Adapt to TOA index rather than plot index, they differ when TOAs are already deleted
                     toa_ind = self.psr.all_toas.table["index"][ind]
@@ -1845,9 +2407,10 @@ class PlkWidget(QWidget):
                     self.updateAllJumped()
                     self.jumped |= unselect_jump_stat
                     self.psr.update_resids()
+                    self.recordState("delete")
                     self.updatePlot(keepAxes=True)
                     self.call_updates()
-                if event.button == 1:
+                if button == 1:
                     # Left click is select
                     self.selected[ind] = not self.selected[ind]
                     self.updatePlot(keepAxes=True)
@@ -1855,89 +2418,67 @@ class PlkWidget(QWidget):
                     # point is unselected but other points remain selected
                     if self.selected[ind] or any(self.selected):
                         # update selected_toas object w/ selected points
-                        self.psr.selected_toas = self.psr.all_toas[self.selected]
+                        self.psr.select_TOAs(self.selected)
                         self.psr.update_resids()
                         self.call_updates()
 
-    def clickAndDrag(self, event):
+    def clickAndDrag(self, xmin, xmax, ymin, ymax):
         """
-        Call this function when the mouse is clicked and dragged (moved)
+        Call this function when a box is dragged in the plot (in select mode)
+
+        :param xmin:    The box, in data coordinates
+        :param xmax:
+        :param ymin:
+        :param ymax:
         """
         # TODO: Right-click drag = select,  left-click drag = zoom
-        log.debug(f"You clicked and dragged in mode '{self.plkToolbar.mode}'")
-        log.trace(f"Value of event '{self.pressEvent.key}' of {self.pressEvent}")
-        # The following is for a selection if not in zoom mode
-        if "zoom" not in self.plkToolbar.mode and event.inaxes == self.plkAxes:
-            # Not in zoom mode: selecting TOAs
-            xmin, xmax = self.pressEvent.xdata, event.xdata
-            ymin, ymax = self.pressEvent.ydata, event.ydata
-            if xmin > xmax:
-                xmin, xmax = xmax, xmin
-            if ymin > ymax:
-                ymin, ymax = ymax, ymin
-            selected = (self.xvals.value > xmin) & (self.xvals.value < xmax)
-            selected &= (self.yvals.value > ymin) & (self.yvals.value < ymax)
-            self.selected |= selected
-            self.updatePlot(keepAxes=True)
-            #self.plkCanvas._tkcanvas.delete(self.brect)
-            if any(self.selected):
-                log.debug(f"Updating plot with selected points: {np.sum(self.selected)}")
-                self.psr.selected_toas = self.psr.all_toas[self.selected]
-                self.psr.update_resids()
-                self.call_updates()
-        else:
-            # We need to NOT rescale the axes here. That is happening, even though
-            # we should be SELECTING TOAs
-            log.debug(f"In zoom mode/not in axes")
+        self.flushPlot()
+        if self.fitBlocksEdit():
+            return
+        self.selected |= self.pointIndex.box(xmin, xmax, ymin, ymax)
+        self.updatePlot(keepAxes=True)
+        if any(self.selected):
+            log.debug(f"Updating plot with selected points: {np.sum(self.selected)}")
+            self.psr.select_TOAs(self.selected)
+            self.psr.update_resids()
+            self.call_updates()
 
-    def canvasKeyEvent(self, event):
+    def canvasKeyEvent(self, ukey, modifiers, xpos, ypos):
         """
-        When one presses a button on the Figure/Canvas, this function is called.
-        The coordinates of the click are stored in event.xdata, event.ydata
+        A key is pressed in the plot, with the mouse at (xpos, ypos) (both
+        None if the mouse is outside of the plot)
         """
-        # Callback to the plkWidget, which handles all events
-        self.keyPressEvent(event)
+        self.propagate_key_up = False
+        self.handleKey(ukey, modifiers, xpos, ypos, from_canvas=True)
 
     def keyPressEvent(self, event, **kwargs):
         """
-        A key is pressed. Handle all the shortcuts here.
-
-        This function can be called as a callback from the Canvas, or as a
-        callback from Qt. So first some parsing must be done
+        A key is pressed (Qt callback). The canvas location is not available
         """
+        self.propagate_key_up = True
+        log.debug(
+            "Call-back key-press, canvas location not available"
+        )
+        self.handleKey(event.key(), event.modifiers(), None, None, from_canvas=False)
 
-        if hasattr(event.key, '__call__'):
-            from_canvas = False
-            self.propagate_key_up = True
-            xpos, ypos = None, None
-            ukey = event.key()
-            modifiers = event.modifiers()
-
-            log.debug(
-                "Call-back key-press, canvas location not available"
-            )
-        else:
-            from_canvas = True
-            self.propagate_key_up = False
-            xpos, ypos = event.xdata, event.ydata
-            ukey, modifiers = mpl_key_to_qt_key(event.key)
+        # TODO: check when this is necessary
+        if self.parent is not None:
+            log.debug("Propagating key press to parent also")
+            self.parent.keyPressEvent(event)
 
+        super(PlkWidget, self).keyPressEvent(event, **kwargs)
 
+    def handleKey(self, ukey, modifiers, xpos=None, ypos=None, from_canvas=False):
+        """
+        A key is pressed. Handle all the shortcuts here.
+        """
+        self.flushPlot()
         action = self.key_handlers.get((ukey, modifiers), None)
-        if action: 
+        if action and action not in self.fit_safe_handlers and self.fitBlocksEdit():
+            action = None
+        if action:
             action(xpos, ypos, from_canvas)
 
-        # For propagate_key_up we'd need the Qt event. We don't have that
-        # Since it's a matplotlib event, we're just not going to propagate it,
-        # it's not recommended. TODO: Remove propagate_key_up
-        if not from_canvas: # or self.propagate_key_up:
-            # TODO: check when this is necessary
-            if self.parent is not None:
-                log.debug("Propagating key press to parent also")
-                self.parent.keyPressEvent(event)
-
-            super(PlkWidget, self).keyPressEvent(event, **kwargs)
-
     def handleKeyA(self, xpos=None, ypos=None, from_canvas=False):
         pass
 
@@ -1945,7 +2486,7 @@ class PlkWidget(QWidget):
         pass
 
     def handleKeyC(self, xpos=None, ypos=None, from_canvas=False):
-        if self.psr.fitted:
+        if self.psr.fitted and self.psr.fitter is not None:
             self.psr.fitter.get_parameter_correlation_matrix(
                 pretty_print=True, prec=3, usecolor=True
             )
@@ -1976,14 +2517,16 @@ class PlkWidget(QWidget):
         # Restore the jumps back
         self.jumped |= unselect_jump_status
         self.psr.update_resids()
+        self.recordState("delete")
         self.updatePlot(keepAxes=True)
         self.call_updates()
 
     def handleKeyE(self, xpos=None, ypos=None, from_canvas=False):
-        pass
+        self.exploreParams()
 
     def handleKeyF(self, xpos=None, ypos=None, from_canvas=False):
-        self.fit()
+        if not self.fitBlocksEdit():
+            self.fit()
 
     def handleKeyG(self, xpos=None, ypos=None, from_canvas=False):
         pass
@@ -2002,8 +2545,9 @@ class PlkWidget(QWidget):
         # jump the selected points, or unjump if already jumped
         jump_name = self.psr.add_jump(self.selected)
         self.updateJumped(jump_name)
-        self.psr.selected_toas = copy.deepcopy(self.psr.all_toas)
+        self.psr.select_TOAs()
         self.selected = np.zeros(self.psr.selected_toas.ntoas, dtype=bool)
+        self.recordState("jump")
         self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
         self.randomboxWidget.addRandomCheckbox(self)
         self.colorModeWidget.addColorModeCheckbox(self.color_modes)
@@ -2044,7 +2588,7 @@ class PlkWidget(QWidget):
         self.reset()
 
     def handleKeyS(self, xpos=None, ypos=None, from_canvas=False):
-        if self.psr.fitted:
+        if self.psr.fitted and self.psr.fitter is not None:
             print(self.psr.fitter.get_summary())
 
     def handleKeyT(self, xpos=None, ypos=None, from_canvas=False):
@@ -2063,10 +2607,14 @@ class PlkWidget(QWidget):
                 f"Unstashing {len(self.psr.stashed)-len(self.psr.all_toas)} TOAs"
             )
             self.psr.all_toas = copy.deepcopy(self.psr.stashed)
+            # The stash has its own copy of the jump flags
+            self.psr.jump_index.rebuild(self.psr.all_toas)
+            self.psr.select_TOAs()
             self.selected = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
             self.psr.stashed = None
             self.updateAllJumped()
             self.psr.update_resids()
+            self.recordState("unstash")
             self.updatePlot(keepAxes=False)
 
         else:  # if TOAs are selected, add them to the stash
@@ -2095,10 +2643,11 @@ class PlkWidget(QWidget):
 
             # remove the newly-stashed TOAs from the front-facing TOAs
             self.psr.all_toas.table = self.psr.all_toas.table[~self.selected]
-            self.psr.selected_toas = copy.deepcopy(self.psr.all_toas)
+            self.psr.select_TOAs()
             self.selected = np.zeros(self.psr.all_toas.ntoas, dtype=bool)
             self.updateAllJumped()
             self.psr.update_resids()
+            self.recordState("stash")
             self.updatePlot(
                 keepAxes=False
             )  # We often stash at beginning or end of array
@@ -2115,17 +2664,12 @@ class PlkWidget(QWidget):
         self.updateAllJumped()
         all_jumped = copy.deepcopy(self.jumped)
         self.jumped = jumped_copy
-        clusters = list(self.psr.all_toas.table["clusters"])
+        clusters = np.asarray(self.psr.all_toas.table["clusters"])
         # jump each cluster, check doesn't overlap with existing jumps and selected
-        for num in np.arange(max(clusters) + 1):
-            cluster_bool = np.array([
-                num == cluster for cluster in self.psr.all_toas.table["clusters"]
-            ])
-            if True in [
-                a and b for a, b in zip(cluster_bool, self.selected)
-            ] or True in [a and b for a, b in zip(cluster_bool, all_jumped)]:
-                continue
-            self.psr.selected_toas = self.psr.all_toas[cluster_bool]
+        blocked = np.unique(clusters[self.selected | all_jumped])
+        for num in np.setdiff1d(np.unique(clusters), blocked):
+            cluster_bool = clusters == num
+            self.psr.select_TOAs(cluster_bool)
             jump_name = self.psr.add_jump(cluster_bool)
             self.updateJumped(jump_name)
         if (
@@ -2133,7 +2677,8 @@ class PlkWidget(QWidget):
             and self.selected is not []
             and all(self.selected)
         ):
-            self.psr.selected_toas = self.all_toas[self.selected]
+            self.psr.select_TOAs(self.selected)
+        self.recordState("jump")
         self.fitboxesWidget.addFitCheckBoxes(self.psr.prefit_model)
         self.randomboxWidget.addRandomCheckbox(self)
         self.colorModeWidget.addColorModeCheckbox(self.color_modes)
@@ -2151,8 +2696,8 @@ class PlkWidget(QWidget):
 
     def handleKeyZ(self, xpos=None, ypos=None, from_canvas=False):
         """Zoom"""
-        self.plkToolbar.zoom()
-        self.randomboxWidget.changeMode(self.plkToolbar.mode)
+        self.plotView.toggleZoom()
+        self.randomboxWidget.changeMode(self.plotView.mode)
 
     def handleEscape(self, xpos=None, ypos=None, from_canvas=False):
         log.info("Exiting.")
@@ -2187,9 +2732,22 @@ class PlkWidget(QWidget):
         """This is handled by the parent window (through the menu shortcuts)"""
         self.propagate_key_up = True
 
+    def handleCtrlZ(self, xpos=None, ypos=None, from_canvas=False):
+        """Undo the last change"""
+        self.undo()
+
+    def handleCtrlY(self, xpos=None, ypos=None, from_canvas=False):
+        """Redo the last undone change"""
+        self.redo()
+
+    def handleCtrlT(self, xpos=None, ypos=None, from_canvas=False):
+        """Show or hide the redraw timing overlay"""
+        self.timingHud.toggle()
+
     def subtractPhaseWrapSel(self, xpos=None, ypos=None, from_canvas=False):
         """Subtract a phase wrap for selected TOAs"""
         self.psr.add_phase_wrap(self.selected, -1)
+        self.recordState("phase wrap")
         self.updatePlot(keepAxes=False)
         self.call_updates()
         log.info("Pulse number for selected points decreased.")
@@ -2197,6 +2755,7 @@ class PlkWidget(QWidget):
     def addPhaseWrapSel(self, xpos=None, ypos=None, from_canvas=False):
         """Add a phase wrap for selected TOAs"""
         self.psr.add_phase_wrap(self.selected, 1)
+        self.recordState("phase wrap")
         self.updatePlot(keepAxes=False)
         self.call_updates()
         log.info("Pulse number for selected points increased.")
@@ -2208,6 +2767,7 @@ class PlkWidget(QWidget):
                 < self.psr.all_toas.get_mjds()
             )
             self.psr.add_phase_wrap(later, -1)
+            self.recordState("phase wrap")
             log.info(
                 "Pulse numbers to the right (i.e. later in time) of selection were decreased."
             )
@@ -2221,6 +2781,7 @@ class PlkWidget(QWidget):
                 < self.psr.all_toas.get_mjds()
             )
             self.psr.add_phase_wrap(later, 1)
+            self.recordState("phase wrap")
             log.info(
                 "Pulse numbers to the right (i.e. later in time) of selection were increased."
             )
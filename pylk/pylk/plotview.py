@@ -0,0 +1,553 @@
+"""Plot views of the plk widget.
+
+The plk widget decides what to plot: which TOAs, in which colors, with which
+axes and labels. A plot view shows that on a canvas, and reports the mouse
+clicks, box selections, and key presses on that canvas in data coordinates.
+That way, the plotting library is a detail of the plot view:
+
+- MplPlotView: matplotlib, rasterized by Agg (the default)
+- PgPlotView: pyqtgraph scene graph, in pylk.pgplotview (optional)
+
+Matplotlib is always used to export the plot to a file.
+"""
+import matplotlib as mpl
+import numpy as np
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+
+from pylk import constants
+from pylk.frametimer import FrameTimer
+from pylk.renderer import ResidualRenderer
+
+from loguru import logger as log
+
+
+# The available plot backends
+plot_backends = ["matplotlib", "pyqtgraph"]
+
+# Mapping from Matplotlib key strings to Qt key constants
+key_map = {
+    "control": Qt.ControlModifier,
+    "ctrl": Qt.ControlModifier,
+    "alt": Qt.AltModifier,
+    "shift": Qt.ShiftModifier,
+    "super": Qt.MetaModifier,
+    "cmd": Qt.MetaModifier,
+    "up": Qt.Key_Up,
+    "down": Qt.Key_Down,
+    "left": Qt.Key_Left,
+    "right": Qt.Key_Right,
+    "enter": Qt.Key_Return,
+    "return": Qt.Key_Return,
+    "backspace": Qt.Key_Backspace,
+    "escape": Qt.Key_Escape,
+    "f1": Qt.Key_F1,
+    "f2": Qt.Key_F2,
+    "f3": Qt.Key_F3,
+    "f4": Qt.Key_F4,
+    "f5": Qt.Key_F5,
+    "f6": Qt.Key_F6,
+    "f7": Qt.Key_F7,
+    "f8": Qt.Key_F8,
+    "f9": Qt.Key_F9,
+    "f10": Qt.Key_F10,
+    "f11": Qt.Key_F11,
+    "f12": Qt.Key_F12,
+    "underscore": Qt.Key_Underscore,
+    "minus": Qt.Key_Minus,
+    "plus": Qt.Key_Plus,
+    "equal": Qt.Key_Equal,
+    "less": Qt.Key_Less,
+    "greater": Qt.Key_Greater,
+    "comma": Qt.Key_Comma,
+    "period": Qt.Key_Period,
+    "space": Qt.Key_Space,
+}
+
+
+def mpl_key_to_qt_key(mpl_key):
+    """Convert a Matplotlib key string to a Qt key constant"""
+    qt_key = 0
+    qt_mod = Qt.NoModifier
+
+    keys = mpl_key.split("+")
+
+    for key in keys:
+        if key in key_map:
+            if key in ["control", "ctrl", "alt", "shift", "super", "cmd"]:
+                qt_mod |= key_map[key]
+            else:
+                qt_key = key_map[key]
+        elif len(key) == 1:
+            qt_key = ord(key.upper())
+
+    return qt_key, qt_mod
+
+
+class PlkToolbar(NavigationToolbar2QT):
+    """
+    A modification of the stock Matplotlib toolbar to perform the
+    necessary selections/un-selections on points
+    """
+
+    toolitems = [t for t in NavigationToolbar2QT.toolitems if t[0] in ("Home", "Back", "Forward", "Pan", "Zoom", "Save")]
+
+    def __init__(self, *args, **kwargs):
+        super(PlkToolbar, self).__init__(*args, **kwargs)
+
+        self.setIconSize(QtCore.QSize(16, 16))
+        self.set_actions()
+
+    def set_actions(self):
+        for action in self.actions():
+            if action.text() == 'Home':
+                action.triggered.connect(self.updatePlot)
+        
+        self.homeCallback = None
+
+    def setHomeCallback(self, homeCallback):
+        self.homeCallback = homeCallback
+
+    def updatePlot(self):
+        if self.homeCallback:
+            self.homeCallback()
+
+
+class PlotView(QObject):
+    """
+    Base class of the plot views. A plot view has a canvas `widget` and a
+    `toolbar` widget, which the plk widget puts in its layout.
+    """
+
+    # Stationary click at (x, y) with a mouse button (1 = left, 3 = right)
+    clicked = pyqtSignal(float, float, int)
+
+    # Box selection (xmin, xmax, ymin, ymax)
+    boxSelected = pyqtSignal(float, float, float, float)
+
+    # Key press (Qt key, Qt modifiers, x, y). x and y are None if the mouse
+    # is not in the plot
+    keyPressed = pyqtSignal(int, int, object, object)
+
+    # The toolbar home button was pressed
+    home = pyqtSignal()
+
+    name = None
+
+    def __init__(self, parent=None):
+        super(PlotView, self).__init__(parent)
+        # Timing of the redraws and frames, shown by the plk widget
+        self.timer = FrameTimer()
+
+    @property
+    def mode(self):
+        """The interaction mode: 'zoom' when dragging zooms instead of selects"""
+        raise NotImplementedError
+
+    def toggleZoom(self):
+        """Toggle between zoom mode and select mode"""
+        raise NotImplementedError
+
+    def clear(self, xlabel, ylabel):
+        """Show an empty plot"""
+        raise NotImplementedError
+
+    def limits(self):
+        """Return the current (xmin, xmax, ymin, ymax) of the plot"""
+        raise NotImplementedError
+
+    def setResiduals(self, x, y, yerr, index, colors, selected, selected_color):
+        """
+        Show the residuals
+
+        :param x:               x-values of all TOAs
+        :param y:               y-values of all TOAs
+        :param yerr:            y-errors of all TOAs (None = no error bars)
+        :param index:           Per-TOA color index, from the color mode
+        :param colors:          List of colors, from the color mode
+        :param selected:        Boolean array, True = selected TOA
+        :param selected_color:  Color of the selected TOAs
+        """
+        raise NotImplementedError
+
+    def setAxes(self, limits, xlabel, ylabel, title, x2=None, y2=None):
+        """
+        Set the axes of the plot
+
+        :param limits:  (xmin, xmax, ymin, ymax)
+        :param xlabel:  Label of the x-axis
+        :param ylabel:  Label of the y-axis
+        :param title:   Title of the plot
+        :param x2:      (label, scale) of a secondary x-axis, with the x-values
+                        multiplied by scale (None = no secondary axis)
+        :param y2:      (label, scale) of a secondary y-axis
+        """
+        raise NotImplementedError
+
+    def setLines(self, lines):
+        """
+        Show lines on top of the residuals (replacing the previous ones)
+
+        :param lines:   List of (x, y, color, alpha) tuples
+        """
+        raise NotImplementedError
+
+    def setCurves(self, x, ys, color, alpha):
+        """
+        Show curves with common x-values on top of the residuals, as one item
+
+        The curves are kept until they are replaced. Passing the arrays that
+        are shown already does nothing.
+
+        :param x:       x-values, shape [n] (None = no curves)
+        :param ys:      y-values of every curve, shape [ncurves, n]
+        :param color:   Color of the curves
+        :param alpha:   Opacity of the curves
+        """
+        raise NotImplementedError
+
+    def setGhost(self, x, y, color, alpha):
+        """
+        Show points behind the residuals, like the residuals of a fit preview
+
+        :param x:       x-values (None = no ghost points)
+        :param y:       y-values
+        :param color:   Color of the points
+        :param alpha:   Opacity of the points
+        """
+        raise NotImplementedError
+
+    def draw(self):
+        """Redraw the canvas"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return the number of (artists, points) that are shown"""
+        raise NotImplementedError
+
+    def resetHistory(self):
+        """Forget the zoom history"""
+        raise NotImplementedError
+
+    def savefig(self, filename):
+        """Save the plot to a file"""
+        raise NotImplementedError
+
+
+class MplPlot:
+    """
+    The residual plot on a matplotlib figure. No Qt here: this is used by
+    the matplotlib plot view, and to export plots of the other views.
+    """
+
+    def __init__(self, figure):
+        """
+        :param figure:  The matplotlib Figure to plot on
+        """
+        # Since we have only one plot, we could use add_axes
+        # instead of add_subplot, but then the subplot
+        # configuration tool in the navigation toolbar wouldn't
+        # work.
+        self.figure = figure
+        self.axes = figure.add_subplot(111)
+        self.ax2x = self.axes.twinx()
+        self.ax2y = self.axes.twiny()
+        self.axes.set_zorder(0.1)
+        # The residual artists are kept, and updated in place
+        self.renderer = ResidualRenderer(self.axes)
+        self.extras = []  # Other artists, re-created on every plot
+        self.curves = None  # LineCollection of the curves, and what it shows
+        self.curvesShown = (None, None)
+        self.ghost = None  # Line2D of the ghost points
+
+    def clear(self, xlabel, ylabel):
+        self.axes.clear()
+        self.axes.grid(True)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        self.extras = []
+
+    def limits(self):
+        return self.axes.get_xlim() + self.axes.get_ylim()
+
+    def setResiduals(self, x, y, yerr, index, colors, selected, selected_color):
+        self.renderer.update(x, y, yerr, index, colors, selected, selected_color)
+
+    def setAxes(self, limits, xlabel, ylabel, title, x2=None, y2=None):
+        xmin, xmax, ymin, ymax = limits
+        # The twin axes only have labels, but the residual artists are kept
+        self.ax2x.clear()
+        self.ax2y.clear()
+        self.axes.grid(True)
+        self.axes.axis([xmin, xmax, ymin, ymax])
+        self.axes.get_xaxis().get_major_formatter().set_useOffset(False)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        self.axes.set_title(title, y=1.1)
+
+        self.ax2y.set_visible(x2 is not None)
+        if x2 is not None:
+            label, scale = x2
+            self.ax2y.set_xlabel(label)
+            self.ax2y.set_xlim(xmin * scale, xmax * scale)
+            self.ax2y.xaxis.set_major_locator(
+                mpl.ticker.FixedLocator(self.axes.get_xticks() * scale)
+            )
+        self.ax2x.set_visible(y2 is not None)
+        if y2 is not None:
+            label, scale = y2
+            self.ax2x.set_ylabel(label)
+            self.ax2x.set_ylim(ymin * scale, ymax * scale)
+            self.ax2x.yaxis.set_major_locator(
+                mpl.ticker.FixedLocator(self.axes.get_yticks() * scale)
+            )
+
+    def setLines(self, lines):
+        for artist in self.extras:
+            artist.remove()
+        self.extras = []
+        for x, y, color, alpha in lines:
+            self.extras += self.axes.plot(x, y, "-", color=color, alpha=alpha)
+
+    def setCurves(self, x, ys, color, alpha):
+        # Clearing the axes detaches the collection, so create it again
+        if self.curves is None or self.curves.axes is None:
+            self.curves = LineCollection([], linestyles="-", zorder=3)
+            self.axes.add_collection(self.curves, autolim=False)
+            self.curvesShown = (None, None)
+        if x is None:
+            self.curves.set_visible(False)
+            return
+        if self.curvesShown[0] is not x or self.curvesShown[1] is not ys:
+            segments = np.empty(ys.shape + (2,))
+            segments[:, :, 0] = x
+            segments[:, :, 1] = ys
+            self.curves.set_segments(segments)
+            self.curvesShown = (x, ys)
+        self.curves.set_color(color)
+        self.curves.set_alpha(alpha)
+        self.curves.set_visible(True)
+
+    def setGhost(self, x, y, color, alpha):
+        # Clearing the axes detaches the line, so create it again
+        if self.ghost is None or self.ghost.axes is None:
+            (self.ghost,) = self.axes.plot(
+                [], [], ".", markersize=4, zorder=1, scalex=False, scaley=False
+            )
+        if x is None:
+            self.ghost.set_visible(False)
+            return
+        self.ghost.set_data(x, y)
+        self.ghost.set_color(color)
+        self.ghost.set_alpha(alpha)
+        self.ghost.set_visible(True)
+
+    def stats(self):
+        artists = sum(len(axes.get_children()) for axes in self.figure.axes)
+        points = self.renderer.npoints
+        if self.curves is not None and self.curves.get_visible():
+            points += self.curvesShown[1].size
+        if self.ghost is not None and self.ghost.get_visible():
+            points += len(self.ghost.get_xdata())
+        return artists, points
+
+
+class MplPlotView(PlotView):
+    """Plot view on a matplotlib canvas"""
+
+    name = "matplotlib"
+
+    def __init__(self, parent=None):
+        super(MplPlotView, self).__init__(parent)
+
+        # Create the mpl Figure and FigCanvas objects.
+        # To start: 5x4 inches, 100 dots-per-inch
+        self.figure = Figure(constants.plk_figsize_inch, dpi=constants.plk_figure_dpi)
+        self.canvas = FigureCanvas(self.figure)
+        self.toolbar = PlkToolbar(self.canvas, parent)
+        self.toolbar.setHomeCallback(self.home.emit)
+        self.widget = self.canvas
+        self.plot = MplPlot(self.figure)
+        self.axes = self.plot.axes
+
+        self.rect = Rectangle((0, 0), 0, 0, fill=False)
+        self.rectBackground = None  # Plot without the selection box, for blitting
+        self.press = False
+        self.move = False
+        self.pressEvent = None
+
+        # Call-back functions for clicking and key-press.
+        # This is a GUI-independent way of dealing with events. Matplotlib
+        # provides that for portability. However, in Qt, we would have more
+        # flexibility if we subclass 'FigureCanvas' instead. Then we can just
+        # overload 'mousePressEvent', 'mouseMoveEvent' etc. However, we stay
+        # close to the pintk way of doing things for now
+        self.canvas.mpl_connect("button_press_event", self.canvasClickEvent)
+        self.canvas.mpl_connect("button_release_event", self.canvasReleaseEvent)
+        self.canvas.mpl_connect("motion_notify_event", self.canvasMotionEvent)
+        self.canvas.mpl_connect("key_press_event", self.canvasKeyEvent)
+        self.canvas.mpl_connect("draw_event", self.canvasDrawEvent)
+
+    @property
+    def mode(self):
+        return str(self.toolbar.mode)
+
+    def toggleZoom(self):
+        self.toolbar.zoom()
+
+    def clear(self, xlabel, ylabel):
+        self.plot.clear(xlabel, ylabel)
+        self.figure.tight_layout()
+        self.toolbar.push_current()
+        self.canvas.draw()
+
+    def limits(self):
+        return self.plot.limits()
+
+    def setResiduals(self, x, y, yerr, index, colors, selected, selected_color):
+        self.plot.setResiduals(x, y, yerr, index, colors, selected, selected_color)
+
+    def setAxes(self, limits, xlabel, ylabel, title, x2=None, y2=None):
+        self.plot.setAxes(limits, xlabel, ylabel, title, x2=x2, y2=y2)
+        # clears the views stack and puts the scaled view on top, fixes toolbar problems
+        self.toolbar.push_current()
+
+    def setLines(self, lines):
+        self.plot.setLines(lines)
+
+    def setCurves(self, x, ys, color, alpha):
+        self.plot.setCurves(x, ys, color, alpha)
+
+    def setGhost(self, x, y, color, alpha):
+        self.plot.setGhost(x, y, color, alpha)
+
+    def draw(self):
+        with self.timer.stage("layout"):
+            self.figure.tight_layout()
+        with self.timer.stage("draw"):
+            self.canvas.draw()
+
+    def stats(self):
+        return self.plot.stats()
+
+    def resetHistory(self):
+        self.toolbar.update()
+
+    def savefig(self, filename):
+        self.figure.savefig(filename)
+
+    def canvasClickEvent(self, event):
+        """
+        Call this function when the figure/canvas is clicked
+        """
+        log.debug(f"You clicked in the canvas (button = {event.button})")
+        self.canvas.setFocus()
+        if event.inaxes == self.axes:
+            self.press = True
+            self.pressEvent = event
+
+            # Unlike in Tk, in PyQt we don't directly draw on the canvas
+            # So, we need to create a rectangle artist using Matplotlib and add
+            # it to the axes. It is animated, so it is only drawn by blitting
+            # on top of the cached plot, never as part of a full redraw
+            self.rect = Rectangle((0, 0), 0, 0, fill=False, edgecolor='gray', animated=True)
+            self.axes.add_patch(self.rect)  # add rectangle to the axes
+
+    def canvasDrawEvent(self, event):
+        """
+        Call this function after the canvas has been redrawn completely
+        """
+        # Cache the plot (without the selection box) for blitting
+        self.rectBackground = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.timer.frame()
+
+    def blitRect(self):
+        """
+        Draw the selection box on top of the cached plot, if it is visible
+        """
+        if self.rectBackground is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.rectBackground)
+        if self.rect.get_visible() and self.rect.axes is not None:
+            self.axes.draw_artist(self.rect)
+        self.canvas.blit(self.axes.bbox)
+        self.timer.frame()
+
+    def canvasMotionEvent(self, event):
+        """
+        Call this function when mouse is moved in the figure/canvas
+        """
+        log.trace(f"Canvas motion event triggered (coords = {event.xdata, event.ydata})")
+        if event.inaxes == self.axes and self.press:
+            self.move = True
+            # Draw bounding box
+            x0, x1 = self.pressEvent.xdata, event.xdata
+            y0, y1 = self.pressEvent.ydata, event.ydata
+            self.rect.set_xy((min([x0, x1]), min([y0, y1])))  # set bottom left corner
+            self.rect.set_width(abs(x1 - x0))  # set width
+            self.rect.set_height(abs(y1 - y0))  # set height
+            self.rect.set_visible(True)  # make rectangle visible
+            self.blitRect()              # Don't need to update the whole plot
+
+    def canvasReleaseEvent(self, event):
+        """
+        Call this function when the figure/canvas is released
+        """
+        log.debug(f"canvasReleaseEvent triggered (coords = {event.x, event.y})")
+        self.rect.set_visible(False)  # hide the rectangle
+        if self.rect.axes is not None:
+            self.rect.remove()
+            self.blitRect()
+
+        if self.press and event.inaxes == self.axes:
+            if not self.move:
+                log.debug(f"You stationary clicked (button = {event.button})")
+                self.clicked.emit(event.xdata, event.ydata, int(event.button))
+            elif "zoom" not in self.mode:
+                # Not in zoom mode: selecting TOAs
+                log.debug(f"You clicked and dragged in mode '{self.mode}'")
+                xmin, xmax = sorted([self.pressEvent.xdata, event.xdata])
+                ymin, ymax = sorted([self.pressEvent.ydata, event.ydata])
+                self.boxSelected.emit(xmin, xmax, ymin, ymax)
+            else:
+                # We need to NOT rescale the axes here. That is happening, even though
+                # we should be SELECTING TOAs
+                log.debug(f"In zoom mode/not in axes")
+        self.press = False
+        self.move = False
+
+    def canvasKeyEvent(self, event):
+        """
+        When one presses a button on the Figure/Canvas, this function is called.
+        The coordinates of the click are stored in event.xdata, event.ydata
+        """
+        ukey, modifiers = mpl_key_to_qt_key(event.key)
+        self.keyPressed.emit(ukey, int(modifiers), event.xdata, event.ydata)
+
+
+def make_plot_view(backend="matplotlib", parent=None):
+    """
+    Create a plot view
+
+    :param backend: One of plot_backends. If pyqtgraph is not installed, the
+                    matplotlib backend is used instead
+    :param parent:  Parent of the view and its widgets
+    :return:        The PlotView
+    """
+    if backend == "pyqtgraph":
+        try:
+            from pylk.pgplotview import PgPlotView
+        except ImportError as e:
+            log.error(f"Cannot use the pyqtgraph plot backend ({e}), using matplotlib")
+        else:
+            return PgPlotView(parent=parent)
+    elif backend != "matplotlib":
+        raise ValueError(f"Unknown plot backend '{backend}'")
+    return MplPlotView(parent=parent)
@@ -0,0 +1,115 @@
+"""Spatial index of the points in the residual plot.
+
+Picking the TOA closest to a click, and selecting the TOAs in a box, used to
+scan all plotted points for every mouse event. A PointIndex keeps the points
+sorted along both axes, so that both only need a binary search plus a look
+at the points within the x (or y) range of interest.
+
+The distance used for picking is measured in units of the current axes
+limits, which change with every zoom. A KD-tree in data coordinates cannot
+handle that scaling, but sorted coordinates can: a point can only be close
+enough to the click if it is within a window around the click along both
+axes, and the index is built once per set of plotted values.
+"""
+import numpy as np
+
+
+class _Axis:
+    """The values of one coordinate, in sorted order"""
+
+    def __init__(self, values):
+        self.order = np.argsort(values, kind="stable")
+        self.sorted = values[self.order]
+
+    def within(self, vmin, vmax):
+        """Return the point indices with vmin <= value <= vmax"""
+        lo = np.searchsorted(self.sorted, vmin, side="left")
+        hi = np.searchsorted(self.sorted, vmax, side="right")
+        return self.order[lo:hi]
+
+    def count(self, vmin, vmax):
+        """Return the number of points with vmin <= value <= vmax"""
+        return np.searchsorted(self.sorted, vmax, side="right") - np.searchsorted(
+            self.sorted, vmin, side="left"
+        )
+
+
+class PointIndex:
+    """Nearest-point and box queries on the plotted (x, y) points"""
+
+    def __init__(self, x, y):
+        """
+        :param x:   x-values of the points (plain array or Quantity)
+        :param y:   y-values of the points (plain array or Quantity)
+        """
+        self.x = np.array(getattr(x, "value", x), dtype=float)
+        self.y = np.array(getattr(y, "value", y), dtype=float)
+        self._x = _Axis(self.x)
+        self._y = _Axis(self.y)
+
+    def matches(self, x, y):
+        """True if the index was built for these points"""
+        x = np.asarray(getattr(x, "value", x), dtype=float)
+        y = np.asarray(getattr(y, "value", y), dtype=float)
+        return (
+            x.shape == self.x.shape
+            and y.shape == self.y.shape
+            and np.array_equal(x, self.x, equal_nan=True)
+            and np.array_equal(y, self.y, equal_nan=True)
+        )
+
+    def box(self, xmin, xmax, ymin, ymax):
+        """Return a boolean mask of the points strictly inside the box"""
+        # Start from the axis with the fewest candidates
+        if self._x.count(xmin, xmax) <= self._y.count(ymin, ymax):
+            cand = self._x.within(xmin, xmax)
+        else:
+            cand = self._y.within(ymin, ymax)
+        inside = (
+            (self.x[cand] > xmin)
+            & (self.x[cand] < xmax)
+            & (self.y[cand] > ymin)
+            & (self.y[cand] < ymax)
+        )
+        mask = np.zeros(len(self.x), dtype=bool)
+        mask[cand[inside]] = True
+        return mask
+
+    def nearest(self, cx, cy, xscale, yscale, maxdist, which="xy"):
+        """Return the point closest to (cx, cy)
+
+        The distance is ((x-cx)/xscale)**2 + ((y-cy)/yscale)**2, with only
+        one of the terms if which is 'x' or 'y'.
+
+        :param cx:      x-value of the coordinates
+        :param cy:      y-value of the coordinates
+        :param xscale:  Scale of the x-distance (e.g. width of the view)
+        :param yscale:  Scale of the y-distance (e.g. height of the view)
+        :param maxdist: Maximum distance of the point
+        :param which:   which axis to include in distance measure [xy/x/y]
+        :return:        (index, distance) of the closest point, or
+                        (None, None) if no point is within maxdist
+        """
+        radius = np.sqrt(maxdist)
+        dx, dy = radius * abs(xscale), radius * abs(yscale)
+        if which == "y":
+            cand = self._y.within(cy - dy, cy + dy)
+        elif which == "x" or self._x.count(cx - dx, cx + dx) <= self._y.count(
+            cy - dy, cy + dy
+        ):
+            cand = self._x.within(cx - dx, cx + dx)
+        else:
+            cand = self._y.within(cy - dy, cy + dy)
+        if len(cand) == 0:
+            return None, None
+
+        ax = 0 if which == "y" else 1
+        ay = 0 if which == "x" else 1
+        dist = (
+            ax * ((self.x[cand] - cx) / xscale) ** 2.0
+            + ay * ((self.y[cand] - cy) / yscale) ** 2.0
+        )
+        best = np.nanargmin(dist) if np.any(np.isfinite(dist)) else None
+        if best is None or dist[best] > maxdist:
+            return None, None
+        return cand[best], dist[best]
@@ -6,6 +6,7 @@ pre/post fit residuals, and other useful information.
 self.selected_toas = selected toas, self.all_toas = all toas in tim file
 """
 import copy
+import io
 
 import astropy.units as u
 import numpy as np
@@ -15,16 +16,28 @@ import pint.models
 from pint.pulsar_mjd import Time
 from pint.simulation import (
     make_fake_toas_uniform,
-    calculate_random_models,
     zero_residuals,
 )
-from pint.residuals import Residuals
 from pint.toa import get_TOAs, merge_TOAs
 from pint.utils import FTest
 
 import pint.logging
 from loguru import logger as log
 
+from pylk.derivedaxes import DerivedAxes
+from pylk.explorer import (
+    candidate_params,
+    explore_params,
+    kind_other,
+    print_explore_table,
+)
+from pylk.fitsession import FitSession
+from pylk.jumpindex import JumpIndex
+from pylk.noisecache import NoiseCache
+from pylk.residengine import ResidualEngine, model_fingerprint
+from pylk.sessioncache import SessionCache, session_key
+from pylk.toaview import TOAView
+
 
 plot_labels = [
     "pre-fit",
@@ -55,13 +68,79 @@ nofitboxpars = [
 ]
 
 
+def linearized_random_models(fitter, toas, Nmodels=15, rng=None):
+    """
+    Calculate random models from the parameter covariance matrix of a fitter
+
+    This is the linearized, batched equivalent of
+    `pint.simulation.calculate_random_models` with `return_time=True`. Rather
+    than evaluating the timing model once for every random parameter draw,
+    all draws are propagated at once through the design matrix, so the cost
+    hardly depends on the number of models.
+
+    :param fitter:  The fitter with the model and parameter covariance matrix
+    :param toas:    The TOAs for which to calculate the random models
+    :param Nmodels: Number of random models
+    :param rng:     Numpy random Generator (default: a new one)
+    :return:        Time residuals of shape [Nmodels, ntoas], w.r.t. the model
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    cov_matrix = fitter.parameter_covariance_matrix
+    param_names = cov_matrix.get_label_names(axis=0)
+    fac = fitter.fac
+    if param_names[0] == "Offset":
+        # remove the first column and row (absolute phase)
+        cov_matrix = cov_matrix.get_label_matrix(param_names[1:])
+        fac = fac[1:]
+        param_names = param_names[1:]
+    # scale by fac for numerical stability, like calculate_random_models
+    scaled_cov_matrix = ((cov_matrix.matrix * fac).T * fac).T
+    dparams = rng.multivariate_normal(
+        np.zeros(len(param_names)), scaled_cov_matrix, size=Nmodels
+    )
+    dparams /= fac
+
+    # The design matrix is the derivative of the residuals, so the model
+    # phase (in time) changes by -M dparams
+    M, names, units = fitter.model.designmatrix(toas, incoffset=False)
+    M = M[:, [names.index(name) for name in param_names]]
+    return -(dparams @ M.T) << u.s
+
+
+class RandomModels:
+    """Random models of a fit, to plot
+
+    These are kept in the undo states of the pulsar. They are never changed,
+    so two states compare equal if they have the same random models.
+    """
+
+    def __init__(self, mjds, resids):
+        """
+        :param mjds:    MJDs of the (fake) TOAs of the models
+        :param resids:  Time residuals of shape [Nmodels, ntoas]
+        """
+        self.mjds = mjds
+        self.resids = resids
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.mjds.nbytes + self.resids.nbytes
+
+
 class Pulsar:
     """Wrapper class for a pulsar.
 
     Contains the toas, model, residuals, and fitter
     """
 
-    def __init__(self, parfile=None, timfile=None, ephem=None, fitter="GLSFitter"):
+    def __init__(
+        self,
+        parfile=None,
+        timfile=None,
+        ephem=None,
+        fitter="GLSFitter",
+        usecache=True,
+        cachedir=None,
+    ):
         super().__init__()
 
         log.info(f"Loading pulsar parfile: {str(parfile)}")
@@ -78,16 +157,18 @@ class Pulsar:
                 f"Overriding model ephemeris {self.prefit_model.EPHEM.value} with {ephem}"
             )
             self.prefit_model.EPHEM.value = ephem
-        self.all_toas = get_TOAs(self.timfile, model=self.prefit_model, usepickle=True)
-        self.all_toas.table.sort("index")
-        self.all_toas.get_clusters(add_column=True)
+        self.cache = SessionCache(cachedir) if usecache else None
+        self.cache_key = None
+        cached_phase = self.load_TOAs()
         # Make sure that if we used a model, that any phase jumps from
         # the parfile have their flags updated in the TOA table
         if "PhaseJump" in self.prefit_model.components:
             self.prefit_model.jump_params_to_flags(self.all_toas)
         # turns pre-existing jump flags in toas.table['flags'] into parameters in parfile
         self.prefit_model.jump_flags_to_params(self.all_toas)
-        self.selected_toas = copy.deepcopy(self.all_toas)
+        # Which TOAs are in which JUMP, so we don't have to scan the flags
+        self.jump_index = JumpIndex(self.all_toas)
+        self.select_TOAs()
         print("The prefit model as a parfile:")
         print(self.prefit_model.as_parfile())
         # adds extra prefix params for fitting
@@ -95,14 +176,41 @@ class Pulsar:
 
         self.all_toas.print_summary()
 
-        self.prefit_resids = Residuals(self.all_toas, self.prefit_model)
+        # Caches the noise basis and its factorization, for GLS fits
+        self.noise_cache = NoiseCache()
+        # Caches the model phase, so we only evaluate the model when needed
+        self.resid_engine = ResidualEngine(noise_cache=self.noise_cache)
+        # With the pulse numbers of the timfile, the pre-fit residuals use
+        # the absolute phase, so that is the phase that gets cached
+        abs_phase = True if "pulse_number" in self.all_toas.table.colnames else None
+        if cached_phase is not None:
+            if abs_phase and "AbsPhase" not in self.prefit_model.components:
+                # Like the model evaluation would have done
+                self.prefit_model.add_tzr_toa(self.all_toas)
+            self.resid_engine.prime(
+                self.all_toas, self.prefit_model, cached_phase, abs_phase=abs_phase
+            )
+        self.prefit_resids = self.resid_engine.residuals(
+            self.all_toas, self.prefit_model
+        )
+        if self.cache is not None and cached_phase is None:
+            self.cache.save_phase(
+                self.cache_key,
+                self.resid_engine.model_phase(
+                    self.all_toas, self.prefit_model, abs_phase=abs_phase
+                ),
+            )
         self.selected_prefit_resids = self.prefit_resids
+        # Keeps the fitter, and what it was fitted to, from one fit to the next
+        self.fit_session = FitSession(self.resid_engine)
+        # Caches the year, day of year, and orbital phase plot axes
+        self.derived_axes = DerivedAxes()
         print(
             "RMS pre-fit PINT residuals are %.3f us\n"
             % self.prefit_resids.rms_weighted().to(u.us).value
         )
-        # Set of indices from original list that are deleted
-        self.deleted = set([])
+        # Tombstones: True for the indices from the original list that are deleted
+        self.deleted = self._index_mask()
         if fitter == "auto":
             self.fit_method = self.getDefaultFitter(downhill=False)
             log.info(
@@ -119,7 +227,9 @@ class Pulsar:
         self.fitted = False
         self.stashed = None  # for temporarily stashing some TOAs
         self.faketoas1 = None  # for random models
-        self.faketoas = None  # for random models
+        self.randoms = None  # RandomModels of the last fit
+        self.random_curves = {}  # plottable random models, see random_model_curves
+        self.random_nmodels = 15  # number of random models
         self.use_pulse_numbers = False
 
     @property
@@ -136,6 +246,70 @@ class Pulsar:
     def __contains__(self, key):
         return key in self.prefit_model.params
 
+    def load_TOAs(self):
+        """
+        Load all TOAs from the timfile, or from the session cache
+
+        :return: the cached model phase of the TOAs for the parfile model,
+                 or None if it is not available
+        """
+        if self.cache is not None and self.cache_key is None:
+            self.cache_key = session_key(self.parfile, self.timfile, self.prefit_model)
+        cached = self.cache.load(self.cache_key) if self.cache is not None else None
+        if cached is not None:
+            self.all_toas, phase = cached
+            self.nindex = int(np.max(self.all_toas.table["index"])) + 1
+            self._keep_tim_pulse_numbers()
+            return phase
+
+        self.all_toas = get_TOAs(self.timfile, model=self.prefit_model, usepickle=True)
+        self.all_toas.table.sort("index")
+        self.all_toas.get_clusters(add_column=True)
+        self.nindex = int(np.max(self.all_toas.table["index"])) + 1
+        self._keep_tim_pulse_numbers()
+        if self.cache is not None:
+            self.cache.save(self.cache_key, self.all_toas)
+        return None
+
+    def _keep_tim_pulse_numbers(self):
+        """Remember the pulse numbers of the timfile (the -pn flags), if any"""
+        self.tim_pulse_numbers = None
+        if "pulse_number" in self.all_toas.table.colnames:
+            self.tim_pulse_numbers = dict(
+                zip(
+                    np.asarray(self.all_toas.table["index"], dtype=int),
+                    np.asarray(self.all_toas.table["pulse_number"], dtype=float),
+                )
+            )
+
+    def _restore_pulse_numbers(self, toas, delta_pulse_numbers):
+        """
+        Set the pulse number columns of toas to what they were in a snapshot
+
+        Pulse numbers are those of the timfile, until they are computed from
+        the model by a fit or a phase wrap (with the delta pulse numbers at
+        zero). Without either, the residuals track the nearest pulse again.
+
+        :param toas:                The TOAs to update
+        :param delta_pulse_numbers: Dictionary of index: delta pulse number
+        """
+        indices = np.asarray(toas.table["index"], dtype=int)
+        toas.table["delta_pulse_number"] = np.zeros(toas.ntoas)
+        if self.fitted:
+            self.resid_engine.compute_pulse_numbers(toas, self.postfit_model)
+        elif self.tim_pulse_numbers is not None:
+            toas.table["pulse_number"] = np.array(
+                [self.tim_pulse_numbers.get(idx, np.nan) for idx in indices]
+            )
+            toas.table["pulse_number"].unit = u.dimensionless_unscaled
+        elif self.use_pulse_numbers:
+            self.resid_engine.compute_pulse_numbers(toas, self.prefit_model)
+        elif "pulse_number" in toas.table.colnames:
+            toas.remove_pulse_numbers()
+        toas.table["delta_pulse_number"] = np.array(
+            [delta_pulse_numbers.get(idx, 0.0) for idx in indices]
+        )
+
     def reset_model(self):
         self.prefit_model = pint.models.get_model(self.parfile)
         self.add_model_params()
@@ -145,16 +319,19 @@ class Pulsar:
         self.update_resids()
 
     def reset_TOAs(self):
-        self.all_toas = get_TOAs(self.timfile, model=self.prefit_model, usepickle=True)
+        self.load_TOAs()
         # Make sure that if we used a model, that any phase jumps from
         # the parfile have their flags updated in the TOA table
         if "PhaseJump" in self.prefit_model.components:
             self.prefit_model.jump_params_to_flags(self.all_toas)
         # turns pre-existing jump flags in toas.table['flags'] into parameters in parfile
         self.prefit_model.jump_flags_to_params(self.all_toas)
-        self.selected_toas = copy.deepcopy(self.all_toas)
-        self.deleted = set([])
+        self.jump_index.rebuild(self.all_toas)
+        self.select_TOAs()
+        self.deleted = self._index_mask()
         self.stashed = None
+        self.resid_engine.invalidate()
+        self.derived_axes.invalidate()
         self.update_resids()
 
     def resetAll(self):
@@ -165,51 +342,75 @@ class Pulsar:
         self.use_pulse_numbers = False
         self.reset_TOAs()
 
+    def select_TOAs(self, selected=None):
+        """
+        Select a subset of all_toas, without copying them
+
+        :param selected: boolean array to apply to toas, True = selected toa.
+                         None, or nothing selected, means all TOAs are selected
+        """
+        self.selected_toas = TOAView(self.all_toas, selected)
+
+    def _index_mask(self, indices=()):
+        """
+        Boolean mask over the index space of the TOAs in the timfile
+
+        :param indices: The TOA indices that are set to True
+        """
+        mask = np.zeros(self.nindex, dtype=bool)
+        mask[np.asarray(list(indices), dtype=int)] = True
+        return mask
+
     def _delete_TOAs(self, toa_table):
-        del_inds = np.in1d(toa_table["index"], np.array(list(self.deleted)))
+        return self._delete_TOAs_from(toa_table, self.deleted)
+
+    def _delete_TOAs_from(self, toa_table, tombstones):
+        """
+        Remove the rows of toa_table that are marked in tombstones
+
+        :param toa_table:   The TOA table
+        :param tombstones:  Boolean mask over the TOA indices, True = remove
+        :return:            The remaining rows, or None if there are none
+        """
+        del_inds = tombstones[np.asarray(toa_table["index"], dtype=int)]
         return toa_table[~del_inds] if del_inds.sum() < len(toa_table) else None
 
     def delete_TOAs(self, indices, selected):
         # note: indices should be a list or an array
-        self.deleted |= set(indices)  # update the deleted indices
-        if selected is not None:
-            self.selected_toas.table = self._delete_TOAs(self.selected_toas.table)
+        self.deleted[np.asarray(indices, dtype=int)] = True
+        del_inds = self.deleted[np.asarray(self.all_toas.table["index"], dtype=int)]
         # Now delete from all_toas
         self.all_toas.table = self._delete_TOAs(self.all_toas.table)
-        if self.selected_toas.table is None:  # all selected were deleted
-            self.selected_toas = copy.deepcopy(self.all_toas)
-            selected = np.zeros(self.selected_toas.ntoas, dtype=bool)
-        else:
-            # Make a new selected list by adding a value if the table
-            # index at that position is not in the new indices to
-            # delete, with a value that is the same as the previous
-            # selected array
-            newselected = [
-                sel
-                for idx, sel in zip(self.all_toas.table["index"], selected)
-                if idx not in indices
-            ]
-            selected = np.asarray(newselected, dtype=bool)
-            self.selected_toas = self.all_toas[selected]
+        # Keep the selection of the TOAs that are left
+        if selected is not None:
+            selected = np.asarray(selected, dtype=bool)[~del_inds]
+        if selected is None or not np.any(selected):  # all selected were deleted
+            selected = np.zeros(self.all_toas.ntoas, dtype=bool)
+        self.select_TOAs(selected)
         # delete the TOAs from the stashed list also
         if self.stashed:
             self.stashed.table = self._delete_TOAs(self.stashed.table)
         return selected
 
     def update_resids(self):
-        # update the pre and post fit residuals using all_toas
+        """Update the pre and post fit residuals using all_toas
+
+        The model is only re-evaluated if it has changed since the last call,
+        or for TOAs it has not been evaluated for yet. Deleting, stashing,
+        selecting and phase-wrapping TOAs only re-uses the cached phases.
+        """
         track_mode = "use_pulse_numbers" if self.use_pulse_numbers else None
-        self.prefit_resids = Residuals(
+        self.prefit_resids = self.resid_engine.residuals(
             self.all_toas, self.prefit_model, track_mode=track_mode
         )
-        if self.selected_toas.ntoas and self.selected_toas.ntoas != self.all_toas.ntoas:
-            self.selected_prefit_resids = Residuals(
-                self.selected_toas, self.prefit_model, track_mode=track_mode
+        if not self.selected_toas.is_all:
+            self.selected_prefit_resids = self.resid_engine.residuals(
+                self.selected_toas.toas, self.prefit_model, track_mode=track_mode
             )
         else:
             self.selected_prefit_resids = self.prefit_resids
         if self.fitted:
-            self.postfit_resids = Residuals(
+            self.postfit_resids = self.resid_engine.residuals(
                 self.all_toas, self.postfit_model, track_mode=track_mode
             )
 
@@ -222,33 +423,48 @@ class Pulsar:
             log.warning("This is not a binary pulsar")
             return u.Quantity(np.zeros(self.all_toas.ntoas))
 
-        toas = self.all_toas
-        if self.fitted:
-            phase = self.postfit_model.orbital_phase(toas, anom="mean")
-        else:
-            phase = self.prefit_model.orbital_phase(toas, anom="mean")
-        return phase / (2 * np.pi * u.rad)
+        model = self.postfit_model if self.fitted else self.prefit_model
+        # The orbital phase only depends on the delays, not on the spin model
+        delay_params = [
+            param for component in model.DelayComponent_list for param in component.params
+        ]
+        return self.derived_axes.get(
+            "orbital phase",
+            self.all_toas,
+            lambda toas: model.orbital_phase(toas, anom="mean") / (2 * np.pi * u.rad),
+            key=model_fingerprint(model, delay_params),
+        )
 
     def dayofyear(self):
         """
         Return the day of the year for all the TOAs of this pulsar
         """
-        t = Time(self.all_toas.get_mjds(), format="mjd")
-        year = Time(np.floor(t.decimalyear), format="decimalyear")
-        return np.asarray(t.mjd - year.mjd) << u.day
+
+        def compute(toas):
+            t = Time(toas.get_mjds(), format="mjd")
+            year = Time(np.floor(t.decimalyear), format="decimalyear")
+            return np.asarray(t.mjd - year.mjd) << u.day
+
+        return self.derived_axes.get("day of year", self.all_toas, compute)
 
     def year(self):
         """
         Return the decimal year for all the TOAs of this pulsar
         """
-        t = Time(self.all_toas.get_mjds(), format="mjd")
-        return np.asarray(t.decimalyear) << u.year
 
-    def add_model_params(self):
+        def compute(toas):
+            t = Time(toas.get_mjds(), format="mjd")
+            return np.asarray(t.decimalyear) << u.year
+
+        return self.derived_axes.get("year", self.all_toas, compute)
+
+    def add_model_params(self, model=None):
         """This automatically adds the next available unfit prefix
         parameters to the model so they show up on the GUI
+
+        :param model:   The model to add them to (None = the pre-fit model)
         """
-        m = self.prefit_model
+        m = self.prefit_model if model is None else model
         # Add next spin freq deriv
         if "Spindown" in m.components:
             c = m.components["Spindown"]
@@ -343,27 +559,16 @@ class Pulsar:
         :param phase: phase difference to be added, i.e.  -0.5, +2, etc.
         """
         # Check if pulse numbers are in table already, if not, make the column
-        if (
-            "pulse_number" not in self.all_toas.table.colnames
-            or "pulse_number" not in self.selected_toas.table.colnames
-        ):
-            if self.fitted:
-                self.all_toas.compute_pulse_numbers(self.postfit_model)
-                self.selected_toas.compute_pulse_numbers(self.postfit_model)
-            else:
-                self.all_toas.compute_pulse_numbers(self.prefit_model)
-                self.selected_toas.compute_pulse_numbers(self.prefit_model)
-        if (
-            "delta_pulse_number" not in self.all_toas.table.colnames
-            or "delta_pulse_number" not in self.selected_toas.table.colnames
-        ):
+        if "pulse_number" not in self.all_toas.table.colnames:
+            model = self.postfit_model if self.fitted else self.prefit_model
+            self.resid_engine.compute_pulse_numbers(self.all_toas, model)
+        if "delta_pulse_number" not in self.all_toas.table.colnames:
             self.all_toas.table["delta_pulse_number"] = np.zeros(self.all_toas.ntoas)
-            self.selected_toas.table["delta_pulse_number"] = np.zeros(
-                self.selected_toas.ntoas
-            )
 
         # add phase wrap and update
         self.all_toas.table["delta_pulse_number"][selected] += phase
+        # The selected TOAs are re-sliced from all_toas with the new columns
+        self.selected_toas.invalidate()
         self.use_pulse_numbers = True
         self.update_resids()
 
@@ -383,12 +588,17 @@ class Pulsar:
             retval = self.prefit_model.add_jump_and_flags(
                 self.all_toas.table["flags"][selected]
             )
+            self._index_new_jump(retval, selected)
+            self.resid_engine.invalidate()
             if self.fitted:
                 self.postfit_model.add_component(a)
             log.info(f"New jump {retval} added for {selected.sum()} toas.")
             return retval
         # if gets here, has at least one jump param already
         # and iif it doesn't overlap or cancel, add the param
+        # Whatever happens below changes the jump flags of the TOAs, which
+        # changes the phase without changing the model parameters
+        self.resid_engine.invalidate()
         numjumps = self.prefit_model.components["PhaseJump"].get_number_of_jumps()
         if numjumps == 0:
             log.warning(
@@ -396,41 +606,49 @@ class Pulsar:
             )
             return None
         # delete the jump ad flags if the selected TOAs exactly overlap;
-        # else just delete the jump flag from the selected TOAs
-        for num in range(1, numjumps + 1):
-            # create boolean array corresponding to TOAs to be jumped
-            toas_jumped = [
-                "jump" in dict.keys() and str(num) in dict["jump"]
-                for dict in self.all_toas.table["flags"]
-            ]
-            if np.array_equal(toas_jumped, selected):
+        # else just delete the jump flag from the selected TOAs.
+        # Only the first jump that overlaps with the selected TOAs matters
+        nvisible, nselected = self.jump_index.overlap(
+            self.all_toas, selected, numjumps
+        )
+        nsel = np.count_nonzero(selected)
+        exact = (nvisible == nsel) & (nselected == nsel)
+        candidates = np.flatnonzero(exact | (nselected > 0))
+        candidates = candidates[candidates >= 1]
+        if len(candidates) > 0:
+            num = int(candidates[0])
+            # boolean array corresponding to TOAs jumped by this jump
+            toas_jumped = self.jump_index.mask(self.all_toas, num)
+            if exact[num]:
                 # if current jump exactly matches selected, remove it
                 self.prefit_model.delete_jump_and_flags(
                     self.all_toas.table["flags"], num
                 )
+                self.jump_index.remove(num, self.all_toas.table["index"])
                 if self.fitted:
                     self.postfit_model.delete_jump_and_flags(None, num)
                 log.info("removed param", f"JUMP{str(num)}")
-                return toas_jumped
+                return list(toas_jumped)
 
             # Has to be some overlap between jumps and selected TOAs
-            elif np.any(toas_jumped & selected):
-                # if not, then they don't exactly match, delete the common subset
-                jumped_selected = toas_jumped & selected
-                # Post fit model and prefit model share the same TOA table, so as long as we
-                # don't delete the jump altogether, modifying prefit model table flags is fine.
-                self.prefit_model.delete_not_all_jump_toas(
-                    self.all_toas.table["flags"][jumped_selected], num
-                )
-                log.info(
-                    f"Removed existing jump JUMP{str(num)} from {jumped_selected.astype(int).sum()} TOAs"
-                )
-                return list(jumped_selected)
+            # if not, then they don't exactly match, delete the common subset
+            jumped_selected = toas_jumped & selected
+            # Post fit model and prefit model share the same TOA table, so as long as we
+            # don't delete the jump altogether, modifying prefit model table flags is fine.
+            self.prefit_model.delete_not_all_jump_toas(
+                self.all_toas.table["flags"][jumped_selected], num
+            )
+            self.jump_index.remove(num, self.all_toas.table["index"][jumped_selected])
+            log.info(
+                f"Removed existing jump JUMP{str(num)} from {jumped_selected.astype(int).sum()} TOAs"
+            )
+            return list(jumped_selected)
         # if here, then doesn't match anything
         # add jump flags to selected TOAs at their perspective indices in the TOA tables
         retval = self.prefit_model.add_jump_and_flags(
             self.all_toas.table["flags"][selected]
         )
+        self._index_new_jump(retval, selected)
         log.info(f"New jump {retval} added for {selected.sum()} toas.")
         if (
             self.fitted
@@ -447,6 +665,13 @@ class Pulsar:
             self.postfit_model.components["PhaseJump"].setup()
         return retval
 
+    def _index_new_jump(self, jump_name, selected):
+        """Add the selected TOAs to the jump index, if jump_name was added"""
+        if jump_name is not None:
+            self.jump_index.add(
+                int(jump_name[4:]), self.all_toas.table["index"][selected]
+            )
+
     def getDefaultFitter(self, downhill=False):
         if self.all_toas.wideband:
             return "WidebandDownhillFitter" if downhill else "WidebandTOAFitter"
@@ -465,7 +690,9 @@ class Pulsar:
             self.prefit_resids = self.postfit_resids
             self.add_model_params()
 
-        self.selected_resids = Residuals(self.selected_toas, self.prefit_model)
+        self.selected_resids = self.resid_engine.residuals(
+            self.selected_toas.toas, self.prefit_model
+        )
 
         wrms = self.selected_resids.rms_weighted()
         print("------------------------------------")
@@ -478,9 +705,22 @@ class Pulsar:
         print("Selected Weighted RMS:  %.8g us" % wrms.to(u.us).value)
         print("------------------------------------")
 
-    def fit(self, selected, iters=4, compute_random=False):
+    def fit(
+        self, selected, iters=4, compute_random=False, progress=None, cancelled=None
+    ):
         """
         Run a fit using the specified fitter
+
+        This can be run on a worker thread. The fit can only be cancelled in
+        between iterations, after which the pulsar is left half-way: the
+        caller is responsible for restoring the previous state.
+
+        :param selected:        boolean array to apply to toas, True = selected toa
+        :param iters:           Number of fit iterations
+        :param compute_random:  Also compute random models after the fit
+        :param progress:        Called as progress(iteration, iterations)
+        :param cancelled:       Called before each iteration, cancel if True
+        :return:                True if the fit finished, False if cancelled
         """
         # Select all the TOAs if none are explicitly set
         if not np.any(selected):
@@ -491,18 +731,25 @@ class Pulsar:
             self.prefit_resids = self.postfit_resids
             self.add_model_params()
 
-        if self.selected_toas.ntoas != self.all_toas.ntoas:
-            self.selected_prefit_resids = Residuals(
-                self.selected_toas, self.prefit_model
+        if not self.selected_toas.is_all:
+            self.selected_prefit_resids = self.resid_engine.residuals(
+                self.selected_toas.toas, self.prefit_model
             )
         else:
             self.selected_prefit_resids = self.prefit_resids
 
-        # Have to change the fitter for each fit since TOAs and models change
+        # The fit session re-uses what it can of the last fit
         log.info(f"Using {self.fit_method}")
-        self.fitter = getattr(pint.fitter, self.fit_method)(
-            self.selected_toas, self.prefit_model
+        update = self.fit_session.can_update(
+            self.fit_method, self.selected_toas.toas, self.prefit_model
         )
+        if not update:
+            self.fitter = self.fit_session.start(
+                self.fit_method,
+                self.selected_toas.toas,
+                self.prefit_model,
+                residuals=self.selected_prefit_resids,
+            )
 
         wrms = self.selected_prefit_resids.rms_weighted()
         print("\n------------------------------------")
@@ -512,27 +759,37 @@ class Pulsar:
         print("------------------------------------")
 
         # Do the actual fit and mark things as being fit
-        self.fitter.fit_toas(maxiter=iters)
-        self.fitter.update_model()
+        if update:
+            self.fitter = self.fit_session.update(
+                self.selected_toas.toas, self.prefit_model
+            )
+        elif self.run_fitter(iters, progress=progress, cancelled=cancelled):
+            self.fitter.update_model()
+        else:
+            log.info("Fit cancelled")
+            return False
         self.postfit_model = self.fitter.model
         self.fitted = True
 
         # Zero out all of the "delta_pulse_numbers" if they are set
         if np.any(self.all_toas.table["delta_pulse_number"]):
             self.all_toas.table["delta_pulse_number"] = np.zeros(self.all_toas.ntoas)
-            self.selected_toas.table["delta_pulse_number"] = np.zeros(
-                self.selected_toas.ntoas
+            self.fitter.toas.table["delta_pulse_number"] = np.zeros(
+                self.fitter.toas.ntoas
             )
         # Re-calculate the pulse numbers here
-        self.all_toas.compute_pulse_numbers(self.postfit_model)
-        self.selected_toas.compute_pulse_numbers(self.postfit_model)
+        self.resid_engine.compute_pulse_numbers(self.all_toas, self.postfit_model)
+        self.resid_engine.compute_pulse_numbers(self.fitter.toas, self.postfit_model)
+        self.fit_session.finish()
 
         # Compute the residuals using correct pulse numbers
-        self.postfit_resids = Residuals(self.all_toas, self.postfit_model)
+        self.postfit_resids = self.resid_engine.residuals(
+            self.all_toas, self.postfit_model
+        )
         self.selected_postfit_resids = (
             self.postfit_resids
             if np.all(selected)
-            else Residuals(self.selected_toas, self.postfit_model)
+            else self.resid_engine.residuals(self.fitter.toas, self.postfit_model)
         )
 
         # Need this since it isn't updated using self.fitter.update_model()
@@ -561,12 +818,7 @@ class Pulsar:
             )
 
         # plot the prefit without jumps
-        pm_no_jumps = copy.deepcopy(self.prefit_model)
-        for param in pm_no_jumps.params:
-            if param.startswith("JUMP"):
-                getattr(pm_no_jumps, param).value = 0.0
-                getattr(pm_no_jumps, param).frozen = True
-        self.prefit_resids_no_jumps = Residuals(self.all_toas, pm_no_jumps)
+        self.update_prefit_resids_no_jumps()
 
         # Store some key params for possible F-testing
         self.lastfit = {
@@ -579,8 +831,243 @@ class Pulsar:
         # adds extra prefix params for fitting
         self.add_model_params()
 
-    def random_models(self, selected):
-        """Compute and plot random models"""
+        if compute_random:
+            self.random_models(selected)
+        return True
+
+    def run_fitter(self, iters, progress=None, cancelled=None):
+        """
+        Run the fitter, until it converges or for at most iters iterations
+
+        :param iters:       Maximum number of fit iterations
+        :param progress:    Called as progress(step, steps) after each step
+        :param cancelled:   Called before each step, stop if it returns True
+        :return:            True if the fit finished, False if cancelled
+        """
+        return self.fit_session.run(iters, progress=progress, cancelled=cancelled)
+
+    def preview_fit(self, selected):
+        """
+        Predict a fit with the current free parameters, without running it
+
+        The fit is linearized around the model the next fit starts from, and
+        uses the design matrix of the last fit where it can, so this is fast
+        enough to run whenever a fit checkbox is toggled.
+
+        :param selected:    boolean array to apply to toas, True = selected toa
+        :return:            A FitPreview, with the predicted residuals of all
+                            TOAs and the predicted chi2
+        """
+        model = self.postfit_model if self.fitted else self.prefit_model
+        resids = self.postfit_resids if self.fitted else self.prefit_resids
+        preview = self.fit_session.preview(self.all_toas, model, resids, selected)
+
+        print("\n------------------------------------")
+        print(" Preview Chi2:          %.8g" % preview.chi2)
+        print(" Preview reduced-Chi2:  %.8g" % preview.reduced_chi2)
+        print("------------------------------------")
+        return preview
+
+    def explore_snapshot(self, candidates=None):
+        """
+        Return copies of what explore_params fits: the TOAs, the model, and
+        the candidate parameters
+
+        The copies are independent of the pulsar, so the pulsar can be edited
+        while they are fitted (e.g. on another thread).
+
+        :param candidates:  Names of the parameters to try (None = all
+                            candidates). These can be any fittable parameter
+        :return:            Tuple (toas, model, candidates), with candidates
+                            a list of (name, kind) tuples
+        """
+        model = copy.deepcopy(self.postfit_model if self.fitted else self.prefit_model)
+        toas = copy.deepcopy(self.selected_toas.toas)
+        # The next derivatives are candidates too
+        self.add_model_params(model)
+        found = candidate_params(model, exclude=nofitboxpars)
+        if candidates is not None:
+            kinds = dict(found)
+            found = [(name, kinds.get(name, kind_other)) for name in candidates]
+        return toas, model, found
+
+    def explore_params(self, candidates=None, iters=4, workers=None, fit_method=None):
+        """
+        Find out which parameter to fit next, with an F-test per candidate
+
+        Every frozen candidate parameter (the next derivatives, the jumps
+        and the binary parameters) is fitted in addition to the free
+        parameters, in worker processes, for the selected TOAs. The fits
+        use copies of the model and the TOAs (see explore_snapshot), so the
+        pulsar is not changed.
+
+        :param candidates:  Names of the parameters to try (None = all
+                            candidates). These can be any fittable parameter
+        :param iters:       Number of fit iterations
+        :param workers:     Number of worker processes (None = number of CPUs)
+        :param fit_method:  Name of the pint fitter class (None = fit_method)
+        :return:            List of result dictionaries, with the most
+                            significant first (see explorer.explore_params)
+        """
+        toas, model, found = self.explore_snapshot(candidates)
+        results = explore_params(
+            toas,
+            model,
+            self.fit_method if fit_method is None else fit_method,
+            candidates=found,
+            iters=iters,
+            workers=workers,
+        )
+        print_explore_table(results)
+        return results
+
+    def update_prefit_resids_no_jumps(self):
+        """Compute the pre-fit residuals with all jumps set to zero"""
+        pm_no_jumps = copy.deepcopy(self.prefit_model)
+        for param in pm_no_jumps.params:
+            if param.startswith("JUMP"):
+                getattr(pm_no_jumps, param).value = 0.0
+                getattr(pm_no_jumps, param).frozen = True
+        # Without jumps, this is the phase of the pre-fit model
+        self.resid_engine.share(pm_no_jumps, self.prefit_model)
+        self.prefit_resids_no_jumps = self.resid_engine.residuals(
+            self.all_toas, pm_no_jumps
+        )
+
+    def get_state(self, selected=None):
+        """
+        Return a compact snapshot of everything that can be edited in plk
+
+        The snapshot contains plain values only, so that a Journal can store
+        the differences between snapshots rather than copies of the Pulsar.
+
+        :param selected: boolean array to apply to toas, True = selected toa
+        :return:         Dictionary with the state of the pulsar
+        """
+        toas = self.stashed if self.stashed is not None else self.all_toas
+        indices = [int(idx) for idx in toas.table["index"]]
+        jumps = {}
+        for idx, flags in zip(indices, toas.table["flags"]):
+            jump, gui_jump = flags.get("jump", None), flags.get("gui_jump", None)
+            if jump is not None or gui_jump is not None:
+                jumps[idx] = (jump, gui_jump)
+        delta_pulse_numbers = {}
+        if "delta_pulse_number" in self.all_toas.table.colnames:
+            dpn = np.asarray(self.all_toas.table["delta_pulse_number"])
+            for idx, value in zip(self.all_toas.table["index"][dpn != 0], dpn[dpn != 0]):
+                delta_pulse_numbers[int(idx)] = float(value)
+        visible = frozenset(int(idx) for idx in self.all_toas.table["index"])
+        if selected is not None and np.any(selected):
+            sel = self.all_toas.table["index"][np.asarray(selected, dtype=bool)]
+            selected = frozenset(int(idx) for idx in sel)
+        else:
+            selected = frozenset()
+        return {
+            "prefit_model": self.prefit_model.as_parfile().splitlines(),
+            "postfit_model": self.postfit_model.as_parfile().splitlines()
+            if self.fitted
+            else None,
+            "fitted": self.fitted,
+            "use_pulse_numbers": self.use_pulse_numbers,
+            "deleted": frozenset(int(idx) for idx in np.flatnonzero(self.deleted)),
+            "stashed": frozenset(set(indices) - visible)
+            if self.stashed is not None
+            else None,
+            "jumps": jumps,
+            "delta_pulse_numbers": delta_pulse_numbers,
+            "selected": selected,
+            "random_models": self.randoms if self.fitted else None,
+        }
+
+    def set_state(self, state):
+        """
+        Restore a snapshot that was made with get_state
+
+        The TOAs are only re-read from the timfile when TOAs need to be
+        undeleted. The fitter itself is not part of the snapshot.
+
+        :param state:    Dictionary with the state of the pulsar
+        :return:         boolean array of the selected toas
+        """
+        self.prefit_model = pint.models.get_model(
+            io.StringIO("\n".join(state["prefit_model"]))
+        )
+        self.fitted = state["fitted"]
+        self.postfit_model = (
+            pint.models.get_model(io.StringIO("\n".join(state["postfit_model"])))
+            if self.fitted
+            else None
+        )
+        self.postfit_resids = None
+        self.use_pulse_numbers = state["use_pulse_numbers"]
+
+        deleted = self._index_mask(state["deleted"])
+        toas = self.stashed if self.stashed is not None else self.all_toas
+        if np.any(self.deleted & ~deleted):
+            # Some TOAs come back, so we need to read them again
+            self.load_TOAs()
+            toas = self.all_toas
+        if np.any(deleted):
+            toas.table = self._delete_TOAs_from(toas.table, deleted)
+        self.deleted = deleted
+
+        # Jump flags are shared by the stashed and the visible TOAs
+        jumps = state["jumps"]
+        for idx, flags in zip(toas.table["index"], toas.table["flags"]):
+            flags.pop("jump", None)
+            flags.pop("gui_jump", None)
+            jump, gui_jump = jumps.get(int(idx), (None, None))
+            if jump is not None:
+                flags["jump"] = jump
+            if gui_jump is not None:
+                flags["gui_jump"] = gui_jump
+        self.jump_index.rebuild(toas)
+
+        # Before the split, so that the stashed TOAs get them as well
+        self.resid_engine.invalidate()
+        self._restore_pulse_numbers(toas, state["delta_pulse_numbers"])
+
+        if state["stashed"] is not None:
+            self.stashed = toas
+            self.all_toas = copy.copy(toas)
+            self.all_toas.table = self._delete_TOAs_from(
+                toas.table, self._index_mask(state["stashed"])
+            )
+        else:
+            self.stashed = None
+            self.all_toas = toas
+
+        self.resid_engine.invalidate()
+
+        selected = np.isin(self.all_toas.table["index"], list(state["selected"]))
+        self.select_TOAs(selected)
+        self.add_model_params()
+        self.fitter = None
+        self.fit_session.reset()
+        self.randoms = state["random_models"]
+        self.random_curves = {}
+        if hasattr(self, "lastfit"):
+            del self.lastfit
+        self.update_resids()
+        if self.fitted:
+            self.selected_postfit_resids = (
+                self.postfit_resids
+                if self.selected_toas.is_all
+                else self.resid_engine.residuals(
+                    self.selected_toas.toas, self.postfit_model
+                )
+            )
+            self.update_prefit_resids_no_jumps()
+        return selected
+
+    def random_models(self, selected, nmodels=None):
+        """
+        Compute and plot random models
+
+        :param selected: boolean array to apply to toas, True = selected toa
+        :param nmodels:  Number of random models (default: random_nmodels)
+        """
+        nmodels = self.random_nmodels if nmodels is None else nmodels
         log.info("Computing random models based on parameter covariance matrix.")
         if [p for p in self.postfit_model.free_params if p.startswith("DM")]:
             log.warning(
@@ -588,7 +1075,7 @@ class Pulsar:
             )
 
         # These are the currently selected TOAs in the fit
-        sim_sel = copy.deepcopy(self.selected_toas)
+        sim_sel = self.selected_toas.toas
         # These are single TOAs from each cluster of TOAs
         inds = np.zeros(sim_sel.ntoas, dtype=bool)
         inds[np.unique(sim_sel.get_clusters(), return_index=True)[1]] |= True
@@ -620,8 +1107,9 @@ class Pulsar:
                 self.postfit_model,
                 obs="coe",
                 freq=1 * u.THz,  # effectively infinite frequency
+                # pint always includes the GPS corrections (there is no
+                # include_gps anymore)
                 include_bipm=sim_sel.clock_corr_info["include_bipm"],
-                include_gps=sim_sel.clock_corr_info["include_gps"],
             )
         self.faketoas1.compute_pulse_numbers(self.postfit_model)
         self.faketoas1.get_clusters(add_column=True)
@@ -634,13 +1122,7 @@ class Pulsar:
         refs = np.asarray(toas.get_flag_value("name")[0]) != "fake"
 
         # Compute the new random timing models
-        rs = calculate_random_models(
-            self.fitter,
-            toas,
-            Nmodels=15,
-            keep_models=False,
-            return_time=True,
-        )
+        rs = linearized_random_models(self.fitter, toas, Nmodels=nmodels)
 
         # Get a selection array for the fake TOAs that covers the fit TOAs (plus extra)
         mjds = toas.get_mjds().value
@@ -660,5 +1142,29 @@ class Pulsar:
         rs -= ran_mean[:, np.newaxis]
         rs += ref_mean
         # And store the key things for plotting
-        self.faketoas = toas
-        self.random_resids = rs
+        self.randoms = RandomModels(mjds, rs)
+        self.random_curves = {}
+
+    def random_model_curves(self, year=False, unit=u.us):
+        """
+        Return the random models as curves to plot
+
+        The curves are sorted in time, so that the lines are smooth. They are
+        computed once for every x-axis type and unit, and kept until the next
+        random models are computed.
+
+        :param year:    x-values in decimal years, instead of MJD
+        :param unit:    Time unit of the y-values
+        :return:        (x, ys), plain arrays of shape [nfake] and
+                        [Nmodels, nfake], or None if there are no random models
+        """
+        if self.randoms is None:
+            return None
+        key = (year, str(unit))
+        if key not in self.random_curves:
+            mjds = self.randoms.mjds
+            order = np.argsort(mjds, kind="stable")
+            x = Time(mjds[order], format="mjd").decimalyear if year else mjds[order]
+            ys = self.randoms.resids[:, order].to_value(unit)
+            self.random_curves[key] = (np.asarray(x), ys)
+        return self.random_curves[key]
@@ -0,0 +1,285 @@
+"""Retained-mode rendering of the residual plot.
+
+The plk plot used to be cleared and rebuilt from scratch on every update:
+one errorbar (a marker line plus a collection of error bars) per color
+group, created again even when only a single TOA got selected. Creating
+those artists costs far more than drawing them.
+
+The ResidualRenderer keeps its artists alive between updates:
+
+- one base layer with all TOAs that the color mode shows, with a color per
+  TOA (looked up at once from the per-TOA color index of the color mode)
+- one overlay with the selected TOAs, in the selection color, on top
+
+An update compares the new data, colors and selection with what is shown,
+and only changes the artists that differ. Selecting TOAs therefore only
+touches the (small) overlay.
+
+Per-TOA error bars do not scale to millions of TOAs. When more than
+`lod_threshold` TOAs are within the current view, the renderer switches to a
+level-of-detail view: the layers are hidden, and a density raster of the
+view is shown instead, with the mean color of the TOAs in every pixel. This
+is re-evaluated whenever the axes limits change, so zooming in far enough
+brings back the exact errorbars.
+"""
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.image import AxesImage
+
+
+# Maximum number of TOAs in view that are drawn individually
+LOD_THRESHOLD = 20000
+
+# Size of a level-of-detail raster pixel, in screen pixels
+LOD_PIXEL = 2
+
+
+def _plain(values):
+    """Return values as a plain float array (dropping any unit)"""
+    return np.asarray(getattr(values, "value", values), dtype=float)
+
+
+def _same(a, b):
+    """True if a and b are both None, or equal arrays (NaNs included)"""
+    if a is None or b is None:
+        return a is b
+    return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+
+
+def _segments(x, y, yerr):
+    """Return the vertical error bar segments, shape (n, 2, 2)"""
+    segments = np.empty((len(x), 2, 2))
+    segments[:, :, 0] = x[:, None]
+    segments[:, 0, 1] = y - yerr
+    segments[:, 1, 1] = y + yerr
+    return segments
+
+
+class _Layer:
+    """Points with (optional) error bars, with one color per point"""
+
+    def __init__(self, axes, zorder):
+        self.errors = LineCollection([], zorder=zorder)
+        self.points = axes.scatter([], [], marker=".", zorder=zorder + 0.1)
+        axes.add_collection(self.errors, autolim=False)
+        self.x = self.y = self.yerr = self.colors = None
+
+    @property
+    def attached(self):
+        return self.points.axes is not None and self.errors.axes is not None
+
+    def remove(self):
+        for artist in (self.points, self.errors):
+            if artist.axes is not None:
+                artist.remove()
+
+    def set_visible(self, visible):
+        self.points.set_visible(visible)
+        self.errors.set_visible(visible)
+
+    def update(self, x, y, yerr, colors):
+        """Show these points, and return True if anything changed"""
+        changed = False
+        if not (_same(x, self.x) and _same(y, self.y) and _same(yerr, self.yerr)):
+            self.points.set_offsets(np.column_stack([x, y]))
+            if yerr is None:
+                self.errors.set_segments([])
+            else:
+                self.errors.set_segments(_segments(x, y, yerr))
+            self.x, self.y, self.yerr = x, y, yerr
+            changed = True
+        if changed or not _same(colors, self.colors):
+            self.points.set_facecolor(colors)
+            self.points.set_edgecolor(colors)
+            self.errors.set_color(colors)
+            self.colors = colors
+            changed = True
+        return changed
+
+
+def density_raster(x, y, colors, extent, shape):
+    """Return an RGBA image with the mean color and density of the points
+
+    :param x:       x-values of the points
+    :param y:       y-values of the points
+    :param colors:  RGBA colors of the points, shape (n, 4)
+    :param extent:  (xmin, xmax, ymin, ymax) of the image
+    :param shape:   (ny, nx) of the image
+    :return:        RGBA image, shape (ny, nx, 4). Pixels without points are
+                    transparent, and the opacity increases with the number of
+                    points in the pixel
+    """
+    ny, nx = shape
+    xmin, xmax, ymin, ymax = extent
+    ix = np.floor((x - xmin) / (xmax - xmin) * nx).astype(int)
+    iy = np.floor((y - ymin) / (ymax - ymin) * ny).astype(int)
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    pixel = iy[inside] * nx + ix[inside]
+    counts = np.bincount(pixel, minlength=nx * ny)
+    image = np.zeros((nx * ny, 4))
+    for channel in range(3):
+        image[:, channel] = np.bincount(
+            pixel, weights=colors[inside, channel], minlength=nx * ny
+        )
+    filled = counts > 0
+    image[filled, :3] /= counts[filled, None]
+    if np.any(filled):
+        image[filled, 3] = 0.4 + 0.6 * np.log1p(counts[filled]) / np.log1p(counts.max())
+    return image.reshape(ny, nx, 4)
+
+
+class ResidualRenderer:
+    """Persistent matplotlib artists for the residuals in the plk plot"""
+
+    def __init__(self, axes, lod_threshold=LOD_THRESHOLD):
+        """
+        :param axes:            The matplotlib axes to draw in
+        :param lod_threshold:   Maximum number of TOAs in view that are drawn
+                                individually (None = always draw them all)
+        """
+        self.axes = axes
+        self.lod_threshold = lod_threshold
+        self.base = None
+        self.overlay = None
+        self.image = None
+        self.lod = False  # Whether the level-of-detail raster is shown
+        self.npoints = 0  # Number of TOAs shown (individually or in the raster)
+        self._x = self._y = self._yerr = self._colors = None
+        self._shown = self._selected = None
+        self._refreshing = False
+        axes.callbacks.connect("xlim_changed", self._limits_changed)
+        axes.callbacks.connect("ylim_changed", self._limits_changed)
+
+    def clear(self):
+        """Remove all artists from the axes"""
+        for layer in (self.base, self.overlay):
+            if layer is not None:
+                layer.remove()
+        if self.image is not None and self.image.axes is not None:
+            self.image.remove()
+        self.base = self.overlay = self.image = None
+
+    def _ensure_layers(self):
+        # Clearing the axes detaches the artists, so create them again
+        if (
+            self.base is None
+            or self.overlay is None
+            or not (self.base.attached and self.overlay.attached)
+        ):
+            self.clear()
+            self.base = _Layer(self.axes, zorder=2)
+            self.overlay = _Layer(self.axes, zorder=2.5)
+            # Not added with imshow, which would change the limits and aspect
+            self.image = AxesImage(
+                self.axes, origin="lower", interpolation="nearest", zorder=2
+            )
+            self.image.set_data(np.zeros((1, 1, 4)))
+            self.image.set_visible(False)
+            self.axes.add_image(self.image)
+
+    def update(self, x, y, yerr, index, colors, selected, selected_color):
+        """Show the residuals
+
+        :param x:               x-values of all TOAs
+        :param y:               y-values of all TOAs
+        :param yerr:            y-errors of all TOAs (None = no error bars)
+        :param index:           Per TOA, the position of its color in colors.
+                                TOAs with -1 are not shown, unless selected
+        :param colors:          List of colors
+        :param selected:        Boolean array, True = selected TOA
+        :param selected_color:  Color of the selected TOAs
+        :return:                True if any artist changed
+        """
+        self._ensure_layers()
+        self._x, self._y = _plain(x), _plain(y)
+        self._yerr = None if yerr is None else _plain(yerr)
+        self._selected = np.asarray(selected, dtype=bool)
+
+        index = np.asarray(index, dtype=int)
+        palette = np.array([to_rgba(color) for color in colors]).reshape(-1, 4)
+        self._shown = index >= 0
+        self._colors = np.zeros((len(self._x), 4))
+        self._colors[self._shown] = palette[index[self._shown]]
+        self._selected_rgba = to_rgba(selected_color)
+        return self.refresh()
+
+    def _limits_changed(self, axes):
+        if not self._refreshing:
+            self.refresh()
+
+    def _show(self, layer, mask, colors):
+        """Show the TOAs of mask in layer"""
+        return layer.update(
+            self._x[mask],
+            self._y[mask],
+            None if self._yerr is None else self._yerr[mask],
+            colors,
+        )
+
+    def refresh(self):
+        """Update the artists for the current axes limits
+
+        If there are few enough TOAs, the layers hold all of them. Otherwise
+        they only hold the TOAs in view, or a raster is shown if there are too
+        many of those as well.
+
+        :return:    True if any artist changed
+        """
+        if self._x is None or self.base is None or not self.base.attached:
+            return False
+        threshold = np.inf if self.lod_threshold is None else self.lod_threshold
+        base, selected = self._shown, self._selected
+        if (base | selected).sum() > threshold:
+            # Only what is in view (including error bars that reach into it)
+            xmin, xmax = sorted(self.axes.get_xlim())
+            ymin, ymax = sorted(self.axes.get_ylim())
+            yerr = 0 if self._yerr is None else self._yerr
+            inview = (
+                (self._x >= xmin)
+                & (self._x <= xmax)
+                & (self._y + yerr >= ymin)
+                & (self._y - yerr <= ymax)
+            )
+            base, selected = base & inview, selected & inview
+        exact_overlay = selected.sum() <= threshold
+        # Selected points are drawn on top of their base points
+        npoints = int((base | selected).sum())
+        lod = npoints > threshold
+
+        changed = lod != self.lod
+        self.lod = lod
+        self.npoints = npoints
+        self.base.set_visible(not lod)
+        self.overlay.set_visible(exact_overlay)
+        self.image.set_visible(lod)
+        if not lod:
+            changed |= self._show(self.base, base, self._colors[base])
+        if exact_overlay:
+            changed |= self._show(
+                self.overlay, selected, np.tile(self._selected_rgba, (selected.sum(), 1))
+            )
+        if lod:
+            # The selected TOAs are part of the raster if there are too many
+            points = base if exact_overlay else base | selected
+            colors = self._colors[points]
+            if not exact_overlay:
+                colors[selected[points]] = self._selected_rgba
+            bbox = self.axes.bbox
+            shape = (
+                max(1, int(bbox.height / LOD_PIXEL)),
+                max(1, int(bbox.width / LOD_PIXEL)),
+            )
+            extent = self.axes.get_xlim() + self.axes.get_ylim()
+            self._refreshing = True
+            try:
+                self.image.set_data(
+                    density_raster(
+                        self._x[points], self._y[points], colors, extent, shape
+                    )
+                )
+                self.image.set_extent(extent)
+            finally:
+                self._refreshing = False
+            changed = True
+        return changed
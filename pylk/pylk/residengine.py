@@ -0,0 +1,293 @@
+"""Incremental residual engine for pylk.
+
+Evaluating the timing model (all delays, then the phase) is by far the most
+expensive part of computing residuals. Most interactive operations in the plk
+widget do not change the model at all though: deleting or stashing TOAs only
+removes rows, selecting TOAs picks a subset, and phase wraps only change the
+pulse numbers. This module caches the per-TOA model phase, keyed by the TOA
+`index` column, so that those operations only have to slice the cache.
+The model is re-evaluated only when its parameter values or structure change,
+or when the cache is explicitly invalidated (e.g. when jump flags change).
+"""
+import copy
+from collections import OrderedDict
+
+import astropy.units as u
+import numpy as np
+
+from pint.phase import Phase
+from pint.residuals import Residuals
+from pint.utils import weighted_mean
+
+from loguru import logger as log
+
+
+def model_fingerprint(model, params=None):
+    """Return a hashable summary of everything in the model that affects phase
+
+    Frozen flags and uncertainties are left out on purpose: toggling a fit
+    checkbox does not change the model phase. Parameters that are unset or
+    zero are left out as well, so that adding the next (frozen, zero) F, FB or
+    DM derivative after a fit does not count as a model change.
+
+    :param model:   The PINT timing model
+    :param params:  Only include these parameters (None = all parameters)
+    :return:        Tuple that changes whenever the model phase may change
+    """
+    fingerprint = [tuple(model.components)]
+    for name in model.params if params is None else params:
+        par = getattr(model, name)
+        if par.value is None or (np.isscalar(par.value) and par.value == 0):
+            continue
+        key_value = getattr(par, "key_value", None)
+        fingerprint.append(
+            (
+                name,
+                str(par.value),
+                getattr(par, "key", None),
+                tuple(key_value) if key_value is not None else None,
+            )
+        )
+    return tuple(fingerprint)
+
+
+def _plain(values):
+    """Strip the (dimensionless) unit from a Phase component"""
+    return np.asarray(getattr(values, "value", values), dtype=np.longdouble)
+
+
+class _PhaseCache:
+    """Model phase of one model, for a set of TOAs identified by their index"""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.indices = np.zeros(0, dtype=int)
+        self.phase_int = np.zeros(0, dtype=np.longdouble)
+        self.phase_frac = np.zeros(0, dtype=np.longdouble)
+        self.position = np.zeros(0, dtype=int)
+
+    def lookup(self, indices):
+        """Return the cache positions of indices (-1 for missing ones)"""
+        pos = np.full(len(indices), -1, dtype=int)
+        known = indices < len(self.position)
+        pos[known] = self.position[indices[known]]
+        return pos
+
+    def add(self, indices, phase):
+        """Add newly evaluated TOAs to the cache"""
+        self.indices = np.concatenate([self.indices, indices])
+        self.phase_int = np.concatenate([self.phase_int, _plain(phase.int)])
+        self.phase_frac = np.concatenate([self.phase_frac, _plain(phase.frac)])
+        position = np.full(self.indices.max() + 1, -1, dtype=int)
+        position[self.indices] = np.arange(len(self.indices))
+        self.position = position
+
+
+class ResidualEngine:
+    """Cache of the per-TOA model phase, for one or more timing models
+
+    Caches are kept per model object (the pre-fit and post-fit models of a
+    Pulsar usually live side by side), and each one is checked against the
+    model fingerprint before use. Only the `maxmodels` most recently used
+    models are kept.
+    """
+
+    def __init__(self, maxmodels=4, noise_cache=None):
+        """
+        :param maxmodels:   Number of models to keep the phases of
+        :param noise_cache: NoiseCache for the GLS chi2 of models with
+                            correlated noise (None = not cached)
+        """
+        self.maxmodels = maxmodels
+        self.noise_cache = noise_cache
+        self._caches = OrderedDict()
+        self.nevaluated = 0  # Number of TOAs for which the model was evaluated
+        self.nreused = 0  # Number of TOAs taken from the cache
+        self.generation = 0  # Number of times all caches were invalidated
+
+    def invalidate(self, model=None):
+        """Forget the cached phases of model, or of all models if None
+
+        This needs to be called when something changes that is not part of
+        the model fingerprint, like the jump flags in the TOA table.
+        """
+        if model is None:
+            self._caches.clear()
+            self.generation += 1
+        else:
+            self._caches.pop((id(model), True), None)
+            self._caches.pop((id(model), False), None)
+
+    def prime(self, toas, model, phase, abs_phase=None):
+        """Fill the cache with a known model phase, e.g. from disk
+
+        :param toas:        The TOAs that phase belongs to
+        :param model:       The timing model
+        :param phase:       The model phase as a `pint.phase.Phase` object
+        :param abs_phase:   The abs_phase that phase was computed with
+        """
+        key = (id(model), bool(abs_phase))
+        cache = _PhaseCache(model_fingerprint(model))
+        cache.add(np.asarray(toas.table["index"], dtype=int), phase)
+        self._caches[key] = cache
+        self._caches.move_to_end(key)
+        while len(self._caches) > self.maxmodels:
+            self._caches.popitem(last=False)
+
+    def share(self, model, source):
+        """Let model use the cached phases of source, if it has the same phase
+
+        This is for copies of a model, like the one a fitter works on.
+
+        :param model:   The model that will be evaluated
+        :param source:  The model with cached phases
+        """
+        fingerprint = model_fingerprint(model)
+        for abs_phase in (True, False):
+            cache = self._caches.get((id(source), abs_phase), None)
+            if cache is not None and cache.fingerprint == fingerprint:
+                self._caches[(id(model), abs_phase)] = copy.copy(cache)
+                self._caches.move_to_end((id(model), abs_phase))
+        while len(self._caches) > self.maxmodels:
+            self._caches.popitem(last=False)
+
+    def model_phase(self, toas, model, abs_phase=None):
+        """Return the model phase for toas, evaluating only uncached TOAs
+
+        :param toas:        The TOAs for which we need the phase
+        :param model:       The timing model
+        :param abs_phase:   Passed on to `model.phase`
+        :return:            The model phase as a `pint.phase.Phase` object
+        """
+        key = (id(model), bool(abs_phase))
+        cache = self._caches.get(key, None)
+        fingerprint = model_fingerprint(model)
+        if cache is None or cache.fingerprint != fingerprint:
+            cache = _PhaseCache(fingerprint)
+            self._caches[key] = cache
+        self._caches.move_to_end(key)
+        while len(self._caches) > self.maxmodels:
+            self._caches.popitem(last=False)
+
+        indices = np.asarray(toas.table["index"], dtype=int)
+        pos = cache.lookup(indices)
+        missing = pos < 0
+        if np.any(missing):
+            log.debug(f"Evaluating model phase for {missing.sum()} TOAs")
+            subset = toas if np.all(missing) else toas[missing]
+            cache.add(indices[missing], model.phase(subset, abs_phase=abs_phase))
+            # The model may have been changed by the evaluation (a TZR TOA
+            # can be added), and that should not count as a model change
+            cache.fingerprint = model_fingerprint(model)
+            pos = cache.lookup(indices)
+            self.nevaluated += missing.sum()
+        self.nreused += (~missing).sum()
+
+        return Phase(cache.phase_int[pos], cache.phase_frac[pos])
+
+    def compute_pulse_numbers(self, toas, model):
+        """Set the pulse numbers of toas from the cached model phase
+
+        This is the cached equivalent of `TOAs.compute_pulse_numbers`.
+        """
+        if "delta_pulse_number" not in toas.table.colnames:
+            toas.table["delta_pulse_number"] = np.zeros(toas.ntoas)
+        delta_pulse_numbers = Phase(toas.table["delta_pulse_number"])
+        phases = self.model_phase(toas, model, abs_phase=True) + delta_pulse_numbers
+        toas.table["pulse_number"] = phases.int
+        toas.table["pulse_number"].unit = u.dimensionless_unscaled
+
+    def residuals(self, toas, model, **kwargs):
+        """Return a Residuals object for toas and model that uses this cache"""
+        return CachedResiduals(toas, model, engine=self, **kwargs)
+
+
+class CachedResiduals(Residuals):
+    """Residuals that obtain the model phase from a ResidualEngine
+
+    This behaves exactly like `pint.residuals.Residuals`, except that the
+    model phase is looked up in the engine rather than evaluated from scratch.
+    """
+
+    def __new__(cls, toas=None, model=None, engine=None, **kwargs):
+        return super().__new__(cls, toas, model, **kwargs)
+
+    def __init__(self, toas=None, model=None, engine=None, **kwargs):
+        self.engine = engine if engine is not None else ResidualEngine()
+        super().__init__(toas, model, **kwargs)
+
+    def __deepcopy__(self, memo):
+        """Copy the residuals, but not the engine: that is a shared cache"""
+        memo[id(self.engine)] = self.engine
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        for name, value in self.__dict__.items():
+            setattr(copied, name, copy.deepcopy(value, memo))
+        return copied
+
+    def _calc_gls_chi2(self, lognorm=False):
+        """Compute the chi2 with correlated noise, using the noise cache"""
+        if self.engine.noise_cache is None:
+            return super()._calc_gls_chi2(lognorm=lognorm)
+        return self.engine.noise_cache.gls_chi2(
+            self.toas, self.model, self.time_resids.to_value(u.s), lognorm=lognorm
+        )
+
+    def calc_phase_resids(
+        self, subtract_mean=None, use_weighted_mean=None, use_abs_phase=None
+    ):
+        """Compute timing model residuals in pulse phase, using the cache"""
+        if subtract_mean is None:
+            subtract_mean = self.subtract_mean
+        subtract_mean = subtract_mean and "PhaseOffset" not in self.model.components
+
+        if use_weighted_mean is None:
+            use_weighted_mean = self.use_weighted_mean
+
+        if use_abs_phase is None:
+            use_abs_phase = self.use_abs_phase
+
+        if "delta_pulse_number" not in self.toas.table.colnames:
+            self.toas.table["delta_pulse_number"] = np.zeros(self.toas.ntoas)
+        delta_pulse_numbers = Phase(self.toas.table["delta_pulse_number"])
+
+        if self.track_mode == "use_pulse_numbers":
+            pulse_num = self.toas.get_pulse_numbers()
+            if pulse_num is None:
+                raise ValueError(
+                    "Pulse numbers missing from TOAs but track_mode requires them"
+                )
+            if np.any(np.isnan(pulse_num)):
+                raise ValueError("Pulse numbers are missing on some TOAs")
+            modelphase = (
+                self.engine.model_phase(self.toas, self.model, abs_phase=use_abs_phase)
+                + delta_pulse_numbers
+            )
+            residualphase = modelphase - Phase(
+                np.array(pulse_num), np.zeros_like(pulse_num)
+            )
+            full = residualphase.int + residualphase.frac
+
+        elif self.track_mode == "nearest":
+            modelphase = (
+                self.engine.model_phase(self.toas, self.model) + delta_pulse_numbers
+            )
+            if subtract_mean:
+                modelphase -= Phase(modelphase.int[0], modelphase.frac[0])
+            full = np.zeros_like(modelphase.frac) + modelphase.frac
+        else:
+            raise ValueError(f"Invalid track_mode '{self.track_mode}'")
+
+        if not subtract_mean:
+            return full
+        if not use_weighted_mean:
+            mean = full.mean()
+        else:
+            if np.any(self.get_data_error() == 0):
+                raise ValueError(
+                    "Some TOA errors are zero - cannot calculate residuals"
+                )
+            w = 1.0 / (self.get_data_error().value ** 2)
+            mean, err = weighted_mean(full, w)
+
+        return full - mean
@@ -0,0 +1,308 @@
+"""On-disk session cache for pylk.
+
+Opening a pulsar reads the tim file, applies clock corrections, computes the
+TDBs and observatory positions, finds the TOA clusters, and evaluates the
+timing model for the pre-fit residuals. All of that only depends on the
+par/tim file contents and the ephemeris and clock settings, so pylk caches
+the results under a hash of those.
+
+Every cache entry is a directory with one `.npy` file per numeric column of
+the TOA table, which is opened memory-mapped (copy-on-write), so that only
+the pages that are actually used get read. Time columns are stored as their
+two-double `jd1`/`jd2` representation plus the observatory location, and the
+flags and other small objects are pickled. The model phase of the pre-fit
+model is stored as well, so that the pre-fit residuals do not need a model
+evaluation.
+
+Entries are written to a temporary name and then renamed, so that a crash or
+another pylk writing the same entry never leaves a partial one. The cache is
+kept below CACHE_MAX_BYTES by removing the least recently used entries.
+"""
+import contextlib
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import astropy.units as u
+import numpy as np
+from astropy import table
+from astropy.coordinates import EarthLocation
+from astropy.time import Time
+
+import pint
+from pint.phase import Phase
+from pint.toa import TOAs
+
+from loguru import logger as log
+
+
+# Bump this whenever the layout of the cache changes
+CACHE_VERSION = 2
+
+# The least recently used entries are removed when the cache is larger
+CACHE_MAX_BYTES = 2 * 1024**3
+
+# Temporary directories of writes that did not finish are removed after this
+STALE_TMP_SECONDS = 24 * 3600
+
+
+def default_cache_dir():
+    """Return the cache directory ($PYLK_CACHE_DIR, or ~/.cache/pylk)"""
+    cachedir = os.environ.get("PYLK_CACHE_DIR", None)
+    if cachedir is None:
+        cachedir = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pylk"
+        )
+    return cachedir
+
+
+def _tim_files(timfile):
+    """Return the tim file and all files it INCLUDEs, recursively"""
+    files, todo = [], [os.path.abspath(timfile)]
+    while todo:
+        filename = todo.pop(0)
+        if filename in files:
+            continue
+        files.append(filename)
+        with open(filename) as fp:
+            for line in fp:
+                words = line.split()
+                if len(words) > 1 and words[0].upper() == "INCLUDE":
+                    todo.append(
+                        os.path.join(os.path.dirname(filename), words[1])
+                    )
+    return files
+
+
+def session_key(parfile, timfile, model):
+    """Return the cache key for a par/tim combination
+
+    :param parfile: The parfile name
+    :param timfile: The timfile name
+    :param model:   The timing model, which sets the ephemeris and clock
+    :return:        Hexadecimal hash of everything the cached data depends on
+    """
+    h = hashlib.sha256()
+    h.update(f"pylk-cache-{CACHE_VERSION} pint-{pint.__version__}\n".encode())
+    for filename in [parfile] + _tim_files(timfile):
+        with open(filename, "rb") as fp:
+            h.update(hashlib.sha256(fp.read()).digest())
+    for name in ("EPHEM", "CLOCK", "PLANET_SHAPIRO"):
+        par = getattr(model, name, None)
+        h.update(f"{name}={None if par is None else par.value}\n".encode())
+    return h.hexdigest()
+
+
+def _time_rows(column):
+    """Split a column of per-row Time objects into jd1, jd2, scale, location"""
+    rows = list(column)
+    jd1 = np.array([t.jd1 for t in rows], dtype=float)
+    jd2 = np.array([t.jd2 for t in rows], dtype=float)
+    scale = np.array([t.scale for t in rows])
+    loc = np.full((len(rows), 3), np.nan)
+    for i, t in enumerate(rows):
+        location = getattr(t, "location", None)
+        if location is not None:
+            loc[i] = u.Quantity(location.geocentric).to_value(u.m)
+    return jd1, jd2, scale, loc
+
+
+def _make_time_rows(jd1, jd2, scale, loc, fmt, precision):
+    """Re-create per-row Time objects, vectorized per scale and location"""
+    rows = np.empty(len(jd1), dtype=object)
+    keys = np.column_stack([loc, np.zeros(len(jd1))]).astype(str)
+    keys[:, 3] = scale
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    for group in np.unique(inverse):
+        inds = np.flatnonzero(inverse == group)
+        i0 = inds[0]
+        location = (
+            None
+            if np.isnan(loc[i0, 0])
+            else EarthLocation.from_geocentric(*loc[i0], unit=u.m)
+        )
+        times = Time(
+            jd1[inds],
+            jd2[inds],
+            format="jd",
+            scale=scale[i0],
+            location=location,
+            precision=precision,
+        )
+        times.format = fmt
+        for i, ind in enumerate(inds):
+            rows[ind] = times[i]
+    return rows
+
+
+def _dir_size(path):
+    """Return the total size of the files in the directory path"""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class SessionCache:
+    """Cache of loaded TOAs and pre-fit model phases, keyed by session_key
+
+    The cache is kept below maxbytes, by removing the least recently used
+    entries whenever an entry is written.
+    """
+
+    def __init__(self, cachedir=None, maxbytes=CACHE_MAX_BYTES):
+        self.cachedir = default_cache_dir() if cachedir is None else cachedir
+        self.maxbytes = maxbytes
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def load(self, key):
+        """Load the TOAs (and pre-fit model phase, if stored) for key
+
+        :param key: The cache key from session_key
+        :return:    Tuple (toas, phase), or None if key is not in the cache.
+                    The phase is None if it was not stored.
+        """
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, "objects.pkl"), "rb") as fp:
+                objects = pickle.load(fp)
+            columns = []
+            for spec in objects["columns"]:
+                name, kind = spec["name"], spec["kind"]
+                if kind == "flags":
+                    data = np.empty(len(objects["flags"]), dtype=object)
+                    data[:] = objects["flags"]
+                elif kind == "time":
+                    data = _make_time_rows(
+                        *[
+                            np.load(os.path.join(path, f"{name}.{part}.npy"))
+                            for part in ("jd1", "jd2", "scale", "loc")
+                        ],
+                        spec["format"],
+                        spec["precision"],
+                    )
+                else:
+                    data = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+                columns.append(table.Column(data, name=name, unit=spec["unit"], copy=False))
+            # Like unpickling: TOAs(toatable=...) would deep-copy the table
+            toas = TOAs.__new__(TOAs)
+            toas.__dict__.update(objects["attributes"])
+            toas.table = table.Table(columns, meta=objects["meta"], copy=False)
+            toas.was_pickled = True
+            phase = None
+            if os.path.exists(os.path.join(path, "phase.npy")):
+                phase_int, phase_frac = np.load(os.path.join(path, "phase.npy"))
+                phase = Phase(phase_int, phase_frac)
+            # For the least recently used order
+            with contextlib.suppress(OSError):
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Ignoring unreadable session cache {path}: {e}")
+            return None
+        log.info(f"Loaded TOAs from session cache {path}")
+        return toas, phase
+
+    def save(self, key, toas):
+        """Store the TOAs for key (written atomically)"""
+        os.makedirs(self.cachedir, exist_ok=True)
+        tmppath = tempfile.mkdtemp(dir=self.cachedir, prefix=".tmp-")
+        try:
+            specs, objects = [], {"meta": dict(toas.table.meta)}
+            for name in toas.table.colnames:
+                column = toas.table[name]
+                unit = None if column.unit is None else column.unit.to_string()
+                if name == "flags":
+                    specs.append({"name": name, "kind": "flags", "unit": None})
+                    objects["flags"] = [dict(flags) for flags in column]
+                elif column.dtype == object and isinstance(column[0], Time):
+                    parts = _time_rows(column)
+                    for part, data in zip(("jd1", "jd2", "scale", "loc"), parts):
+                        np.save(os.path.join(tmppath, f"{name}.{part}.npy"), data)
+                    specs.append(
+                        {
+                            "name": name,
+                            "kind": "time",
+                            "unit": None,
+                            "format": column[0].format,
+                            "precision": column[0].precision,
+                        }
+                    )
+                else:
+                    np.save(os.path.join(tmppath, f"{name}.npy"), np.asarray(column))
+                    specs.append({"name": name, "kind": "array", "unit": unit})
+            objects["columns"] = specs
+            objects["attributes"] = {
+                attr: value
+                for attr, value in vars(toas).items()
+                if attr not in ("table", "was_pickled")
+            }
+            with open(os.path.join(tmppath, "objects.pkl"), "wb") as fp:
+                pickle.dump(objects, fp)
+            if os.path.exists(self.path(key)):
+                # Written by another pylk in the meantime
+                shutil.rmtree(tmppath, ignore_errors=True)
+            else:
+                os.replace(tmppath, self.path(key))
+        except Exception as e:
+            log.warning(f"Could not write the session cache: {e}")
+            shutil.rmtree(tmppath, ignore_errors=True)
+        else:
+            log.debug(f"Wrote session cache {self.path(key)}")
+            self.trim(keep=key)
+
+    def save_phase(self, key, phase):
+        """Store the pre-fit model phase for the TOAs of key (written atomically)"""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return
+        fd, tmpname = tempfile.mkstemp(dir=path, prefix=".tmp-", suffix=".npy")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                np.save(
+                    fp,
+                    np.array(
+                        [np.asarray(phase.int), np.asarray(phase.frac)], dtype=np.longdouble
+                    ),
+                )
+            os.replace(tmpname, os.path.join(path, "phase.npy"))
+        except Exception as e:
+            log.warning(f"Could not write the model phase to the session cache: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmpname)
+
+    def trim(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is below
+        maxbytes, and temporary directories of writes that did not finish
+
+        :param keep:    Key of an entry that is never removed
+        """
+        if not os.path.isdir(self.cachedir):
+            return
+        entries, now = [], time.time()
+        for entry in os.scandir(self.cachedir):
+            if not entry.is_dir():
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.startswith("."):
+                    if now - mtime > STALE_TMP_SECONDS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                entries.append((mtime, _dir_size(entry.path), entry))
+            except FileNotFoundError:
+                # Removed by another pylk in the meantime
+                continue
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, entry in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.maxbytes:
+                break
+            if entry.name == keep:
+                continue
+            log.debug(f"Removing session cache {entry.path}")
+            shutil.rmtree(entry.path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,87 @@
+"""Lightweight views on a subset of TOAs.
+
+Selecting TOAs in the plk widget used to deep-copy the full TOAs object,
+including the astropy table and the per-TOA flag dictionaries. A TOAView only
+stores a boolean mask over the full TOAs. Cheap queries (the number of TOAs,
+their MJDs) are answered from the mask directly, and a real TOAs object is
+only created when it is needed, e.g. to construct a fitter.
+"""
+import copy
+
+import numpy as np
+
+
+class TOAView:
+    """A mask-backed selection of TOAs
+
+    An empty or all-True mask selects all TOAs, in which case the full TOAs
+    object itself is used without making any copy. Attributes that are not
+    part of the view are looked up on the materialized TOAs, so a view can be
+    used in most places where a TOAs object is expected.
+    """
+
+    def __init__(self, toas, mask=None):
+        """Create a view on toas
+
+        :param toas:    The full `pint.toa.TOAs` object
+        :param mask:    Boolean array, True = selected toa (None = all)
+        """
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if len(mask) != toas.ntoas:
+                raise ValueError(
+                    f"Selection mask has length {len(mask)} for {toas.ntoas} TOAs"
+                )
+            if np.all(mask) or not np.any(mask):
+                mask = None
+        self.base = toas
+        self.mask = mask
+        self._toas = None
+        self._table = None
+
+    @property
+    def is_all(self):
+        """True if this view selects all TOAs"""
+        return self.mask is None
+
+    @property
+    def ntoas(self):
+        return self.base.ntoas if self.mask is None else int(self.mask.sum())
+
+    def __len__(self):
+        return self.ntoas
+
+    def get_mjds(self, high_precision=False):
+        mjds = self.base.get_mjds(high_precision=high_precision)
+        return mjds if self.mask is None else mjds[self.mask]
+
+    @property
+    def toas(self):
+        """The selected TOAs as a `pint.toa.TOAs` object
+
+        The table rows are copied, but the flag dictionaries are shared with
+        the full TOAs. The result is cached until the table of the full TOAs
+        is replaced, or until `invalidate` is called.
+        """
+        if self.mask is None:
+            return self.base
+        if self._toas is None or self._table is not self.base.table:
+            self._toas = copy.copy(self.base)
+            self._toas.table = self.base.table[self.mask]
+            self._table = self.base.table
+        return self._toas
+
+    @property
+    def table(self):
+        return self.toas.table
+
+    def invalidate(self):
+        """Forget the materialized TOAs, e.g. after columns of the base changed"""
+        self._toas = None
+        self._table = None
+
+    def __getattr__(self, name):
+        # Guard against recursion while copying/unpickling, before __init__
+        if name.startswith("_") or "base" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.toas, name)
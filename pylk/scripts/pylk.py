@@ -36,6 +36,7 @@ import pint
 from pylk import constants
 from pylk.pulsar import Pulsar
 from pylk.plk import PlkWidget
+from pylk.plotview import plot_backends
 from pylk.opensomething import OpenSomethingWidget
 
 
@@ -60,15 +61,23 @@ class PylkWindow(QMainWindow):
         fitter="auto",
         ephem=None,
         loglevel=None,
+        undo_budget=None,
+        usecache=True,
+        plot_backend="matplotlib",
         **kwargs,
     ):
         super().__init__(parent)
 
+        self.usecache = usecache
+        self.plot_backend = plot_backend
+
         self.initUI()
 
         self.createJupyterKernel()
 
         self.createPlkWidget()
+        if undo_budget is not None:
+            self.plkWidget.undo_budget = undo_budget
         self.createJupyterWidget()
         self.createOpenSomethingWidget()
 
@@ -255,7 +264,7 @@ class PylkWindow(QMainWindow):
     def createPlkWidget(self):
         """Create the Plk widget"""
 
-        self.plkWidget = PlkWidget(parent=self.mainFrame)
+        self.plkWidget = PlkWidget(parent=self.mainFrame, plot_backend=self.plot_backend)
         self.plkWidget.hide()
 
     def toggleJupyter(self):
@@ -460,7 +469,13 @@ class PylkWindow(QMainWindow):
 
         # Open a PINT pulsar here
 
-        self.psr = Pulsar(parfilename, timfilename, ephem=None, fitter="WLSFitter")
+        self.psr = Pulsar(
+            parfilename,
+            timfilename,
+            ephem=None,
+            fitter="WLSFitter",
+            usecache=self.usecache,
+        )
 
         # From pintk
         # This is a way to set callbacks ('updates') from the main window
@@ -538,8 +553,8 @@ def main():
     parser = argparse.ArgumentParser(
         description="Pylk: Qt interface for PINT pulsar timing tool"
     )
-    parser.add_argument("parfile", help="parfile to use")
-    parser.add_argument("timfile", help="timfile to use")
+    parser.add_argument("parfile", nargs="?", help="parfile to use")
+    parser.add_argument("timfile", nargs="?", help="timfile to use")
     parser.add_argument("--ephem", help="Ephemeris to use", default=None)
     parser.add_argument(
         "--test",
@@ -566,6 +581,54 @@ def main():
         default="auto",
         help="PINT Fitter to use [default='auto'].  'auto' will choose WLS/GLS/WidebandTOA depending on TOA/model properties.  'downhill' will do the same for Downhill versions.",
     )
+    parser.add_argument(
+        "--undo-budget",
+        type=float,
+        default=32.0,
+        help="Memory budget of the undo/revert history, in MB [default=32]",
+    )
+    parser.add_argument(
+        "--plot-backend",
+        choices=plot_backends,
+        default="matplotlib",
+        help="Library that draws the residual plot [default=matplotlib]. pyqtgraph pans and zooms faster on large data sets",
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Do not use the on-disk session cache ($PYLK_CACHE_DIR or ~/.cache/pylk)",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run headless: load, fit, and export all par/tim pairs listed in FILE (one pair per line)",
+        default=None,
+    )
+    parser.add_argument(
+        "--outdir",
+        help="Output directory for --batch [default=current directory]",
+        default=".",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for --batch [default=number of CPUs]",
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=4,
+        help="Number of fit iterations for --batch [default=4]",
+    )
+    parser.add_argument(
+        "--no-plots",
+        help="Do not save residual plots in --batch mode",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -597,6 +660,29 @@ def main():
             parsed_args.quiet)
     )
 
+    if parsed_args.batch is not None:
+        # Headless: no QApplication, no kernel, no widgets
+        from pylk.batch import read_batch_file, run_batch, print_batch_summary
+
+        results = run_batch(
+            read_batch_file(parsed_args.batch),
+            parsed_args.outdir,
+            workers=parsed_args.workers,
+            loglevel=pint.logging.get_level(
+                parsed_args.loglevel, parsed_args.verbosity, parsed_args.quiet
+            ),
+            ephem=parsed_args.ephem,
+            fitter=parsed_args.fitter,
+            iters=parsed_args.iters,
+            usecache=not parsed_args.no_cache,
+            plot=not parsed_args.no_plots,
+        )
+        print_batch_summary(results)
+        sys.exit(1 if any(result["error"] is not None for result in results) else 0)
+
+    if parsed_args.parfile is None or parsed_args.timfile is None:
+        parser.error("the parfile and timfile are required (unless using --batch)")
+
     # Create the actual application
     qt_args = sys.argv[:1] + unparsed_args
     app = QApplication(qt_args)
@@ -609,7 +695,10 @@ def main():
                 timfile=parsed_args.timfile,
                 fitter=parsed_args.fitter,
                 ephem=parsed_args.ephem,
-                loglevel=parsed_args.loglevel
+                loglevel=parsed_args.loglevel,
+                undo_budget=int(parsed_args.undo_budget * 1024**2),
+                usecache=not parsed_args.no_cache,
+                plot_backend=parsed_args.plot_backend,
             )
 
     pylkwin.raise_()        # Required on OSX to move the app to the foreground (Is that true?)